@@ -25,8 +25,13 @@
 #     """
 #     return a * b
 
+import os
+import time
+
 from typing_extensions import Annotated, TypedDict
 
+from tool_dispatcher import ToolCallingRunner, ToolRegistry
+
 
 class add(TypedDict):
     """Add two integers."""
@@ -45,12 +50,53 @@ class multiply(TypedDict):
 
 tools = [add, multiply]
 
-from langchain_openai import ChatOpenAI
+######################################################################
+# ツールの実装の登録
+# TypedDictのツールは引数のスキーマだけなので、実装をToolRegistryに登録する
+# 引数の検証器は登録時に1回だけ作成される(tool_dispatcher.py)
+# templateを指定したツールは、モデルを呼び直さずに結果から回答を作る
+######################################################################
+registry = ToolRegistry()
+registry.register(add, lambda a, b: a + b, template="{a} + {b} = {result}")
+registry.register(multiply, lambda a, b: a * b, template="{a} * {b} = {result}")
+
+######################################################################
+# モデルの初期化
+# CHAT_MODEL=fakeの場合はAPIを呼ばないFakeToolCallingChatModel(fake_chat_model.py)を使う
+######################################################################
+if os.getenv("CHAT_MODEL") == "fake":
+    from fake_chat_model import FakeToolCallingChatModel
+
+    llm = FakeToolCallingChatModel(latency=float(os.getenv("FAKE_MODEL_LATENCY", "0.3")))
+else:
+    from langchain_openai import ChatOpenAI
 
-llm = ChatOpenAI(model="gpt-4o-mini")
+    llm = ChatOpenAI(model="gpt-4o-mini")
 
 llm_with_tools = llm.bind_tools(tools)
 
 query = "What is 3 * 12?"
 
-print(llm_with_tools.invoke(query))
+ai_msg = llm_with_tools.invoke(query)
+print(ai_msg)
+
+######################################################################
+# ツール呼び出しの実行
+# モデルが返したtool_callsをプロセス内で実行し、ToolMessageを得る
+######################################################################
+for tool_message in registry.dispatch(ai_msg.tool_calls):
+    print(tool_message)
+
+######################################################################
+# 質問から回答まで
+# add/multiplyは決定的なツールなので、2回目のモデル呼び出しなしで回答する
+# batch()は複数の質問のモデル呼び出しをまとめて実行し、同じ計算は1回だけ行う
+######################################################################
+runner = ToolCallingRunner(llm_with_tools, registry)
+print(runner.invoke(query).content)
+
+queries = [f"What is {i} * 12? And {i} + 7?" for i in range(1, 11)]
+start = time.perf_counter()
+for answer in runner.batch(queries, max_concurrency=5):
+    print(answer.content.replace("\n", " / "))
+print(f"{len(queries)} queries in {time.perf_counter() - start:.2f}s {runner.stats()}")
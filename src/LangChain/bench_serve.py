@@ -0,0 +1,340 @@
+######################################################################
+# Serving with LangServe
+# bench_serve.py
+# serve.pyの負荷試験・レイテンシ計測
+#
+# ChatOpenAIをローカルのFakeChatModel(fake_chat_model.py)に差し替えて
+# serve.pyのアプリを別プロセスで起動し、APIを呼ばずに計測する
+#
+# - エンドポイント : /chain/invoke, /chain/batch, /chain/stream
+# - ドライバ       : remote (client.pyと同じRemoteRunnable) / http (生のHTTP)
+# - 同時実行数     : --rampで指定した値に順に増やしながら計測
+# - 計測値         : スループット、p50/p95/p99レイテンシ、最初のトークンまでの時間
+# - 結果           : JSONで保存し、--compareで以前の結果と比較できる
+#
+# 実行例)
+# python bench_serve.py --ramp 1,8,32 --requests 200 --latency 0.2 --tokens-per-second 50
+# python bench_serve.py --compare bench_results/serve-old.json
+######################################################################
+import argparse
+import asyncio
+import itertools
+import json
+import math
+import os
+import subprocess
+import sys
+import time
+from datetime import datetime, timezone
+
+import httpx
+
+ENDPOINTS = ("invoke", "batch", "stream")
+DRIVERS = ("remote", "http")
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="serve.pyの負荷試験")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--ramp", default="1,4,16,64", help="同時実行数(カンマ区切り)")
+    parser.add_argument("--requests", type=int, default=200, help="同時実行数ごとのリクエスト数")
+    parser.add_argument("--batch-size", type=int, default=8, help="/chain/batchの1リクエストあたりの件数")
+    parser.add_argument("--endpoints", default=",".join(ENDPOINTS))
+    parser.add_argument("--drivers", default=",".join(DRIVERS))
+    parser.add_argument("--latency", type=float, default=0.2, help="FakeChatModelの最初のトークンまでの時間(秒)")
+    parser.add_argument("--tokens-per-second", type=float, default=50.0, help="FakeChatModelの生成速度")
+    parser.add_argument("--text-words", type=int, default=8, help="翻訳するテキストの単語数")
+    parser.add_argument("--repeat", action="store_true", help="同じテキストを繰り返し送る(キャッシュ込みで計測)")
+    parser.add_argument("--output", help="結果のJSONの保存先")
+    parser.add_argument("--compare", help="比較する以前の結果のJSON")
+    parser.add_argument("--serve", action="store_true", help=argparse.SUPPRESS)
+    return parser.parse_args(argv)
+
+
+######################################################################
+# サーバー側
+# --serveを指定した場合はFakeChatModelに差し替えたアプリを起動する
+# serve.pyの設定(SERVE_MODEなど)は環境変数からそのまま読み込む
+######################################################################
+def serve_fake(args) -> None:
+    import uvicorn
+
+    from fake_chat_model import FakeChatModel
+    from serve import create_app
+    from serve_settings import ServeSettings
+
+    settings = ServeSettings.from_env()
+    model = FakeChatModel(latency=args.latency, tokens_per_second=args.tokens_per_second)
+    app = create_app(settings, model=model)
+    uvicorn.run(app, host=args.host, port=args.port, log_level="warning")
+
+
+def start_server(args) -> subprocess.Popen:
+    command = [
+        sys.executable, os.path.abspath(__file__), "--serve",
+        "--host", args.host, "--port", str(args.port),
+        "--latency", str(args.latency), "--tokens-per-second", str(args.tokens_per_second),
+    ]
+    process = subprocess.Popen(command, cwd=os.path.dirname(os.path.abspath(__file__)))
+    url = f"http://{args.host}:{args.port}/chain/input_schema"
+    deadline = time.monotonic() + 60
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError("ベンチマーク用サーバーの起動に失敗しました")
+        try:
+            if httpx.get(url, timeout=1).status_code == 200:
+                return process
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.2)
+    process.terminate()
+    raise RuntimeError("ベンチマーク用サーバーが起動しませんでした")
+
+
+######################################################################
+# クライアント側(ドライバ)
+# 各関数は (レイテンシ, 最初のトークンまでの時間) を秒で返す
+######################################################################
+class RemoteDriver:
+    def __init__(self, base_url: str):
+        from langserve import RemoteRunnable
+
+        self.chain = RemoteRunnable(base_url + "/chain/")
+
+    async def invoke(self, input):
+        start = time.perf_counter()
+        await self.chain.ainvoke(input)
+        elapsed = time.perf_counter() - start
+        return elapsed, elapsed
+
+    async def batch(self, inputs):
+        start = time.perf_counter()
+        await self.chain.abatch(inputs)
+        elapsed = time.perf_counter() - start
+        return elapsed, elapsed
+
+    async def stream(self, input):
+        start = time.perf_counter()
+        first = None
+        async for _ in self.chain.astream(input):
+            if first is None:
+                first = time.perf_counter() - start
+        elapsed = time.perf_counter() - start
+        return elapsed, first if first is not None else elapsed
+
+    async def aclose(self):
+        pass
+
+
+class HttpDriver:
+    def __init__(self, base_url: str, max_connections: int):
+        self.base_url = base_url
+        self.client = httpx.AsyncClient(
+            timeout=None, limits=httpx.Limits(max_connections=max_connections)
+        )
+
+    async def invoke(self, input):
+        start = time.perf_counter()
+        response = await self.client.post(self.base_url + "/chain/invoke", json={"input": input})
+        response.raise_for_status()
+        elapsed = time.perf_counter() - start
+        return elapsed, elapsed
+
+    async def batch(self, inputs):
+        start = time.perf_counter()
+        response = await self.client.post(self.base_url + "/chain/batch", json={"inputs": inputs})
+        response.raise_for_status()
+        elapsed = time.perf_counter() - start
+        return elapsed, elapsed
+
+    async def stream(self, input):
+        start = time.perf_counter()
+        first = None
+        async with self.client.stream(
+            "POST", self.base_url + "/chain/stream", json={"input": input}
+        ) as response:
+            response.raise_for_status()
+            async for line in response.aiter_lines():
+                if line.startswith("event: error"):
+                    raise RuntimeError("stream error")
+                if first is None and line.startswith("event: data"):
+                    first = time.perf_counter() - start
+        elapsed = time.perf_counter() - start
+        return elapsed, first if first is not None else elapsed
+
+    async def aclose(self):
+        await self.client.aclose()
+
+
+######################################################################
+# 集計
+######################################################################
+def percentile(values, p):
+    if not values:
+        return None
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, math.ceil(p / 100.0 * len(ordered)) - 1))
+    return ordered[index]
+
+
+def summarize(values):
+    if not values:
+        return None
+    return {
+        "mean": sum(values) / len(values) * 1000.0,
+        "p50": percentile(values, 50) * 1000.0,
+        "p95": percentile(values, 95) * 1000.0,
+        "p99": percentile(values, 99) * 1000.0,
+        "max": max(values) * 1000.0,
+    }
+
+
+async def run_level(driver, endpoint, concurrency, args, counter):
+    words = " ".join(f"word{i}" for i in range(max(args.text_words - 1, 0)))
+
+    def make_input():
+        n = 0 if args.repeat else next(counter)
+        return {"language": "italian", "text": f"text{n} {words}".strip()}
+
+    latencies, ttfts, errors = [], [], 0
+    remaining = iter(range(args.requests))
+
+    async def worker():
+        nonlocal errors
+        for _ in remaining:
+            try:
+                if endpoint == "batch":
+                    result = await driver.batch([make_input() for _ in range(args.batch_size)])
+                else:
+                    result = await getattr(driver, endpoint)(make_input())
+            except Exception:
+                errors += 1
+                continue
+            latencies.append(result[0])
+            ttfts.append(result[1])
+
+    start = time.perf_counter()
+    await asyncio.gather(*[worker() for _ in range(concurrency)])
+    elapsed = time.perf_counter() - start
+    items = len(latencies) * (args.batch_size if endpoint == "batch" else 1)
+    return {
+        "endpoint": endpoint,
+        "concurrency": concurrency,
+        "requests": args.requests,
+        "errors": errors,
+        "elapsed_s": elapsed,
+        "throughput_rps": len(latencies) / elapsed if elapsed else 0.0,
+        "throughput_items_per_s": items / elapsed if elapsed else 0.0,
+        "latency_ms": summarize(latencies),
+        "ttft_ms": summarize(ttfts) if endpoint == "stream" else None,
+    }
+
+
+async def run_benchmark(args):
+    base_url = f"http://{args.host}:{args.port}"
+    ramp = [int(c) for c in args.ramp.split(",") if c]
+    counter = itertools.count()
+    results = []
+    for driver_name in args.drivers.split(","):
+        for endpoint in args.endpoints.split(","):
+            for concurrency in ramp:
+                if driver_name == "remote":
+                    driver = RemoteDriver(base_url)
+                else:
+                    driver = HttpDriver(base_url, max_connections=concurrency)
+                try:
+                    result = await run_level(driver, endpoint, concurrency, args, counter)
+                finally:
+                    await driver.aclose()
+                result["driver"] = driver_name
+                results.append(result)
+                print_result(result)
+    return results
+
+
+def print_result(result):
+    latency = result["latency_ms"] or {}
+    ttft = result["ttft_ms"] or {}
+    print(
+        f"{result['driver']:>6} {result['endpoint']:>6} c={result['concurrency']:<4} "
+        f"{result['throughput_rps']:8.1f} req/s  "
+        f"p50={latency.get('p50', 0):7.1f}ms p95={latency.get('p95', 0):7.1f}ms "
+        f"p99={latency.get('p99', 0):7.1f}ms"
+        + (f"  ttft p50={ttft['p50']:7.1f}ms" if ttft else "")
+        + (f"  errors={result['errors']}" if result["errors"] else "")
+    )
+
+
+######################################################################
+# 結果の保存と比較
+######################################################################
+def git_commit():
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "--short", "HEAD"],
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+            stderr=subprocess.DEVNULL,
+            text=True,
+        ).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def save_results(args, results):
+    commit = git_commit()
+    report = {
+        "commit": commit,
+        "timestamp": datetime.now(timezone.utc).isoformat(),
+        "settings": {
+            key: getattr(args, key)
+            for key in ("ramp", "requests", "batch_size", "latency", "tokens_per_second", "text_words", "repeat")
+        },
+        "env": {k: v for k, v in os.environ.items() if k.startswith(("SERVE_", "CHAIN_", "TRANSLATION_CACHE_"))},
+        "results": results,
+    }
+    path = args.output or os.path.join(
+        "bench_results", f"serve-{commit or datetime.now().strftime('%Y%m%d%H%M%S')}.json"
+    )
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    with open(path, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"saved: {path}")
+    return report
+
+
+def compare(baseline_path, results):
+    with open(baseline_path) as f:
+        baseline = json.load(f)
+    previous = {(r["driver"], r["endpoint"], r["concurrency"]): r for r in baseline["results"]}
+    print(f"compare with {baseline_path} (commit {baseline.get('commit')})")
+    for result in results:
+        old = previous.get((result["driver"], result["endpoint"], result["concurrency"]))
+        if old is None or not old["latency_ms"] or not result["latency_ms"]:
+            continue
+        throughput = (result["throughput_rps"] / old["throughput_rps"] - 1) * 100 if old["throughput_rps"] else 0.0
+        p95 = (result["latency_ms"]["p95"] / old["latency_ms"]["p95"] - 1) * 100
+        print(
+            f"{result['driver']:>6} {result['endpoint']:>6} c={result['concurrency']:<4} "
+            f"throughput {throughput:+6.1f}%  p95 {p95:+6.1f}%"
+        )
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    if args.serve:
+        serve_fake(args)
+        return
+    process = start_server(args)
+    try:
+        results = asyncio.run(run_benchmark(args))
+    finally:
+        process.terminate()
+        process.wait()
+    save_results(args, results)
+    if args.compare:
+        compare(args.compare, results)
+
+
+if __name__ == "__main__":
+    main()
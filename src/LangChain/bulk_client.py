@@ -0,0 +1,304 @@
+######################################################################
+# Serving with LangServe
+# bulk_client.py
+# serve.pyを使って大量の文字列をまとめて翻訳するクライアント
+#
+# - 入力     : JSONL/CSV(language, textの列)を1行ずつ読み込む(全体をメモリに載せない)
+# - 重複排除 : 同じ(language, text)は1回だけ翻訳し、結果を使い回す
+# - 送信     : RemoteRunnable.abatchを同時実行数の上限つきで呼び出す
+#              バッチサイズはレイテンシとエラーに応じて自動で増減する
+# - 出力     : 入力と同じ順番でJSONLに書き出す(完了したものから順次)
+# - 再開     : 進捗を"<出力ファイル>.ckpt"(SQLite)に記録し、
+#              中断した場合は続きから再開する
+#              翻訳に失敗した行("error")は書き出すが、進捗は最初に失敗した行の手前までしか
+#              進めないため、再実行するとその行から翻訳し直す(翻訳済みの結果は使い回す)
+#              languageかtextがないレコードは"error"の行にして進める(再実行しても同じため)
+######################################################################
+import asyncio
+import collections
+import csv
+import json
+import os
+import sqlite3
+import sys
+import time
+from typing import Iterator, Optional
+
+from translation_cache import normalize_key
+
+
+######################################################################
+# 入力の読み込み
+# 拡張子(.csv / それ以外はJSONL)で形式を判定する
+######################################################################
+def read_records(path: str) -> Iterator[dict]:
+    with open(path, newline="", encoding="utf-8") as f:
+        if path.endswith(".csv"):
+            yield from csv.DictReader(f)
+        else:
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+
+
+class InvalidRecord(ValueError):
+    pass
+
+
+def record_input(record) -> dict:
+    # 翻訳の入力(language, text)を取り出す。ない場合はInvalidRecord
+    if not isinstance(record, dict):
+        raise InvalidRecord("record must be an object with 'language' and 'text'")
+    missing = [field for field in ("language", "text") if not isinstance(record.get(field), str)]
+    if missing:
+        raise InvalidRecord(f"missing field: {', '.join(missing)}")
+    return {"language": record["language"], "text": record["text"]}
+
+
+######################################################################
+# チェックポイント(SQLite)
+# meta    -> 書き出し済みの件数と出力ファイルのバイト数
+# results -> 翻訳済みの結果(重複排除と再開時の再利用に使う)
+######################################################################
+class Checkpoint:
+    def __init__(self, path: str):
+        self._conn = sqlite3.connect(path)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value INTEGER)")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS results (key TEXT PRIMARY KEY, value TEXT)")
+        self._conn.commit()
+
+    def progress(self) -> tuple[int, int]:
+        rows = dict(self._conn.execute("SELECT key, value FROM meta").fetchall())
+        return rows.get("written", 0), rows.get("output_bytes", 0)
+
+    def get_result(self, key: str) -> Optional[str]:
+        row = self._conn.execute("SELECT value FROM results WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else None
+
+    def put_results(self, items: list[tuple[str, str]]) -> None:
+        self._conn.executemany("INSERT OR REPLACE INTO results (key, value) VALUES (?, ?)", items)
+
+    def commit(self, written: int, output_bytes: int) -> None:
+        self._conn.executemany(
+            "INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)",
+            [("written", written), ("output_bytes", output_bytes)],
+        )
+        self._conn.commit()
+
+    def close(self) -> None:
+        self._conn.commit()
+        self._conn.close()
+
+
+######################################################################
+# バッチサイズの自動調整
+# 目標レイテンシより速ければ1件ずつ増やし、遅ければ3/4に、
+# エラーの場合は半分に減らす
+######################################################################
+class AdaptiveBatchSize:
+    def __init__(self, initial: int = 8, minimum: int = 1, maximum: int = 128, target_latency: float = 5.0):
+        self.size = initial
+        self.minimum = minimum
+        self.maximum = maximum
+        self.target_latency = target_latency
+
+    def record(self, latency: float, error: bool = False) -> None:
+        if error:
+            self.size = max(self.minimum, self.size // 2)
+        elif latency < self.target_latency:
+            self.size = min(self.maximum, self.size + 1)
+        elif latency > self.target_latency * 1.5:
+            self.size = max(self.minimum, int(self.size * 0.75))
+
+
+class BulkTranslator:
+    def __init__(
+        self,
+        url: str = "http://localhost:8001/chain/",
+        concurrency: int = 4,
+        batch_size: AdaptiveBatchSize = None,
+        max_retries: int = 3,
+        checkpoint_every: int = 1000,
+        linger: float = 0.01,
+    ):
+        from langserve import RemoteRunnable
+
+        self.remote_chain = RemoteRunnable(url)
+        self.concurrency = concurrency
+        self.batch_size = batch_size or AdaptiveBatchSize()
+        self.max_retries = max_retries
+        self.checkpoint_every = checkpoint_every
+        self.linger = linger
+        self.stats = {
+            "read": 0, "skipped": 0, "duplicates": 0, "translated": 0, "errors": 0, "invalid": 0, "batches": 0,
+        }
+
+    ##################################################################
+    # 翻訳の実行
+    # input_path  -> 入力ファイル(JSONL/CSV)
+    # output_path -> 出力ファイル(JSONL)。各行は入力のレコードに"output"を追加したもの
+    ##################################################################
+    async def run(self, input_path: str, output_path: str) -> dict:
+        checkpoint = Checkpoint(output_path + ".ckpt")
+        written, output_bytes = checkpoint.progress()
+        self.stats["skipped"] = written
+
+        # 前回の最後のチェックポイント以降に書き出した行は破棄する
+        mode = "r+b" if os.path.exists(output_path) else "wb"
+        output = open(output_path, mode)
+        output.truncate(output_bytes)
+        output.seek(output_bytes)
+
+        window = self.concurrency * self.batch_size.maximum * 2
+        ordered: collections.deque = collections.deque()
+        pending: dict[str, asyncio.Future] = {}
+        queue: collections.deque = collections.deque()
+        slots = asyncio.Semaphore(window)
+        new_item = asyncio.Event()
+        reading_done = False
+        loop = asyncio.get_running_loop()
+
+        ##############################################################
+        # 読み込み
+        # 結果が未確定の件数がwindowを超えないように待ちながら読み込む
+        ##############################################################
+        async def reader():
+            nonlocal reading_done
+            for index, record in enumerate(read_records(input_path)):
+                if index < written:
+                    continue
+                await slots.acquire()
+                self.stats["read"] += 1
+                try:
+                    input = record_input(record)
+                except InvalidRecord as e:
+                    self.stats["invalid"] += 1
+                    future = loop.create_future()
+                    future.set_exception(e)
+                    ordered.append((record, future))
+                    continue
+                key = normalize_key(input["language"], input["text"], "", "")
+                future = pending.get(key)
+                if future is not None:
+                    self.stats["duplicates"] += 1
+                else:
+                    future = loop.create_future()
+                    result = checkpoint.get_result(key)
+                    if result is not None:
+                        self.stats["duplicates"] += 1
+                        future.set_result(result)
+                    else:
+                        pending[key] = future
+                        queue.append((key, input))
+                        new_item.set()
+                ordered.append((record, future))
+            reading_done = True
+            new_item.set()
+
+        ##############################################################
+        # 送信
+        # キューからバッチサイズ分を取り出してabatchで送る
+        ##############################################################
+        async def send(batch):
+            keys = [key for key, _ in batch]
+            inputs = [input for _, input in batch]
+            for attempt in range(self.max_retries + 1):
+                start = time.monotonic()
+                try:
+                    outputs = await self.remote_chain.abatch(inputs)
+                except Exception as e:
+                    self.batch_size.record(time.monotonic() - start, error=True)
+                    if attempt == self.max_retries:
+                        for key in keys:
+                            pending.pop(key).set_exception(e)
+                        self.stats["errors"] += len(keys)
+                        return
+                    await asyncio.sleep(min(2 ** attempt, 30))
+                    continue
+                self.batch_size.record(time.monotonic() - start)
+                self.stats["batches"] += 1
+                self.stats["translated"] += len(keys)
+                checkpoint.put_results(list(zip(keys, outputs)))
+                for key, value in zip(keys, outputs):
+                    pending.pop(key).set_result(value)
+                return
+
+        async def sender():
+            tasks = set()
+            limit = asyncio.Semaphore(self.concurrency)
+            while True:
+                if not queue:
+                    if reading_done:
+                        break
+                    new_item.clear()
+                    await new_item.wait()
+                    continue
+                # 読み込み中でバッチが埋まっていない場合は少しだけ待ってから送る
+                if len(queue) < self.batch_size.size and not reading_done:
+                    await asyncio.sleep(self.linger)
+                await limit.acquire()
+                batch = [queue.popleft() for _ in range(min(self.batch_size.size, len(queue)))]
+                task = asyncio.ensure_future(send(batch))
+                tasks.add(task)
+                task.add_done_callback(lambda t: (tasks.discard(t), limit.release()))
+            if tasks:
+                await asyncio.gather(*tasks)
+
+        ##############################################################
+        # 書き出し
+        # 入力の順番を守り、先頭の結果が確定したものから書き出す
+        # 翻訳に失敗した行があれば、進捗はその行の手前(retry_from)までにする
+        ##############################################################
+        retry_from: Optional[tuple[int, int]] = None
+
+        def commit():
+            output.flush()
+            checkpoint.commit(*(retry_from or (written, output.tell())))
+
+        async def writer():
+            nonlocal written, retry_from
+            since_checkpoint = 0
+            while ordered or not reading_done:
+                if not ordered:
+                    await asyncio.sleep(0.01)
+                    continue
+                record, future = ordered[0]
+                if not isinstance(record, dict):
+                    record = {"record": record}
+                try:
+                    record = {**record, "output": await future}
+                except InvalidRecord as e:
+                    record = {**record, "error": str(e)}
+                except Exception as e:
+                    record = {**record, "error": str(e)}
+                    if retry_from is None:
+                        retry_from = (written, output.tell())
+                ordered.popleft()
+                slots.release()
+                output.write((json.dumps(record, ensure_ascii=False) + "\n").encode("utf-8"))
+                written += 1
+                since_checkpoint += 1
+                if since_checkpoint >= self.checkpoint_every:
+                    commit()
+                    since_checkpoint = 0
+                    self.report(written)
+
+        try:
+            await asyncio.gather(reader(), sender(), writer())
+        finally:
+            commit()
+            output.close()
+            checkpoint.close()
+            # イベントループを閉じる前にRemoteRunnableの接続を閉じておく
+            await self.remote_chain.async_client.aclose()
+        self.report(written)
+        return dict(self.stats, written=written, retry_from=retry_from[0] if retry_from else None)
+
+    def report(self, written: int) -> None:
+        print(
+            f"written={written} translated={self.stats['translated']} "
+            f"duplicates={self.stats['duplicates']} errors={self.stats['errors']} invalid={self.stats['invalid']} "
+            f"batch_size={self.batch_size.size}",
+            file=sys.stderr,
+        )
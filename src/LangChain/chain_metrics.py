@@ -0,0 +1,299 @@
+######################################################################
+# Serving with LangServe
+# chain_metrics.py
+# serve.pyのchainのステージ別計測とPrometheus形式での公開
+#
+# 計測する値(routeはマウント先とエンドポイント。例: /chain/invoke)
+# - chain_request_duration_seconds      : リクエスト全体の処理時間
+# - chain_queue_wait_seconds            : リクエスト受信からchain開始までの待ち時間
+#                                         (マイクロバッチの待ち、同時実行数の制限による待ち)
+# - chain_stage_duration_seconds        : ステージ(prompt/model/parser/chain)ごとの処理時間
+# - chain_time_to_first_token_seconds   : リクエスト受信から最初のトークンまでの時間
+# - chain_tokens_total                  : 入力/出力トークン数
+#
+# 計測はコールバック(run_inline=True)とASGIミドルウェアで行い、
+# 1回あたりの処理は辞書操作とbisect程度に抑えている
+#
+# マイクロバッチ(micro_batch.py)・single-flight(single_flight.py)でまとめて実行した場合、
+# ステージの処理時間・待ち時間・最初のトークンまでの時間は、まとめた実行を開始した
+# リクエストのrouteと受信時刻で記録される(single-flightで相乗りしたリクエストの分は記録されない)
+# リクエストごとの値はchain_request_duration_secondsを使う
+######################################################################
+import bisect
+import contextvars
+import threading
+import time
+from typing import Any, Callable, Optional
+from uuid import UUID
+
+from langchain_core.callbacks import BaseCallbackHandler
+
+DEFAULT_BUCKETS = (
+    0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05,
+    0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0,
+)
+
+# ミドルウェアで設定し、コールバックから参照する
+_route: contextvars.ContextVar[str] = contextvars.ContextVar("chain_route", default="")
+_request_start: contextvars.ContextVar[Optional[float]] = contextvars.ContextVar(
+    "chain_request_start", default=None
+)
+
+# chainの各ステージの名前
+STAGE_NAMES = {
+    "RunnableSequence": "chain",
+    "ChatPromptTemplate": "prompt",
+    "PromptTemplate": "prompt",
+    "StrOutputParser": "parser",
+}
+
+
+class Histogram:
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+class ChainMetrics:
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = buckets
+        self._lock = threading.Lock()
+        self._histograms: dict[tuple[str, tuple], Histogram] = {}
+        self._counters: dict[tuple[str, tuple], float] = {}
+        self._help: dict[str, tuple[str, str]] = {}
+        self._collectors: list[tuple[str, Callable[[], dict]]] = []
+        self.handler = MetricsCallbackHandler(self)
+
+    def observe(self, name: str, value: float, **labels: str) -> None:
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = Histogram(self.buckets)
+            histogram.observe(value)
+
+    def inc(self, name: str, value: float = 1.0, **labels: str) -> None:
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0.0) + value
+
+    def describe(self, name: str, help: str, type: str) -> None:
+        self._help[name] = (help, type)
+
+    ##################################################################
+    # 他のコンポーネントの統計(キャッシュのヒット数など)を公開する
+    # stats()の数値の項目を "{prefix}_{key}" のgaugeとして出力する
+    ##################################################################
+    def register_stats(self, prefix: str, stats: Callable[[], dict]) -> None:
+        self._collectors.append((prefix, stats))
+
+    def render(self) -> str:
+        lines = []
+        with self._lock:
+            histograms = sorted(
+                ((k, (list(h.counts), h.sum, h.count)) for k, h in self._histograms.items()),
+                key=lambda item: item[0],
+            )
+            counters = sorted(self._counters.items())
+        described = set()
+
+        def header(name, default_type):
+            if name in described:
+                return
+            described.add(name)
+            help, type = self._help.get(name, (name, default_type))
+            lines.append(f"# HELP {name} {help}")
+            lines.append(f"# TYPE {name} {type}")
+
+        for (name, labels), (counts, total, count) in histograms:
+            header(name, "histogram")
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += bucket_count
+                le = "+Inf" if bound == float("inf") else repr(bound)
+                lines.append(f"{name}_bucket{_labels(labels + (('le', le),))} {cumulative}")
+            lines.append(f"{name}_sum{_labels(labels)} {total}")
+            lines.append(f"{name}_count{_labels(labels)} {count}")
+        for (name, labels), value in counters:
+            header(name, "counter")
+            lines.append(f"{name}{_labels(labels)} {value}")
+        for prefix, stats in self._collectors:
+            for key, value in stats().items():
+                if isinstance(value, bool) or not isinstance(value, (int, float)):
+                    continue
+                name = f"{prefix}_{key}"
+                header(name, "gauge")
+                lines.append(f"{name} {value}")
+        return "\n".join(lines) + "\n"
+
+
+######################################################################
+# ASGIミドルウェア
+# chainのエンドポイントへのリクエストのrouteと受信時刻をcontextvarに設定し、
+# レスポンスの送信完了までの時間を計測する(ストリーミングの場合も最後まで)
+# routeは"<マウント先>/<エンドポイント>"で、パスをそのまま使わないことでラベルの種類を
+# 固定する(LangServeの/chain/c/<設定>/invokeなども/chain/invokeにまとめる)
+# prefixes -> add_routesのpath(計測するマウント先)
+######################################################################
+CHAIN_ENDPOINTS = ("invoke", "batch", "stream", "stream_log", "stream_events")
+
+
+def route_label(path: str, prefixes: tuple[str, ...]) -> Optional[str]:
+    endpoint = path.rstrip("/").rsplit("/", 1)[-1]
+    if endpoint not in CHAIN_ENDPOINTS:
+        return None
+    for prefix in prefixes:
+        if path.startswith(prefix.rstrip("/") + "/"):
+            return f"{prefix.rstrip('/')}/{endpoint}"
+    return None
+
+
+class MetricsMiddleware:
+    def __init__(self, app, metrics: ChainMetrics, prefixes: tuple[str, ...] = ("/chain",)):
+        self.app = app
+        self.metrics = metrics
+        self.prefixes = tuple(prefixes)
+
+    async def __call__(self, scope, receive, send):
+        path = route_label(scope["path"], self.prefixes) if scope["type"] == "http" else None
+        if path is None:
+            return await self.app(scope, receive, send)
+        status = [500]
+
+        async def send_with_status(message):
+            if message["type"] == "http.response.start":
+                status[0] = message["status"]
+            await send(message)
+
+        start = time.perf_counter()
+        route_token = _route.set(path)
+        start_token = _request_start.set(start)
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            _route.reset(route_token)
+            _request_start.reset(start_token)
+            self.metrics.inc("chain_requests_total", route=path, status=str(status[0]))
+            self.metrics.observe(
+                "chain_request_duration_seconds", time.perf_counter() - start, route=path
+            )
+
+
+def _escape(value: Any) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _labels(labels: tuple) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{key}="{_escape(value)}"' for key, value in labels) + "}"
+
+
+######################################################################
+# chainの各ステージの計測を行うコールバック
+# run_inline=Trueにして、非同期実行時もスレッドプールを経由せずに呼ばれるようにする
+######################################################################
+class MetricsCallbackHandler(BaseCallbackHandler):
+    run_inline = True
+
+    def __init__(self, metrics: ChainMetrics):
+        self.metrics = metrics
+        # run_id -> (ステージ名, 開始時刻, route, 最初のトークンを受信済みか)
+        self._runs: dict[UUID, list] = {}
+
+    def _start(self, run_id: UUID, stage: str) -> None:
+        self._runs[run_id] = [stage, time.perf_counter(), _route.get(), False]
+
+    def _end(self, run_id: UUID, error: bool = False) -> Optional[list]:
+        run = self._runs.pop(run_id, None)
+        if run is None:
+            return None
+        stage, start, route, _ = run
+        self.metrics.observe(
+            "chain_stage_duration_seconds", time.perf_counter() - start, route=route, stage=stage
+        )
+        if error:
+            self.metrics.inc("chain_stage_errors_total", route=route, stage=stage)
+        return run
+
+    def on_chain_start(
+        self, serialized: Optional[dict], inputs: Any, *, run_id: UUID,
+        parent_run_id: Optional[UUID] = None, **kwargs: Any,
+    ) -> None:
+        # 最上位のrun(LangServeではrun名がパスになる)はchain全体として扱う
+        if parent_run_id is None:
+            self._start(run_id, "chain")
+        else:
+            name = kwargs.get("name") or (serialized or {}).get("name") or "chain"
+            self._start(run_id, STAGE_NAMES.get(name, name))
+        if parent_run_id is None:
+            request_start = _request_start.get()
+            if request_start is not None:
+                self.metrics.observe(
+                    "chain_queue_wait_seconds",
+                    time.perf_counter() - request_start,
+                    route=_route.get(),
+                )
+
+    def on_chain_end(self, outputs: Any, *, run_id: UUID, **kwargs: Any) -> None:
+        self._end(run_id)
+
+    def on_chain_error(self, error: BaseException, *, run_id: UUID, **kwargs: Any) -> None:
+        self._end(run_id, error=True)
+
+    def on_chat_model_start(
+        self, serialized: Optional[dict], messages: Any, *, run_id: UUID, **kwargs: Any
+    ) -> None:
+        self._start(run_id, "model")
+
+    def on_llm_start(
+        self, serialized: Optional[dict], prompts: Any, *, run_id: UUID, **kwargs: Any
+    ) -> None:
+        self._start(run_id, "model")
+
+    def on_llm_new_token(self, token: str, *, run_id: UUID, **kwargs: Any) -> None:
+        run = self._runs.get(run_id)
+        if run is None or run[3]:
+            return
+        run[3] = True
+        request_start = _request_start.get()
+        if request_start is not None:
+            self.metrics.observe(
+                "chain_time_to_first_token_seconds",
+                time.perf_counter() - request_start,
+                route=run[2],
+            )
+
+    def on_llm_end(self, response: Any, *, run_id: UUID, **kwargs: Any) -> None:
+        run = self._end(run_id)
+        if run is None:
+            return
+        route = run[2]
+        for generations in response.generations:
+            for generation in generations:
+                usage = getattr(getattr(generation, "message", None), "usage_metadata", None)
+                if usage:
+                    self.metrics.inc("chain_tokens_total", usage["input_tokens"], route=route, direction="in")
+                    self.metrics.inc("chain_tokens_total", usage["output_tokens"], route=route, direction="out")
+
+    def on_llm_error(self, error: BaseException, *, run_id: UUID, **kwargs: Any) -> None:
+        self._end(run_id, error=True)
+
+
+def create_metrics() -> ChainMetrics:
+    metrics = ChainMetrics()
+    metrics.describe("chain_request_duration_seconds", "Request latency per route.", "histogram")
+    metrics.describe("chain_queue_wait_seconds", "Time from request arrival to chain start.", "histogram")
+    metrics.describe("chain_stage_duration_seconds", "Latency per chain stage.", "histogram")
+    metrics.describe("chain_time_to_first_token_seconds", "Time from request arrival to first model token.", "histogram")
+    metrics.describe("chain_tokens_total", "Model tokens in/out.", "counter")
+    metrics.describe("chain_requests_total", "Requests per route and status.", "counter")
+    metrics.describe("chain_stage_errors_total", "Errors per chain stage.", "counter")
+    return metrics
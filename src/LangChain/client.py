@@ -2,10 +2,52 @@
 # Serving with LangServe
 # client.py
 # 実行方法に関してはREADMEを参照
+#
+# 引数なしで実行した場合は1件だけ翻訳する
+# --input/--outputを指定した場合はファイルの内容をまとめて翻訳する(bulk_client.py)
+#
+# 実行例)
+# python client.py
+# python client.py --input strings.jsonl --output translated.jsonl --concurrency 8
 ######################################################################
+import argparse
+import asyncio
 
 from langserve import RemoteRunnable
 
-remote_chain = RemoteRunnable("http://localhost:8001/chain/")
-result = remote_chain.invoke({"language": "italian", "text": "hi"})
-print(result)
\ No newline at end of file
+URL = "http://localhost:8001/chain/"
+
+
+def main():
+    parser = argparse.ArgumentParser(description="serve.pyのクライアント")
+    parser.add_argument("--url", default=URL)
+    parser.add_argument("--input", help="入力ファイル(JSONL/CSV、language/textの列)")
+    parser.add_argument("--output", help="出力ファイル(JSONL)")
+    parser.add_argument("--concurrency", type=int, default=4, help="同時に送るバッチの数")
+    parser.add_argument("--batch-size", type=int, default=8, help="バッチサイズの初期値")
+    parser.add_argument("--max-batch-size", type=int, default=128, help="バッチサイズの上限")
+    parser.add_argument("--target-latency", type=float, default=5.0, help="1バッチの目標レイテンシ(秒)")
+    args = parser.parse_args()
+
+    if not args.input:
+        remote_chain = RemoteRunnable(args.url)
+        result = remote_chain.invoke({"language": "italian", "text": "hi"})
+        print(result)
+        return
+
+    from bulk_client import AdaptiveBatchSize, BulkTranslator
+
+    translator = BulkTranslator(
+        url=args.url,
+        concurrency=args.concurrency,
+        batch_size=AdaptiveBatchSize(
+            initial=args.batch_size,
+            maximum=args.max_batch_size,
+            target_latency=args.target_latency,
+        ),
+    )
+    asyncio.run(translator.run(args.input, args.output or args.input + ".out.jsonl"))
+
+
+if __name__ == "__main__":
+    main()
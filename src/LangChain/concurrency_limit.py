@@ -0,0 +1,96 @@
+######################################################################
+# Serving with LangServe
+# concurrency_limit.py
+# chainの同時実行数を制限し、実行中のリクエスト数を管理する
+#
+# - max_concurrency -> 同時に実行するchainの最大数(Noneの場合は無制限)
+#                      上限を超えたリクエストは空きが出るまで待つ
+# - abatch()        -> マイクロバッチ(micro_batch.py)のまとめた実行は1つの枠で実行する
+# - drain()         -> 終了時に実行中のリクエスト(ストリーミングを含む)が
+#                      全て終わるまで待つ
+######################################################################
+import asyncio
+import contextlib
+from typing import Any, AsyncIterator, Optional, Union
+
+from langchain_core.runnables import Runnable, RunnableConfig
+
+from runnable_wrapper import DelegatingRunnable
+
+
+class ConcurrencyLimitRunnable(DelegatingRunnable):
+    def __init__(self, bound: Runnable, max_concurrency: Optional[int] = None):
+        super().__init__(bound)
+        self.max_concurrency = max_concurrency
+        self._semaphore = asyncio.Semaphore(max_concurrency) if max_concurrency else None
+        self._in_flight = 0
+        self._waiting = 0
+        self._idle = asyncio.Event()
+        self._idle.set()
+
+    @contextlib.asynccontextmanager
+    async def _slot(self):
+        self._in_flight += 1
+        self._idle.clear()
+        try:
+            if self._semaphore is None:
+                yield
+            else:
+                self._waiting += 1
+                try:
+                    await self._semaphore.acquire()
+                finally:
+                    self._waiting -= 1
+                try:
+                    yield
+                finally:
+                    self._semaphore.release()
+        finally:
+            self._in_flight -= 1
+            if self._in_flight == 0:
+                self._idle.set()
+
+    async def ainvoke(
+        self, input: Any, config: Optional[RunnableConfig] = None, **kwargs: Any
+    ) -> Any:
+        async with self._slot():
+            return await self.bound.ainvoke(input, config, **kwargs)
+
+    ##################################################################
+    # まとめて実行(マイクロバッチ)
+    # バッチ全体で1つの枠を使い、元のchainのabatchにそのまま渡す
+    # (Runnable.abatchのように1件ずつainvokeに分けない)
+    ##################################################################
+    async def abatch(
+        self,
+        inputs: list[Any],
+        config: Optional[Union[RunnableConfig, list[RunnableConfig]]] = None,
+        *,
+        return_exceptions: bool = False,
+        **kwargs: Any,
+    ) -> list[Any]:
+        if not inputs:
+            return []
+        async with self._slot():
+            return await self.bound.abatch(inputs, config, return_exceptions=return_exceptions, **kwargs)
+
+    async def astream(
+        self, input: Any, config: Optional[RunnableConfig] = None, **kwargs: Any
+    ) -> AsyncIterator[Any]:
+        async with self._slot():
+            async for chunk in self.bound.astream(input, config, **kwargs):
+                yield chunk
+
+    async def drain(self, timeout: Optional[float] = None) -> bool:
+        try:
+            await asyncio.wait_for(self._idle.wait(), timeout)
+            return True
+        except asyncio.TimeoutError:
+            return False
+
+    def stats(self) -> dict:
+        return {
+            "max_concurrency": self.max_concurrency,
+            "in_flight": self._in_flight,
+            "waiting": self._waiting,
+        }
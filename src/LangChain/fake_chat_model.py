@@ -0,0 +1,191 @@
+######################################################################
+# fake_chat_model.py
+# ベンチマーク・動作確認用のローカルなチャットモデル
+#
+# APIを呼ばずに、決まった応答を返す(同じ入力には常に同じ応答)
+# - latency           -> 最初のトークンを返すまでの時間(秒)
+# - tokens_per_second -> トークンの生成速度(0以下の場合は待たない)
+# - tail_rate         -> tail_latency(秒)だけ余分に遅れる確率(遅いリクエストの再現用)
+# - error_rate        -> 例外(RuntimeError)を送出する確率(プロバイダの障害の再現用)
+#
+# 応答は "[言語] 入力テキスト" のような翻訳風の文字列
+#
+# FakeToolCallingChatModel -> bind_toolsに対応したモデル(07.pyの動作確認用)
+#                             "3 * 12"のような式をadd/multiplyのツール呼び出しにし、
+#                             ツールの結果を受け取ったら "The answer is 結果" と答える
+######################################################################
+import asyncio
+import random
+import re
+import time
+import uuid
+from typing import Any, AsyncIterator, Iterator, List, Optional, Sequence
+
+from langchain_core.callbacks import (
+    AsyncCallbackManagerForLLMRun,
+    CallbackManagerForLLMRun,
+)
+from langchain_core.language_models import BaseChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk, BaseMessage, ToolMessage
+from langchain_core.messages.ai import UsageMetadata
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+from langchain_core.utils.function_calling import convert_to_openai_tool
+
+
+class FakeChatModel(BaseChatModel):
+    model_name: str = "fake-translator"
+    latency: float = 0.0
+    tokens_per_second: float = 0.0
+    tail_rate: float = 0.0
+    tail_latency: float = 0.0
+    error_rate: float = 0.0
+
+    @property
+    def _llm_type(self) -> str:
+        return "fake-chat-model"
+
+    def _first_token_delay(self) -> float:
+        # 最初のトークンまでの時間(error_rateの確率で例外を送出する)
+        if self.error_rate and random.random() < self.error_rate:
+            raise RuntimeError(f"{self.model_name}: simulated provider error")
+        if self.tail_rate and random.random() < self.tail_rate:
+            return self.latency + self.tail_latency
+        return self.latency
+
+    ##################################################################
+    # 応答の生成
+    # systemメッセージの末尾の単語を言語名とみなし、最後のメッセージの
+    # テキストを単語単位のトークンに分割して返す
+    ##################################################################
+    def _reply_tokens(self, messages: List[BaseMessage]) -> List[str]:
+        system = next((m.content for m in messages if m.type == "system"), "")
+        words = str(system).rstrip(":").split()
+        language = words[-1] if words else "echo"
+        text = str(messages[-1].content) if messages else ""
+        reply = f"[{language}] {text}"
+        tokens = reply.split(" ")
+        return [token if i == 0 else " " + token for i, token in enumerate(tokens)]
+
+    def _usage(self, messages: List[BaseMessage], tokens: List[str]) -> UsageMetadata:
+        input_tokens = sum(len(str(m.content).split()) for m in messages)
+        return UsageMetadata(
+            input_tokens=input_tokens,
+            output_tokens=len(tokens),
+            total_tokens=input_tokens + len(tokens),
+        )
+
+    def _token_delay(self) -> float:
+        return 1.0 / self.tokens_per_second if self.tokens_per_second > 0 else 0.0
+
+    def _generate(
+        self,
+        messages: List[BaseMessage],
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[CallbackManagerForLLMRun] = None,
+        **kwargs: Any,
+    ) -> ChatResult:
+        tokens = self._reply_tokens(messages)
+        time.sleep(self._first_token_delay() + self._token_delay() * len(tokens))
+        message = AIMessage(
+            content="".join(tokens), usage_metadata=self._usage(messages, tokens)
+        )
+        return ChatResult(generations=[ChatGeneration(message=message)])
+
+    async def _agenerate(
+        self,
+        messages: List[BaseMessage],
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[AsyncCallbackManagerForLLMRun] = None,
+        **kwargs: Any,
+    ) -> ChatResult:
+        tokens = self._reply_tokens(messages)
+        await asyncio.sleep(self._first_token_delay() + self._token_delay() * len(tokens))
+        message = AIMessage(
+            content="".join(tokens), usage_metadata=self._usage(messages, tokens)
+        )
+        return ChatResult(generations=[ChatGeneration(message=message)])
+
+    def _stream(
+        self,
+        messages: List[BaseMessage],
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[CallbackManagerForLLMRun] = None,
+        **kwargs: Any,
+    ) -> Iterator[ChatGenerationChunk]:
+        tokens = self._reply_tokens(messages)
+        time.sleep(self._first_token_delay())
+        for i, token in enumerate(tokens):
+            if i:
+                time.sleep(self._token_delay())
+            usage = self._usage(messages, tokens) if i == len(tokens) - 1 else None
+            chunk = ChatGenerationChunk(
+                message=AIMessageChunk(content=token, usage_metadata=usage)
+            )
+            if run_manager:
+                run_manager.on_llm_new_token(token, chunk=chunk)
+            yield chunk
+
+    async def _astream(
+        self,
+        messages: List[BaseMessage],
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[AsyncCallbackManagerForLLMRun] = None,
+        **kwargs: Any,
+    ) -> AsyncIterator[ChatGenerationChunk]:
+        tokens = self._reply_tokens(messages)
+        await asyncio.sleep(self._first_token_delay())
+        for i, token in enumerate(tokens):
+            if i:
+                await asyncio.sleep(self._token_delay())
+            usage = self._usage(messages, tokens) if i == len(tokens) - 1 else None
+            chunk = ChatGenerationChunk(
+                message=AIMessageChunk(content=token, usage_metadata=usage)
+            )
+            if run_manager:
+                await run_manager.on_llm_new_token(token, chunk=chunk)
+            yield chunk
+
+
+_EXPRESSION = re.compile(r"(-?\d+)\s*([*x×+])\s*(-?\d+)")
+_OPERATORS = {"*": "multiply", "x": "multiply", "×": "multiply", "+": "add"}
+
+
+class FakeToolCallingChatModel(FakeChatModel):
+    model_name: str = "fake-tool-caller"
+    tool_names: List[str] = []
+
+    def bind_tools(self, tools: Sequence[Any], **kwargs: Any) -> "FakeToolCallingChatModel":
+        names = [convert_to_openai_tool(tool)["function"]["name"] for tool in tools]
+        return self.model_copy(update={"tool_names": names})
+
+    def _reply(self, messages: List[BaseMessage]) -> AIMessage:
+        last = messages[-1]
+        if isinstance(last, ToolMessage):
+            results = [m.content for m in messages if isinstance(m, ToolMessage)]
+            return AIMessage(f"The answer is {', '.join(results)}")
+        tool_calls = [
+            {"name": _OPERATORS[op], "args": {"a": int(a), "b": int(b)}, "id": f"call_{uuid.uuid4().hex[:12]}"}
+            for a, op, b in _EXPRESSION.findall(str(last.content))
+            if _OPERATORS[op] in self.tool_names
+        ]
+        return AIMessage("" if tool_calls else str(last.content), tool_calls=tool_calls)
+
+    def _generate(
+        self,
+        messages: List[BaseMessage],
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[CallbackManagerForLLMRun] = None,
+        **kwargs: Any,
+    ) -> ChatResult:
+        time.sleep(self._first_token_delay())
+        return ChatResult(generations=[ChatGeneration(message=self._reply(messages))])
+
+    async def _agenerate(
+        self,
+        messages: List[BaseMessage],
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[AsyncCallbackManagerForLLMRun] = None,
+        **kwargs: Any,
+    ) -> ChatResult:
+        await asyncio.sleep(self._first_token_delay())
+        return ChatResult(generations=[ChatGeneration(message=self._reply(messages))])
@@ -0,0 +1,94 @@
+######################################################################
+# Serving with LangServe
+# micro_batch.py
+# 同時に届いたリクエストをまとめてchain.abatchで実行する
+#
+# window_ms      -> 最初のリクエストが届いてからまとめて待つ時間(ミリ秒)
+# max_batch_size -> この件数に達したら待たずに実行する
+# max_concurrency-> abatch内で同時に実行する最大数
+#
+# 結果(例外を含む)はそれぞれの呼び出し元に返される
+# ストリーミング(astream)はまとめずにそのまま元のchainに委譲する
+######################################################################
+import asyncio
+from typing import Any, Optional
+
+from langchain_core.runnables import Runnable, RunnableConfig, ensure_config
+
+from runnable_wrapper import DelegatingRunnable
+
+
+class MicroBatchRunnable(DelegatingRunnable):
+    def __init__(
+        self,
+        bound: Runnable,
+        window_ms: float = 10.0,
+        max_batch_size: int = 32,
+        max_concurrency: Optional[int] = None,
+    ):
+        super().__init__(bound)
+        self.window = window_ms / 1000.0
+        self.max_batch_size = max_batch_size
+        self.max_concurrency = max_concurrency
+        self._pending: list[tuple[Any, RunnableConfig, asyncio.Future]] = []
+        self._timer: Optional[asyncio.TimerHandle] = None
+        # 実行中のバッチ(タスクの参照を持っておかないと、実行中にGCされることがある)
+        self._tasks: set[asyncio.Task] = set()
+        self._stats = {"requests": 0, "batches": 0, "max_batch": 0}
+
+    async def ainvoke(
+        self, input: Any, config: Optional[RunnableConfig] = None, **kwargs: Any
+    ) -> Any:
+        # 追加の引数がある呼び出しはまとめられないのでそのまま実行する
+        if kwargs:
+            return await self.bound.ainvoke(input, config, **kwargs)
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._pending.append((input, ensure_config(config), future))
+        if len(self._pending) >= self.max_batch_size:
+            self._flush()
+        elif self._timer is None:
+            self._timer = loop.call_later(self.window, self._flush)
+        return await future
+
+    ##################################################################
+    # 溜まったリクエストを取り出してバッチ実行を開始する
+    ##################################################################
+    def _flush(self) -> None:
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        batch, self._pending = self._pending, []
+        if batch:
+            task = asyncio.ensure_future(self._run(batch))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    async def _run(self, batch: list[tuple[Any, RunnableConfig, asyncio.Future]]) -> None:
+        self._stats["requests"] += len(batch)
+        self._stats["batches"] += 1
+        self._stats["max_batch"] = max(self._stats["max_batch"], len(batch))
+        inputs = [item[0] for item in batch]
+        configs = [
+            {**item[1], "max_concurrency": self.max_concurrency} for item in batch
+        ]
+        try:
+            outputs = await self.bound.abatch(inputs, configs, return_exceptions=True)
+        except Exception as e:
+            outputs = [e] * len(batch)
+        for (_, _, future), output in zip(batch, outputs):
+            # 呼び出し元が既に切断(キャンセル)している場合は何もしない
+            if future.done():
+                continue
+            if isinstance(output, Exception):
+                future.set_exception(output)
+            else:
+                future.set_result(output)
+
+    def stats(self) -> dict:
+        stats = dict(self._stats)
+        stats["avg_batch"] = stats["requests"] / stats["batches"] if stats["batches"] else 0.0
+        stats["window_ms"] = self.window * 1000.0
+        stats["max_batch_size"] = self.max_batch_size
+        stats["max_concurrency"] = self.max_concurrency
+        return stats
@@ -0,0 +1,456 @@
+######################################################################
+# model_router.py
+# 複数のモデルプロバイダ(ChatOpenAI / ChatAnthropicなど)を1つのRunnableとして扱い、
+# リクエストごとにその時点で最も速い正常なプロバイダに送る
+#
+# - プロバイダごとに直近window件の成功時のレイテンシと成否を記録する
+# - 送り先は正常なプロバイダのうちp50の小さい順(記録がないプロバイダは最初に試す)
+#   エラー率がerror_thresholdを超えたプロバイダは、最後の失敗からcooldown秒の間は
+#   後回しにする(その後は1件ずつ試して、成功すれば元に戻る)
+# - ヘッジ: 送り先のp(hedge_quantile)(記録が少ない間はhedge_after秒)を過ぎても
+#   応答がない場合は、次のプロバイダにも同じリクエストを送り、先に成功した方を返す
+#   ainvokeでは負けた方をキャンセルし、送り先だった場合は失敗として記録する
+#   (invokeではスレッドを止められないため結果を捨てる。時間は実行が始まってから数える)
+# - 失敗した場合は次のプロバイダに送り直す(フェイルオーバー)
+# - stream / astreamは最初のチャンクを受け取る前に失敗した場合だけ次のプロバイダに送る
+# - bind_toolsは各プロバイダにツールを結び付けたルーターを返す(統計は共有する)
+#
+# 使用例)
+# router = ModelRouter({"openai": ChatOpenAI(model="gpt-4o-mini"),
+#                       "anthropic": ChatAnthropic(model="claude-3-5-sonnet-20240620")})
+# chain = prompt_template | router | parser
+#
+# python model_router.py --requests 200   # FakeChatModelでヘッジの有無を比較する
+######################################################################
+import argparse
+import asyncio
+import os
+import re
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Any, AsyncIterator, Iterator, Optional
+
+from langchain_core.runnables import Runnable, RunnableConfig
+
+
+class _ProviderStats:
+    def __init__(self, window: int):
+        self.latencies: deque = deque(maxlen=window)
+        self.outcomes: deque = deque(maxlen=window)
+        self.requests = 0
+        self.errors = 0
+        self.last_failure = 0.0
+
+    def success(self, latency: float) -> None:
+        self.requests += 1
+        self.latencies.append(latency)
+        self.outcomes.append(True)
+
+    def failure(self) -> None:
+        self.requests += 1
+        self.errors += 1
+        self.outcomes.append(False)
+        self.last_failure = time.monotonic()
+
+    def quantile(self, q: float, min_samples: int = 1) -> Optional[float]:
+        if len(self.latencies) < min_samples:
+            return None
+        ordered = sorted(self.latencies)
+        return ordered[min(int(q * len(ordered)), len(ordered) - 1)]
+
+    @property
+    def error_rate(self) -> float:
+        return self.outcomes.count(False) / len(self.outcomes) if self.outcomes else 0.0
+
+
+class _RouterState:
+    # bind_toolsで作ったルーターとも共有する統計
+    def __init__(self, names: list[str], window: int):
+        self.lock = threading.Lock()
+        self.providers = {name: _ProviderStats(window) for name in names}
+        self.counters = {"requests": 0, "hedged": 0, "hedge_wins": 0, "failovers": 0}
+
+    def count(self, name: str) -> None:
+        with self.lock:
+            self.counters[name] += 1
+
+
+class ModelRouter(Runnable):
+    ##################################################################
+    # providers       -> {名前: チャットモデル}(順序は記録がない時の優先順位)
+    # hedge           -> Falseの場合はヘッジしない
+    # hedge_quantile  -> ヘッジするまでの時間に使うレイテンシの分位点
+    # hedge_after     -> 記録がmin_samples件未満の間のヘッジするまでの時間(秒)
+    # window          -> プロバイダごとに記録する直近の件数
+    # min_samples     -> 分位点を使い始める記録の件数
+    # error_threshold -> このエラー率を超えたプロバイダは後回しにする
+    # cooldown        -> 後回しにする時間(秒)
+    # max_workers     -> invokeでヘッジする場合に使うスレッド数
+    ##################################################################
+    def __init__(
+        self,
+        providers: dict[str, Runnable],
+        hedge: bool = True,
+        hedge_quantile: float = 0.95,
+        hedge_after: float = 2.0,
+        window: int = 100,
+        min_samples: int = 20,
+        error_threshold: float = 0.5,
+        cooldown: float = 30.0,
+        max_workers: int = 64,
+        _state: Optional[_RouterState] = None,
+    ):
+        if not providers:
+            raise ValueError("ModelRouter needs at least one provider")
+        self.providers = dict(providers)
+        self.hedge = hedge
+        self.hedge_quantile = hedge_quantile
+        self.hedge_after = hedge_after
+        self.window = window
+        self.min_samples = min_samples
+        self.error_threshold = error_threshold
+        self.cooldown = cooldown
+        self.max_workers = max_workers
+        self._state = _state or _RouterState(list(self.providers), window)
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self.name = "ModelRouter"
+
+    @classmethod
+    def from_env(cls, providers: dict[str, Runnable]) -> "ModelRouter":
+        return cls(
+            providers,
+            hedge=os.getenv("ROUTER_HEDGE", "true").lower() not in ("0", "false", "no", "off"),
+            hedge_quantile=float(os.getenv("ROUTER_HEDGE_QUANTILE", "0.95")),
+            hedge_after=float(os.getenv("ROUTER_HEDGE_AFTER", "2.0")),
+            window=int(os.getenv("ROUTER_WINDOW", "100")),
+            error_threshold=float(os.getenv("ROUTER_ERROR_THRESHOLD", "0.5")),
+            cooldown=float(os.getenv("ROUTER_COOLDOWN", "30")),
+            max_workers=int(os.getenv("ROUTER_MAX_WORKERS", "64")),
+        )
+
+    @property
+    def InputType(self) -> Any:
+        return next(iter(self.providers.values())).InputType
+
+    @property
+    def OutputType(self) -> Any:
+        return next(iter(self.providers.values())).OutputType
+
+    def bind_tools(self, tools: Any, **kwargs: Any) -> "ModelRouter":
+        providers = {name: model.bind_tools(tools, **kwargs) for name, model in self.providers.items()}
+        return ModelRouter(
+            providers,
+            hedge=self.hedge,
+            hedge_quantile=self.hedge_quantile,
+            hedge_after=self.hedge_after,
+            window=self.window,
+            min_samples=self.min_samples,
+            error_threshold=self.error_threshold,
+            cooldown=self.cooldown,
+            max_workers=self.max_workers,
+            _state=self._state,
+        )
+
+    ##################################################################
+    # 送り先の順序
+    ##################################################################
+    def _healthy(self, stats: _ProviderStats, now: float) -> bool:
+        return stats.error_rate <= self.error_threshold or now - stats.last_failure >= self.cooldown
+
+    def order(self) -> list[str]:
+        now = time.monotonic()
+        with self._state.lock:
+            ranked = []
+            for position, name in enumerate(self.providers):
+                stats = self._state.providers[name]
+                p50 = stats.quantile(0.5)
+                ranked.append((not self._healthy(stats, now), p50 if p50 is not None else 0.0, position, name))
+        return [name for *_, name in sorted(ranked)]
+
+    def _deadline(self, name: str) -> float:
+        with self._state.lock:
+            deadline = self._state.providers[name].quantile(self.hedge_quantile, self.min_samples)
+        return deadline if deadline is not None else self.hedge_after
+
+    def _record(self, name: str, latency: Optional[float]) -> None:
+        with self._state.lock:
+            stats = self._state.providers[name]
+            if latency is None:
+                stats.failure()
+            else:
+                stats.success(latency)
+
+    ##################################################################
+    # 同期版
+    # ヘッジしたリクエストはスレッドプールで実行する
+    # ヘッジまでの時間はプールの待ち時間を含めないよう、startedがセットされてから数える
+    ##################################################################
+    def _call(
+        self,
+        name: str,
+        input: Any,
+        config: Optional[RunnableConfig],
+        kwargs: dict,
+        started: Optional[threading.Event] = None,
+    ) -> Any:
+        if started is not None:
+            started.set()
+        start = time.perf_counter()
+        try:
+            result = self.providers[name].invoke(input, config, **kwargs)
+        except Exception:
+            self._record(name, None)
+            raise
+        self._record(name, time.perf_counter() - start)
+        return result
+
+    def _pool(self) -> ThreadPoolExecutor:
+        if self._executor is None:
+            with self._state.lock:
+                if self._executor is None:
+                    self._executor = ThreadPoolExecutor(self.max_workers, thread_name_prefix="model-router")
+        return self._executor
+
+    def invoke(self, input: Any, config: Optional[RunnableConfig] = None, **kwargs: Any) -> Any:
+        self._state.count("requests")
+        order = self.order()
+        last_error: Optional[BaseException] = None
+        i = 0
+        while i < len(order):
+            primary = order[i]
+            i += 1
+            if not (self.hedge and i < len(order)):
+                try:
+                    return self._call(primary, input, config, kwargs)
+                except Exception as e:
+                    last_error = e
+                    self._state.count("failovers")
+                    continue
+            started = threading.Event()
+            pending = {self._pool().submit(self._call, primary, input, config, kwargs, started)}
+            started.wait()
+            done, pending = wait(pending, timeout=self._deadline(primary))
+            hedge = None
+            if not done:
+                hedge = self._pool().submit(self._call, order[i], input, config, kwargs)
+                i += 1
+                pending.add(hedge)
+                self._state.count("hedged")
+            while done or pending:
+                if not done:
+                    done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                future = done.pop()
+                if future.exception() is None:
+                    if future is hedge:
+                        self._state.count("hedge_wins")
+                    return future.result()
+                last_error = future.exception()
+            self._state.count("failovers")
+        raise last_error
+
+    ##################################################################
+    # 非同期版
+    # 負けたリクエストはキャンセルし、送り先だった場合はタイムアウト(失敗)として記録する
+    # (ヘッジに負けるほど遅かったことを次の順序に反映するため。成功として記録すると
+    #  完了していないのにレイテンシの記録が短くなる)
+    ##################################################################
+    async def _acall(self, name: str, input: Any, config: Optional[RunnableConfig], kwargs: dict) -> Any:
+        start = time.perf_counter()
+        try:
+            result = await self.providers[name].ainvoke(input, config, **kwargs)
+        except Exception:
+            self._record(name, None)
+            raise
+        self._record(name, time.perf_counter() - start)
+        return result
+
+    async def ainvoke(self, input: Any, config: Optional[RunnableConfig] = None, **kwargs: Any) -> Any:
+        self._state.count("requests")
+        order = self.order()
+        last_error: Optional[BaseException] = None
+        i = 0
+        while i < len(order):
+            primary = order[i]
+            i += 1
+            if not (self.hedge and i < len(order)):
+                try:
+                    return await self._acall(primary, input, config, kwargs)
+                except Exception as e:
+                    last_error = e
+                    self._state.count("failovers")
+                    continue
+            task = asyncio.ensure_future(self._acall(primary, input, config, kwargs))
+            pending = {task}
+            hedge = None
+            winner = None
+            try:
+                done, pending = await asyncio.wait(pending, timeout=self._deadline(primary))
+                if not done:
+                    hedge = asyncio.ensure_future(self._acall(order[i], input, config, kwargs))
+                    i += 1
+                    pending.add(hedge)
+                    self._state.count("hedged")
+                while done or pending:
+                    if not done:
+                        done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                    finished = done.pop()
+                    if finished.exception() is None:
+                        winner = finished
+                        if finished is hedge:
+                            self._state.count("hedge_wins")
+                        return finished.result()
+                    last_error = finished.exception()
+            finally:
+                # 呼び出し元がキャンセルした場合は記録しない
+                for loser in pending:
+                    loser.cancel()
+                    if loser is task and winner is hedge is not None:
+                        self._record(primary, None)
+            self._state.count("failovers")
+        raise last_error
+
+    ##################################################################
+    # ストリーミング
+    ##################################################################
+    def stream(self, input: Any, config: Optional[RunnableConfig] = None, **kwargs: Any) -> Iterator[Any]:
+        self._state.count("requests")
+        last_error: Optional[BaseException] = None
+        for name in self.order():
+            start = time.perf_counter()
+            started = False
+            try:
+                for chunk in self.providers[name].stream(input, config, **kwargs):
+                    if not started:
+                        started = True
+                        self._record(name, time.perf_counter() - start)
+                    yield chunk
+                return
+            except Exception as e:
+                if started:
+                    raise
+                self._record(name, None)
+                self._state.count("failovers")
+                last_error = e
+        raise last_error
+
+    async def astream(self, input: Any, config: Optional[RunnableConfig] = None, **kwargs: Any) -> AsyncIterator[Any]:
+        self._state.count("requests")
+        last_error: Optional[BaseException] = None
+        for name in self.order():
+            start = time.perf_counter()
+            started = False
+            try:
+                async for chunk in self.providers[name].astream(input, config, **kwargs):
+                    if not started:
+                        started = True
+                        self._record(name, time.perf_counter() - start)
+                    yield chunk
+                return
+            except Exception as e:
+                if started:
+                    raise
+                self._record(name, None)
+                self._state.count("failovers")
+                last_error = e
+        raise last_error
+
+    ##################################################################
+    # 統計(/metricsに出力できるように値は数値のみ)
+    ##################################################################
+    def stats(self) -> dict:
+        now = time.monotonic()
+        with self._state.lock:
+            result = dict(self._state.counters)
+            for provider, stats in self._state.providers.items():
+                name = re.sub(r"\W", "_", provider)
+                p50 = stats.quantile(0.5)
+                p95 = stats.quantile(0.95)
+                result[f"{name}_requests"] = stats.requests
+                result[f"{name}_errors"] = stats.errors
+                result[f"{name}_error_rate"] = stats.error_rate
+                result[f"{name}_p50_ms"] = p50 * 1000 if p50 is not None else 0.0
+                result[f"{name}_p95_ms"] = p95 * 1000 if p95 is not None else 0.0
+                result[f"{name}_healthy"] = int(self._healthy(stats, now))
+        return result
+
+
+######################################################################
+# プロバイダの作成
+# MODEL_ROUTER=openai,anthropic のようにカンマ区切りで指定する
+# openai    -> ChatOpenAI(OPENAI_MODEL、デフォルトはgpt-4o-mini)
+# anthropic -> ChatAnthropic(ANTHROPIC_MODEL、デフォルトはclaude-3-5-sonnet-20240620)
+# fake      -> FakeChatModel(fake_chat_model.py)
+######################################################################
+def create_provider(name: str, **kwargs: Any) -> Runnable:
+    if name == "openai":
+        from langchain_openai import ChatOpenAI
+
+        return ChatOpenAI(model=os.getenv("OPENAI_MODEL") or "gpt-4o-mini", **kwargs)
+    if name == "anthropic":
+        from langchain_anthropic import ChatAnthropic
+
+        return ChatAnthropic(model=os.getenv("ANTHROPIC_MODEL") or "claude-3-5-sonnet-20240620", **kwargs)
+    if name.startswith("fake"):
+        from fake_chat_model import FakeChatModel
+
+        return FakeChatModel(model_name=name, **kwargs)
+    raise ValueError(f"unknown provider: {name}")
+
+
+def create_router(names: Optional[str] = None) -> ModelRouter:
+    names = names or os.getenv("MODEL_ROUTER", "openai,anthropic")
+    return ModelRouter.from_env({name: create_provider(name) for name in names.split(",") if name})
+
+
+######################################################################
+# FakeChatModelでの比較
+# fast  -> 通常は速いが、tail_rateの確率で大きく遅れる
+# slow  -> 常に少し遅い
+######################################################################
+def main():
+    from fake_chat_model import FakeChatModel
+
+    parser = argparse.ArgumentParser(description="ModelRouterのヘッジの有無の比較(FakeChatModel)")
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=20)
+    parser.add_argument("--tail-rate", type=float, default=0.1)
+    parser.add_argument("--error-rate", type=float, default=0.02)
+    args = parser.parse_args()
+
+    def providers():
+        return {
+            "fast": FakeChatModel(model_name="fast", latency=0.05, tail_rate=args.tail_rate,
+                                  tail_latency=1.0, error_rate=args.error_rate),
+            "slow": FakeChatModel(model_name="slow", latency=0.15, error_rate=args.error_rate),
+        }
+
+    async def run(router: ModelRouter) -> list[float]:
+        semaphore = asyncio.Semaphore(args.concurrency)
+        latencies = []
+
+        async def one(i: int):
+            async with semaphore:
+                start = time.perf_counter()
+                await router.ainvoke([("system", "Translate the following into italian"), ("user", f"hello {i}")])
+                latencies.append(time.perf_counter() - start)
+
+        await asyncio.gather(*(one(i) for i in range(args.requests)))
+        return sorted(latencies)
+
+    print(f"{'mode':>10} {'p50(ms)':>8} {'p95(ms)':>8} {'p99(ms)':>8} {'hedged':>7} {'wins':>5} {'failover':>8}")
+    for hedge in (False, True):
+        router = ModelRouter(providers(), hedge=hedge, hedge_after=0.2, min_samples=10)
+        latencies = asyncio.run(run(router))
+        stats = router.stats()
+
+        def pct(q):
+            return latencies[min(int(q * len(latencies)), len(latencies) - 1)] * 1000
+
+        print(f"{'hedge' if hedge else 'no hedge':>10} {pct(0.5):>8.1f} {pct(0.95):>8.1f} {pct(0.99):>8.1f} "
+              f"{stats['hedged']:>7} {stats['hedge_wins']:>5} {stats['failovers']:>8}")
+
+
+if __name__ == "__main__":
+    main()
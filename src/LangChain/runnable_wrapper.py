@@ -0,0 +1,86 @@
+######################################################################
+# Serving with LangServe
+# runnable_wrapper.py
+# chainの前段に処理を差し込むためのラッパーの共通部分
+#
+# input/outputのスキーマやconfigの定義は元のchainのものをそのまま公開する
+# (LangServeのplaygroundやinput_schemaが変わらないようにするため)
+# 何もしなければ元のchainにそのまま処理を委譲する
+######################################################################
+import threading
+from typing import Any, AsyncIterator, Callable, Iterator, Optional
+
+from langchain_core.runnables import Runnable, RunnableConfig
+
+
+class DelegatingRunnable(Runnable):
+    def __init__(self, bound: Runnable):
+        self.bound = bound
+        self.name = bound.get_name()
+
+    @property
+    def InputType(self) -> Any:
+        return self.bound.InputType
+
+    @property
+    def OutputType(self) -> Any:
+        return self.bound.OutputType
+
+    def get_input_schema(self, config: Optional[RunnableConfig] = None):
+        return self.bound.get_input_schema(config)
+
+    def get_output_schema(self, config: Optional[RunnableConfig] = None):
+        return self.bound.get_output_schema(config)
+
+    @property
+    def config_specs(self):
+        return self.bound.config_specs
+
+    def invoke(self, input: Any, config: Optional[RunnableConfig] = None, **kwargs: Any) -> Any:
+        return self.bound.invoke(input, config, **kwargs)
+
+    async def ainvoke(
+        self, input: Any, config: Optional[RunnableConfig] = None, **kwargs: Any
+    ) -> Any:
+        return await self.bound.ainvoke(input, config, **kwargs)
+
+    def stream(
+        self, input: Any, config: Optional[RunnableConfig] = None, **kwargs: Any
+    ) -> Iterator[Any]:
+        yield from self.bound.stream(input, config, **kwargs)
+
+    async def astream(
+        self, input: Any, config: Optional[RunnableConfig] = None, **kwargs: Any
+    ) -> AsyncIterator[Any]:
+        async for chunk in self.bound.astream(input, config, **kwargs):
+            yield chunk
+
+
+######################################################################
+# 初回利用時に生成するRunnable
+# モデルの生成(プロバイダSDKのインポートを含む)を最初のリクエストまで遅らせ、
+# 起動時間を短くする
+######################################################################
+class LazyRunnable(DelegatingRunnable):
+    def __init__(self, factory: Callable[[], Runnable], name: str):
+        self._factory = factory
+        self._bound: Optional[Runnable] = None
+        self._lock = threading.Lock()
+        self.name = name
+
+    @property
+    def bound(self) -> Runnable:
+        if self._bound is None:
+            with self._lock:
+                if self._bound is None:
+                    self._bound = self._factory()
+        return self._bound
+
+    @property
+    def built(self) -> bool:
+        return self._bound is not None
+
+    @property
+    def config_specs(self):
+        # ルート登録時にモデルが生成されないように、生成前は空とする
+        return self._bound.config_specs if self._bound is not None else []
@@ -4,45 +4,241 @@
 # Serving with LangServe
 # serve.py
 # 実行方法に関してはREADMEを参照
+#
+# SERVE_MODE=productionの場合は本番モードで起動する(設定はserve_settings.py)
+# - chainの各ステージはainvoke/astreamで非同期に実行される
+# - モデルプロバイダへのHTTPクライアントを共有し、接続をプールして再利用する
+# - ワーカー数・同時実行数の上限は設定値で制御する
+# - 終了時は実行中のストリーミングが終わるのを待ってから停止する
+# LOCAL_TRACING=trueの場合はLangSmithの代わりにローカルのファイルにトレースを書き出す
+# (src/local_tracing.py。main.py経由で起動した場合に有効)
 ######################################################################
-from fastapi import FastAPI
+import contextlib
+import functools
+import os
+
+import httpx
+from fastapi import FastAPI, Response
 from langchain_core.prompts import ChatPromptTemplate
 from langchain_core.output_parsers import StrOutputParser
-from langchain_openai import ChatOpenAI
 from langserve import add_routes
 
-# 1. Create prompt template
+from chain_metrics import MetricsMiddleware, create_metrics
+from concurrency_limit import ConcurrencyLimitRunnable
+from micro_batch import MicroBatchRunnable
+from runnable_wrapper import LazyRunnable
+from serve_settings import ServeSettings
+from single_flight import SingleFlightRunnable
+from translation_cache import TranslationCache
+
 system_template = "Translate the following into {language}:"
-prompt_template = ChatPromptTemplate.from_messages([
-    ('system', system_template),
-    ('user', '{text}')
-])
 
-# 2. Create model
-model = ChatOpenAI()
 
-# 3. Create parser
-parser = StrOutputParser()
+######################################################################
+# モデルプロバイダへのHTTPクライアント
+# 本番モードではワーカー内で1つのクライアントを共有し、keep-aliveで
+# 接続を再利用する(リクエスト毎にTCP/TLS接続を張り直さない)
+######################################################################
+def create_http_clients(settings: ServeSettings) -> tuple[httpx.Client, httpx.AsyncClient]:
+    limits = httpx.Limits(
+        max_connections=settings.pool_size,
+        max_keepalive_connections=settings.keepalive_connections,
+        keepalive_expiry=settings.keepalive_expiry,
+    )
+    timeout = httpx.Timeout(settings.request_timeout)
+    return (
+        httpx.Client(limits=limits, timeout=timeout),
+        httpx.AsyncClient(limits=limits, timeout=timeout),
+    )
+
+
+def create_app(settings: ServeSettings = None, model=None) -> FastAPI:
+    settings = settings or ServeSettings.from_env()
+
+    # 0. Local tracing
+    # 複数ワーカーで起動した場合、main.pyでの登録は各ワーカーに引き継がれないため、ここでも登録する
+    if settings.local_tracing:
+        from local_tracing import install
+
+        install()
+
+    # 1. Create prompt template
+    prompt_template = ChatPromptTemplate.from_messages([
+        ('system', system_template),
+        ('user', '{text}')
+    ])
+
+    # 2. Create model
+    # ChatOpenAI(langchain_openaiのインポートを含む)は最初のリクエストで生成する
+    http_clients = []
+    router = None
+    if model is None:
+        def create_model():
+            from langchain_openai import ChatOpenAI
+
+            model_kwargs = {"max_retries": settings.max_retries}
+            if settings.model_name:
+                model_kwargs["model"] = settings.model_name
+            if settings.request_timeout:
+                model_kwargs["timeout"] = settings.request_timeout
+            if settings.production:
+                http_clients.extend(create_http_clients(settings))
+                model_kwargs["http_client"], model_kwargs["http_async_client"] = http_clients
+            return ChatOpenAI(**model_kwargs)
+
+        model = LazyRunnable(create_model, name="ChatOpenAI")
+        model_name = settings.model_name or "ChatOpenAI"
+
+        # MODEL_ROUTERを指定した場合は、リクエストごとに最も速い正常なプロバイダに送る
+        # (遅い場合は別のプロバイダにもヘッジする)。各プロバイダも最初のリクエストで生成する
+        if settings.model_router:
+            from model_router import ModelRouter, create_provider
+
+            providers = {}
+            for name in settings.model_router.split(","):
+                if name == "openai":
+                    providers[name] = model
+                else:
+                    providers[name] = LazyRunnable(
+                        functools.partial(create_provider, name, max_retries=settings.max_retries), name=name
+                    )
+            router = ModelRouter.from_env(providers)
+            model = router
+            model_name = f"ModelRouter({settings.model_router})"
+    else:
+        model_name = getattr(model, "model_name", model.get_name())
+
+    # 3. Create parser
+    parser = StrOutputParser()
+
+    # 4. Create chain
+    # SERVE_METRICS=falseでない場合はステージ別の計測用コールバックを設定する
+    chain = prompt_template | model | parser
+    metrics = create_metrics() if settings.metrics else None
+    if metrics is not None:
+        chain = chain.with_config(callbacks=[metrics.handler])
+
+    # 5. Create cache
+    # 同じ(language, text)の翻訳はモデルを呼ばずにキャッシュから返す
+    # TRANSLATION_CACHE_PATHを指定した場合はSQLiteにも保存され、再起動後も有効
+    cache = TranslationCache(
+        model_name=model_name,
+        system_template=system_template,
+        maxsize=settings.cache_size,
+        ttl=settings.cache_ttl,
+        path=settings.cache_path,
+    )
+
+    # 6. Concurrency limit
+    # ワーカーあたりのchainの同時実行数を制限し、終了時の待ち合わせに使う
+    limiter = ConcurrencyLimitRunnable(chain, max_concurrency=settings.max_concurrency)
+    served_chain = limiter
+
+    # 7. Micro-batching (opt-in)
+    # CHAIN_BATCH_WINDOW_MSを指定した場合のみ、同時に届いたリクエストを
+    # まとめてchain.abatchで実行する
+    batcher = None
+    if settings.batch_window_ms:
+        batcher = MicroBatchRunnable(
+            served_chain,
+            window_ms=settings.batch_window_ms,
+            max_batch_size=settings.batch_max_size,
+            max_concurrency=settings.batch_max_concurrency,
+        )
+        served_chain = batcher
+
+    # 8. Single-flight
+    # 同じ入力のリクエストが同時に実行中の場合はモデルの呼び出しを1回にまとめる
+    # CHAIN_SINGLE_FLIGHT=falseで無効化できる
+    single_flight = None
+    if settings.single_flight:
+        single_flight = SingleFlightRunnable(served_chain, key=cache.key)
+        served_chain = single_flight
+
+    # 9. Graceful shutdown
+    # 実行中のリクエスト(ストリーミングを含む)が終わるのを待ってから
+    # HTTPクライアントを閉じる
+    @contextlib.asynccontextmanager
+    async def lifespan(app: FastAPI):
+        yield
+        await limiter.drain(settings.graceful_timeout)
+        if http_clients:
+            http_clients[0].close()
+            await http_clients[1].aclose()
+
+    # 10. App definition
+    app = FastAPI(
+      title="LangChain Server",
+      version="1.0",
+      description="A simple API server using LangChain's Runnable interfaces",
+      lifespan=lifespan,
+    )
+
+    if metrics is not None:
+        app.add_middleware(MetricsMiddleware, metrics=metrics, prefixes=("/chain",))
+
+    # 11. Adding chain route
+    add_routes(
+        app,
+        cache.wrap(served_chain),
+        path="/chain",
+    )
+
+    # 12. Cache / batching / single-flight / concurrency / router statistics
+    @app.get("/chain/cache")
+    def cache_stats():
+        return cache.stats()
+
+    @app.get("/chain/batching")
+    def batching_stats():
+        return batcher.stats() if batcher else {"enabled": False}
+
+    @app.get("/chain/single-flight")
+    def single_flight_stats():
+        return single_flight.stats() if single_flight else {"enabled": False}
+
+    @app.get("/chain/concurrency")
+    def concurrency_stats():
+        return limiter.stats()
+
+    @app.get("/chain/router")
+    def router_stats():
+        return router.stats() if router else {"enabled": False}
+
+    # 13. Prometheus metrics
+    if metrics is not None:
+        metrics.register_stats("chain_cache", cache.stats)
+        metrics.register_stats("chain_concurrency", limiter.stats)
+        if batcher:
+            metrics.register_stats("chain_batching", batcher.stats)
+        if single_flight:
+            metrics.register_stats("chain_single_flight", single_flight.stats)
+        if router:
+            metrics.register_stats("chain_router", router.stats)
 
-# 4. Create chain
-chain = prompt_template | model | parser
+        @app.get("/metrics")
+        def prometheus_metrics():
+            return Response(metrics.render(), media_type="text/plain; version=0.0.4")
 
+    return app
 
-# 4. App definition
-app = FastAPI(
-  title="LangChain Server",
-  version="1.0",
-  description="A simple API server using LangChain's Runnable interfaces",
-)
 
-# 5. Adding chain route
-add_routes(
-    app,
-    chain,
-    path="/chain",
-)
+app = create_app()
 
 if __name__ == "__main__":
     import uvicorn
 
-    uvicorn.run(app, host="localhost", port=8001)
\ No newline at end of file
+    settings = ServeSettings.from_env()
+    if settings.production:
+        # 複数ワーカーで起動する場合はアプリをインポート文字列で指定する
+        uvicorn.run(
+            "serve:app",
+            app_dir=os.path.dirname(os.path.abspath(__file__)),
+            host=settings.host,
+            port=settings.port,
+            workers=settings.workers,
+            limit_concurrency=settings.limit_connections,
+            timeout_graceful_shutdown=settings.graceful_timeout,
+        )
+    else:
+        uvicorn.run(app, host=settings.host, port=settings.port)
@@ -0,0 +1,106 @@
+######################################################################
+# Serving with LangServe
+# serve_settings.py
+# serve.pyの設定(環境変数から読み込む)
+#
+# SERVE_MODE=productionの場合は本番モードとして起動する
+# - モデルプロバイダへのHTTPクライアントを共有し、keep-aliveで接続を再利用する
+# - ワーカー数・同時実行数の上限を設定値で制御する
+# - 終了時は実行中のストリーミングが終わるのを待ってから停止する
+######################################################################
+import os
+from dataclasses import dataclass
+from typing import Optional
+
+
+def _env_int(name: str, default: Optional[int]) -> Optional[int]:
+    value = os.getenv(name)
+    return int(value) if value else default
+
+
+def _env_float(name: str, default: Optional[float]) -> Optional[float]:
+    value = os.getenv(name)
+    return float(value) if value else default
+
+
+def _env_bool(name: str, default: bool) -> bool:
+    value = os.getenv(name)
+    return value.lower() not in ("0", "false", "no", "off") if value else default
+
+
+@dataclass
+class ServeSettings:
+    # サーバー
+    mode: str = "development"
+    host: str = "localhost"
+    port: int = 8001
+    workers: int = 1
+    # ワーカーあたりの同時実行数の上限(chainの実行数、Noneの場合は無制限)
+    max_concurrency: Optional[int] = None
+    # uvicornが受け付ける同時接続数の上限(超えた場合は503を返す)
+    limit_connections: Optional[int] = None
+    # 終了時に実行中のリクエストを待つ最大時間(秒)
+    graceful_timeout: float = 30.0
+
+    # モデル
+    model_name: Optional[str] = None
+    request_timeout: Optional[float] = None
+    max_retries: int = 2
+    # 複数プロバイダのルーター(model_router.py)。"openai,anthropic"のように指定する
+    model_router: Optional[str] = None
+
+    # モデルプロバイダへのHTTP接続プール
+    pool_size: int = 100
+    keepalive_connections: int = 20
+    keepalive_expiry: float = 30.0
+
+    # キャッシュ(translation_cache.py)
+    cache_size: int = 1024
+    cache_ttl: float = 3600.0
+    cache_path: Optional[str] = None
+
+    # マイクロバッチ(micro_batch.py)
+    batch_window_ms: Optional[float] = None
+    batch_max_size: int = 32
+    batch_max_concurrency: int = 8
+
+    # Single-flight(single_flight.py)
+    single_flight: bool = True
+
+    # ステージ別の計測と/metrics(chain_metrics.py)
+    metrics: bool = True
+
+    # ローカルのトレース(src/local_tracing.py)
+    local_tracing: bool = False
+
+    @property
+    def production(self) -> bool:
+        return self.mode == "production"
+
+    @classmethod
+    def from_env(cls) -> "ServeSettings":
+        return cls(
+            mode=os.getenv("SERVE_MODE", cls.mode),
+            host=os.getenv("SERVE_HOST", cls.host),
+            port=_env_int("SERVE_PORT", cls.port),
+            workers=_env_int("SERVE_WORKERS", cls.workers),
+            max_concurrency=_env_int("SERVE_MAX_CONCURRENCY", cls.max_concurrency),
+            limit_connections=_env_int("SERVE_LIMIT_CONNECTIONS", cls.limit_connections),
+            graceful_timeout=_env_float("SERVE_GRACEFUL_TIMEOUT", cls.graceful_timeout),
+            model_name=os.getenv("OPENAI_MODEL", cls.model_name),
+            request_timeout=_env_float("OPENAI_REQUEST_TIMEOUT", cls.request_timeout),
+            max_retries=_env_int("OPENAI_MAX_RETRIES", cls.max_retries),
+            model_router=os.getenv("MODEL_ROUTER", cls.model_router),
+            pool_size=_env_int("OPENAI_POOL_SIZE", cls.pool_size),
+            keepalive_connections=_env_int("OPENAI_KEEPALIVE_CONNECTIONS", cls.keepalive_connections),
+            keepalive_expiry=_env_float("OPENAI_KEEPALIVE_EXPIRY", cls.keepalive_expiry),
+            cache_size=_env_int("TRANSLATION_CACHE_SIZE", cls.cache_size),
+            cache_ttl=_env_float("TRANSLATION_CACHE_TTL", cls.cache_ttl),
+            cache_path=os.getenv("TRANSLATION_CACHE_PATH", cls.cache_path),
+            batch_window_ms=_env_float("CHAIN_BATCH_WINDOW_MS", cls.batch_window_ms),
+            batch_max_size=_env_int("CHAIN_BATCH_MAX_SIZE", cls.batch_max_size),
+            batch_max_concurrency=_env_int("CHAIN_BATCH_MAX_CONCURRENCY", cls.batch_max_concurrency),
+            single_flight=_env_bool("CHAIN_SINGLE_FLIGHT", cls.single_flight),
+            metrics=_env_bool("SERVE_METRICS", cls.metrics),
+            local_tracing=_env_bool("LOCAL_TRACING", cls.local_tracing),
+        )
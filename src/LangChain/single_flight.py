@@ -0,0 +1,161 @@
+######################################################################
+# Serving with LangServe
+# single_flight.py
+# 同じ入力のリクエストが同時に実行中の場合、chainの呼び出しを1回にまとめる
+#
+# - invoke/ainvoke : 最初の呼び出し元だけがchainを実行し、
+#                    後から来た呼び出し元は同じ結果(Future)を待つ
+# - batch/abatch   : 各要素がinvoke/ainvokeを通るため、同じようにまとめられる
+# - astream        : 最初の呼び出し元がストリーミングを開始し、
+#                    受信したチャンクを全ての購読者に配信する
+#                    (途中から参加した購読者には受信済みのチャンクから配信する)
+######################################################################
+import asyncio
+import json
+import threading
+from concurrent.futures import Future
+from typing import Any, AsyncIterator, Callable, Optional
+
+from langchain_core.runnables import Runnable, RunnableConfig
+
+from runnable_wrapper import DelegatingRunnable
+
+
+def default_key(input: Any) -> str:
+    return json.dumps(input, sort_keys=True, ensure_ascii=False, default=str)
+
+
+######################################################################
+# ストリーミングの配信
+# 1つのastreamを複数の購読者に配る
+######################################################################
+class _Broadcast:
+    def __init__(self):
+        self.chunks: list = []
+        self.done = False
+        self.error: Optional[BaseException] = None
+        self.subscribers = 0
+        # 配信中のタスク(参照を持っておかないと、配信中にGCされることがある)
+        self.task: Optional[asyncio.Task] = None
+        self._cond = asyncio.Condition()
+
+    async def run(self, stream: AsyncIterator) -> None:
+        try:
+            async for chunk in stream:
+                async with self._cond:
+                    self.chunks.append(chunk)
+                    self._cond.notify_all()
+        except BaseException as e:
+            self.error = e
+        finally:
+            async with self._cond:
+                self.done = True
+                self._cond.notify_all()
+
+    async def subscribe(self) -> AsyncIterator:
+        index = 0
+        while True:
+            async with self._cond:
+                await self._cond.wait_for(lambda: len(self.chunks) > index or self.done)
+                chunks = self.chunks[index:]
+                finished = self.done
+            for chunk in chunks:
+                yield chunk
+            index += len(chunks)
+            if finished and index >= len(self.chunks):
+                if self.error is not None:
+                    raise self.error
+                return
+
+
+class SingleFlightRunnable(DelegatingRunnable):
+    def __init__(self, bound: Runnable, key: Callable[[Any], str] = default_key):
+        super().__init__(bound)
+        self.key = key
+        self._lock = threading.Lock()
+        self._sync_inflight: dict[str, Future] = {}
+        self._inflight: dict[str, asyncio.Future] = {}
+        self._streams: dict[str, _Broadcast] = {}
+        self._stats = {"executed": 0, "coalesced": 0, "streams": 0, "stream_subscribers": 0}
+
+    def invoke(self, input: Any, config: Optional[RunnableConfig] = None, **kwargs: Any) -> Any:
+        if kwargs:
+            return self.bound.invoke(input, config, **kwargs)
+        key = self.key(input)
+        with self._lock:
+            future = self._sync_inflight.get(key)
+            leader = future is None
+            if leader:
+                future = Future()
+                self._sync_inflight[key] = future
+                self._stats["executed"] += 1
+            else:
+                self._stats["coalesced"] += 1
+        if not leader:
+            return future.result()
+        try:
+            output = self.bound.invoke(input, config)
+            future.set_result(output)
+            return output
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        finally:
+            with self._lock:
+                self._sync_inflight.pop(key, None)
+
+    async def ainvoke(
+        self, input: Any, config: Optional[RunnableConfig] = None, **kwargs: Any
+    ) -> Any:
+        if kwargs:
+            return await self.bound.ainvoke(input, config, **kwargs)
+        key = self.key(input)
+        task = self._inflight.get(key)
+        if task is None:
+            task = asyncio.ensure_future(self.bound.ainvoke(input, config))
+            self._inflight[key] = task
+            task.add_done_callback(lambda t: self._finish(key, t))
+            self._stats["executed"] += 1
+        else:
+            self._stats["coalesced"] += 1
+        # 呼び出し元の1人がキャンセルしても、他の呼び出し元のために実行は継続する
+        return await asyncio.shield(task)
+
+    def _finish(self, key: str, task: asyncio.Future) -> None:
+        if self._inflight.get(key) is task:
+            del self._inflight[key]
+        # 全員がキャンセル済みの場合でも例外が未取得の警告を出さないようにする
+        if not task.cancelled():
+            task.exception()
+
+    async def astream(
+        self, input: Any, config: Optional[RunnableConfig] = None, **kwargs: Any
+    ) -> AsyncIterator[Any]:
+        if kwargs:
+            async for chunk in self.bound.astream(input, config, **kwargs):
+                yield chunk
+            return
+        key = self.key(input)
+        broadcast = self._streams.get(key)
+        if broadcast is None:
+            broadcast = _Broadcast()
+            self._streams[key] = broadcast
+            broadcast.task = asyncio.ensure_future(broadcast.run(self.bound.astream(input, config)))
+            broadcast.task.add_done_callback(lambda t: self._finish_stream(key, broadcast))
+            self._stats["streams"] += 1
+        else:
+            self._stats["coalesced"] += 1
+        broadcast.subscribers += 1
+        self._stats["stream_subscribers"] += 1
+        async for chunk in broadcast.subscribe():
+            yield chunk
+
+    def _finish_stream(self, key: str, broadcast: _Broadcast) -> None:
+        if self._streams.get(key) is broadcast:
+            del self._streams[key]
+
+    def stats(self) -> dict:
+        stats = dict(self._stats)
+        stats["in_flight"] = len(self._inflight) + len(self._sync_inflight)
+        stats["streaming"] = len(self._streams)
+        return stats
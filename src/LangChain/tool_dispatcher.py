@@ -0,0 +1,231 @@
+######################################################################
+# How to use chat models to call tools
+# tool_dispatcher.py
+# モデルが返したツール呼び出し(AIMessage.tool_calls)をプロセス内で実行する
+#
+# - ToolRegistry     -> ツール(TypedDict / 関数)と実装の登録
+#                       引数のスキーマは登録時に1回だけpydanticのTypeAdapterに変換し、
+#                       呼び出しごとの検証はコンパイル済みの検証器で行う
+# - dispatch         -> tool_callsを実行してToolMessageのリストを返す
+#                       不正な引数・実行時の例外はstatus="error"のToolMessageにする
+#                       決定的なツールの同じ引数の呼び出しは1回だけ実行する
+# - ToolCallingRunner -> 質問 -> モデル -> ツールの実行 -> 回答
+#                       全てのツール呼び出しが決定的(deterministic=True)で、
+#                       templateが登録されている場合は、ツールの結果から回答を作り、
+#                       2回目のモデル呼び出しを省略する
+#                       batch()は複数の質問のモデル呼び出しをまとめて実行し、
+#                       全てのツール呼び出しを1回のdispatchで実行する
+#
+# 使用例)
+# registry = ToolRegistry()
+# registry.register(multiply, lambda a, b: a * b, template="{a} * {b} = {result}")
+# runner = ToolCallingRunner(llm.bind_tools(registry.schemas), registry)
+# runner.invoke("What is 3 * 12?")   # -> "3 * 12 = 36"
+######################################################################
+import inspect
+import json
+import threading
+from dataclasses import dataclass
+from typing import Any, Callable, Optional
+
+from langchain_core.messages import AIMessage, BaseMessage, HumanMessage, ToolMessage
+from langchain_core.utils.function_calling import convert_to_openai_tool
+from pydantic import TypeAdapter, ValidationError
+from typing_extensions import TypedDict, is_typeddict
+
+
+@dataclass
+class CompiledTool:
+    name: str
+    schema: Any
+    func: Callable[..., Any]
+    validator: TypeAdapter
+    deterministic: bool = True
+    template: Optional[str] = None
+
+    def run(self, args: dict) -> Any:
+        return self.func(**self.validator.validate_python(args))
+
+    def answer(self, args: dict, result: Any) -> Optional[str]:
+        if self.template is None:
+            return None
+        return self.template.format(result=result, **args)
+
+
+######################################################################
+# 関数の引数からTypedDictを作る(TypedDictのツールと同じ方法で検証するため)
+######################################################################
+def _signature_typeddict(func: Callable) -> type:
+    fields = {
+        name: (param.annotation if param.annotation is not inspect.Parameter.empty else Any)
+        for name, param in inspect.signature(func).parameters.items()
+    }
+    return TypedDict(func.__name__, fields)
+
+
+class ToolRegistry:
+    def __init__(self):
+        self._tools: dict[str, CompiledTool] = {}
+
+    ##################################################################
+    # ツールの登録
+    # schema        -> bind_toolsに渡すTypedDictまたは関数
+    # func          -> 実装(schemaが関数の場合は省略できる)。引数はキーワードで渡す
+    # deterministic -> 同じ引数で常に同じ結果を返す(結果の再利用・モデル呼び出しの省略に使う)
+    # template      -> モデルを呼ばずに回答する場合の書式({result}と引数名を使える)
+    #                  {result}と区別できないため、resultという名前の引数があるツールには指定できない
+    ##################################################################
+    def register(
+        self,
+        schema: Any,
+        func: Optional[Callable[..., Any]] = None,
+        deterministic: bool = True,
+        template: Optional[str] = None,
+    ) -> CompiledTool:
+        if func is None:
+            if is_typeddict(schema) or not callable(schema):
+                raise ValueError(f"{schema!r} has no implementation; pass func")
+            func = schema
+        name = convert_to_openai_tool(schema)["function"]["name"]
+        args_type = schema if is_typeddict(schema) else _signature_typeddict(schema)
+        if template is not None and "result" in args_type.__annotations__:
+            raise ValueError(f"{name}: template cannot be used with an argument named 'result'")
+        tool = CompiledTool(name, schema, func, TypeAdapter(args_type), deterministic, template)
+        self._tools[name] = tool
+        return tool
+
+    def get(self, name: str) -> Optional[CompiledTool]:
+        return self._tools.get(name)
+
+    @property
+    def schemas(self) -> list:
+        return [tool.schema for tool in self._tools.values()]
+
+    def __contains__(self, name: str) -> bool:
+        return name in self._tools
+
+    ##################################################################
+    # ツール呼び出しの実行
+    # 戻り値はtool_callsと同じ順のToolMessage
+    ##################################################################
+    def dispatch(self, tool_calls: list[dict], memo: Optional[dict] = None) -> list[ToolMessage]:
+        memo = {} if memo is None else memo
+        messages = []
+        for call in tool_calls:
+            tool = self._tools.get(call["name"])
+            if tool is None:
+                messages.append(self._error(call, f"unknown tool: {call['name']}"))
+                continue
+            key = (tool.name, json.dumps(call["args"], sort_keys=True, default=str)) if tool.deterministic else None
+            try:
+                if key is not None and key in memo:
+                    result = memo[key]
+                else:
+                    result = tool.run(call["args"])
+                    if key is not None:
+                        memo[key] = result
+            except ValidationError as e:
+                messages.append(self._error(call, f"invalid arguments: {e.errors(include_url=False)}"))
+                continue
+            except Exception as e:
+                messages.append(self._error(call, f"{type(e).__name__}: {e}"))
+                continue
+            messages.append(
+                ToolMessage(content=str(result), tool_call_id=call["id"], name=tool.name, artifact=result)
+            )
+        return messages
+
+    def _error(self, call: dict, content: str) -> ToolMessage:
+        return ToolMessage(content=content, tool_call_id=call["id"], name=call["name"], status="error")
+
+    ##################################################################
+    # モデルを呼ばずに回答を作る
+    # 全てのツール呼び出しが成功し、決定的でtemplateを持つ場合だけ回答を返す
+    ##################################################################
+    def short_circuit(self, tool_calls: list[dict], results: list[ToolMessage]) -> Optional[str]:
+        lines = []
+        for call, result in zip(tool_calls, results):
+            tool = self._tools.get(call["name"])
+            if tool is None or not tool.deterministic or result.status == "error":
+                return None
+            line = tool.answer(tool.validator.validate_python(call["args"]), result.artifact)
+            if line is None:
+                return None
+            lines.append(line)
+        return "\n".join(lines) if lines else None
+
+
+######################################################################
+# 質問 -> モデル -> ツールの実行 -> 回答
+# llm_with_tools -> bind_tools済みのモデル
+# short_circuit  -> Falseの場合は常にツールの結果をモデルに渡して回答させる
+######################################################################
+class ToolCallingRunner:
+    def __init__(self, llm_with_tools, registry: ToolRegistry, short_circuit: bool = True):
+        self.llm_with_tools = llm_with_tools
+        self.registry = registry
+        self.short_circuit = short_circuit
+        self._lock = threading.Lock()
+        self._stats = {"queries": 0, "llm_calls": 0, "tool_calls": 0, "short_circuited": 0}
+
+    def _count(self, **deltas: int) -> None:
+        with self._lock:
+            for name, delta in deltas.items():
+                self._stats[name] += delta
+
+    def _messages(self, query: Any) -> list[BaseMessage]:
+        return [HumanMessage(query)] if isinstance(query, str) else list(query)
+
+    def _finish(self, ai: AIMessage, results: list[ToolMessage]) -> Optional[AIMessage]:
+        # ツール呼び出しがない、またはモデルを呼ばずに回答できる場合の応答(それ以外はNone)
+        if not ai.tool_calls:
+            return ai
+        if self.short_circuit:
+            answer = self.registry.short_circuit(ai.tool_calls, results)
+            if answer is not None:
+                self._count(short_circuited=1)
+                return AIMessage(answer, response_metadata={"short_circuit": True})
+        return None
+
+    def invoke(self, query: Any) -> AIMessage:
+        messages = self._messages(query)
+        ai = self.llm_with_tools.invoke(messages)
+        results = self.registry.dispatch(ai.tool_calls)
+        self._count(queries=1, llm_calls=1, tool_calls=len(ai.tool_calls))
+        answer = self._finish(ai, results)
+        if answer is not None:
+            return answer
+        self._count(llm_calls=1)
+        return self.llm_with_tools.invoke(messages + [ai] + results)
+
+    ##################################################################
+    # 複数の質問
+    # 1回目のモデル呼び出しをbatchでまとめて実行し、全てのツール呼び出しを
+    # 同じmemoで実行する(同じ計算は1回だけ)。モデルが必要な質問だけ2回目をbatchで呼ぶ
+    ##################################################################
+    def batch(self, queries: list, max_concurrency: Optional[int] = None) -> list[AIMessage]:
+        config = {"max_concurrency": max_concurrency} if max_concurrency else None
+        conversations = [self._messages(query) for query in queries]
+        replies = self.llm_with_tools.batch(conversations, config=config)
+        memo: dict = {}
+        answers: list[Optional[AIMessage]] = []
+        pending = []
+        for i, (messages, ai) in enumerate(zip(conversations, replies)):
+            results = self.registry.dispatch(ai.tool_calls, memo)
+            self._count(queries=1, llm_calls=1, tool_calls=len(ai.tool_calls))
+            answer = self._finish(ai, results)
+            answers.append(answer)
+            if answer is None:
+                pending.append((i, messages + [ai] + results))
+        if pending:
+            self._count(llm_calls=len(pending))
+            finals = self.llm_with_tools.batch([messages for _, messages in pending], config=config)
+            for (i, _), final in zip(pending, finals):
+                answers[i] = final
+        return answers
+
+    def stats(self) -> dict:
+        with self._lock:
+            stats = dict(self._stats)
+        stats["llm_calls_per_query"] = stats["llm_calls"] / stats["queries"] if stats["queries"] else 0.0
+        return stats
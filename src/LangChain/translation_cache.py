@@ -0,0 +1,267 @@
+######################################################################
+# Serving with LangServe
+# translation_cache.py
+# serve.pyの翻訳チェーン用レスポンスキャッシュ
+#
+# - キー     : (language, text, モデル名, system_template) を正規化してハッシュ化
+# - 1段目    : プロセス内LRU + TTL
+# - 2段目    : SQLiteによるディスクキャッシュ(任意、再起動後も残る)
+#              ainvoke / astreamではイベントループを止めないよう、別スレッドで読み書きする
+# - 統計     : hits / misses などをstats()で取得し、HTTPで公開する
+######################################################################
+import asyncio
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+from typing import Any, AsyncIterator, Iterator, Optional
+
+from langchain_core.runnables import Runnable, RunnableConfig
+
+from runnable_wrapper import DelegatingRunnable
+
+
+######################################################################
+# キーの正規化
+# 表記揺れ(前後の空白、大文字小文字、Unicodeの合成形)で
+# キャッシュが分散しないように正規化してからハッシュ化する
+######################################################################
+def normalize_key(language: str, text: str, model_name: str, system_template: str) -> str:
+    language = unicodedata.normalize("NFC", str(language)).strip().casefold()
+    text = unicodedata.normalize("NFC", str(text)).strip()
+    raw = json.dumps(
+        [language, text, model_name, system_template],
+        ensure_ascii=False,
+        separators=(",", ":"),
+    )
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+######################################################################
+# ディスクキャッシュ(SQLite)
+# WALモードにして読み込みと書き込みが互いをブロックしないようにする
+######################################################################
+class _DiskTier:
+    def __init__(self, path: str):
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS translations ("
+            " key TEXT PRIMARY KEY, value TEXT NOT NULL, expires_at REAL NOT NULL)"
+        )
+        self._conn.commit()
+
+    def get(self, key: str) -> Optional[tuple[str, float]]:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT value, expires_at FROM translations WHERE key = ?", (key,)
+            ).fetchone()
+        return row
+
+    def set(self, key: str, value: str, expires_at: float) -> None:
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO translations (key, value, expires_at) VALUES (?, ?, ?)",
+                (key, value, expires_at),
+            )
+            self._conn.commit()
+
+    def delete(self, key: str) -> None:
+        with self._lock:
+            self._conn.execute("DELETE FROM translations WHERE key = ?", (key,))
+            self._conn.commit()
+
+    def clear(self) -> None:
+        with self._lock:
+            self._conn.execute("DELETE FROM translations")
+            self._conn.commit()
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+
+######################################################################
+# 翻訳キャッシュ本体
+# maxsize -> メモリに保持する最大件数(超えたら最も古く使われたものから削除)
+# ttl     -> 有効期限(秒)
+# path    -> SQLiteファイルのパス。Noneの場合はメモリのみ
+######################################################################
+class TranslationCache:
+    def __init__(
+        self,
+        model_name: str,
+        system_template: str,
+        maxsize: int = 1024,
+        ttl: float = 3600.0,
+        path: Optional[str] = None,
+    ):
+        self.model_name = model_name
+        self.system_template = system_template
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._entries: "OrderedDict[str, tuple[str, float]]" = OrderedDict()
+        self._disk = _DiskTier(path) if path else None
+        self._stats = {"hits": 0, "disk_hits": 0, "misses": 0, "evictions": 0, "expired": 0}
+
+    def key(self, input: dict) -> str:
+        return normalize_key(
+            input.get("language", ""),
+            input.get("text", ""),
+            self.model_name,
+            self.system_template,
+        )
+
+    ##################################################################
+    # 取得・保存
+    # aget / asetはディスクキャッシュの読み書きを別スレッドで行う(メモリは直接参照する)
+    ##################################################################
+    def get(self, key: str) -> Optional[str]:
+        value = self._get_memory(key)
+        if value is None:
+            value = self._get_disk(key)
+        return value
+
+    async def aget(self, key: str) -> Optional[str]:
+        value = self._get_memory(key)
+        if value is None:
+            value = await asyncio.to_thread(self._get_disk, key) if self._disk is not None else self._get_disk(key)
+        return value
+
+    def _get_memory(self, key: str) -> Optional[str]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                value, expires_at = entry
+                if expires_at > time.time():
+                    self._entries.move_to_end(key)
+                    self._stats["hits"] += 1
+                    return value
+                del self._entries[key]
+                self._stats["expired"] += 1
+        return None
+
+    def _get_disk(self, key: str) -> Optional[str]:
+        if self._disk is not None:
+            row = self._disk.get(key)
+            if row is not None:
+                value, expires_at = row
+                if expires_at > time.time():
+                    # ディスクでヒットしたものはメモリにも載せておく
+                    self._remember(key, value, expires_at)
+                    with self._lock:
+                        self._stats["disk_hits"] += 1
+                    return value
+                self._disk.delete(key)
+        with self._lock:
+            self._stats["misses"] += 1
+        return None
+
+    def set(self, key: str, value: str) -> None:
+        expires_at = time.time() + self.ttl
+        self._remember(key, value, expires_at)
+        if self._disk is not None:
+            self._disk.set(key, value, expires_at)
+
+    async def aset(self, key: str, value: str) -> None:
+        expires_at = time.time() + self.ttl
+        self._remember(key, value, expires_at)
+        if self._disk is not None:
+            await asyncio.to_thread(self._disk.set, key, value, expires_at)
+
+    def _remember(self, key: str, value: str, expires_at: float) -> None:
+        with self._lock:
+            self._entries[key] = (value, expires_at)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+                self._stats["evictions"] += 1
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+        if self._disk is not None:
+            self._disk.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            stats = dict(self._stats)
+            stats["size"] = len(self._entries)
+        lookups = stats["hits"] + stats["disk_hits"] + stats["misses"]
+        stats["hit_rate"] = (stats["hits"] + stats["disk_hits"]) / lookups if lookups else 0.0
+        stats["maxsize"] = self.maxsize
+        stats["ttl"] = self.ttl
+        stats["disk"] = self._disk is not None
+        return stats
+
+    def wrap(self, runnable: Runnable) -> "CachedRunnable":
+        return CachedRunnable(runnable, self)
+
+
+######################################################################
+# キャッシュ付きRunnable
+# chainの前段に置き、ヒットした場合はモデルを呼ばずに結果を返す
+######################################################################
+class CachedRunnable(DelegatingRunnable):
+    def __init__(self, bound: Runnable, cache: TranslationCache):
+        super().__init__(bound)
+        self.cache = cache
+
+    def invoke(self, input: dict, config: Optional[RunnableConfig] = None, **kwargs: Any) -> str:
+        key = self.cache.key(input)
+        cached = self.cache.get(key)
+        if cached is not None:
+            return cached
+        output = self.bound.invoke(input, config, **kwargs)
+        self.cache.set(key, output)
+        return output
+
+    async def ainvoke(
+        self, input: dict, config: Optional[RunnableConfig] = None, **kwargs: Any
+    ) -> str:
+        key = self.cache.key(input)
+        cached = await self.cache.aget(key)
+        if cached is not None:
+            return cached
+        output = await self.bound.ainvoke(input, config, **kwargs)
+        await self.cache.aset(key, output)
+        return output
+
+    ##################################################################
+    # ストリーミング
+    # ヒット時は1チャンクで返し、ミス時は受信したチャンクを連結して
+    # 最後まで受信できた場合のみキャッシュに保存する
+    ##################################################################
+    def stream(
+        self, input: dict, config: Optional[RunnableConfig] = None, **kwargs: Any
+    ) -> Iterator[str]:
+        key = self.cache.key(input)
+        cached = self.cache.get(key)
+        if cached is not None:
+            yield cached
+            return
+        chunks = []
+        for chunk in self.bound.stream(input, config, **kwargs):
+            chunks.append(chunk)
+            yield chunk
+        self.cache.set(key, "".join(chunks))
+
+    async def astream(
+        self, input: dict, config: Optional[RunnableConfig] = None, **kwargs: Any
+    ) -> AsyncIterator[str]:
+        key = self.cache.key(input)
+        cached = await self.cache.aget(key)
+        if cached is not None:
+            yield cached
+            return
+        chunks = []
+        async for chunk in self.bound.astream(input, config, **kwargs):
+            chunks.append(chunk)
+            yield chunk
+        await self.cache.aset(key, "".join(chunks))
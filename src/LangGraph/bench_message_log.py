@@ -0,0 +1,115 @@
+######################################################################
+# LangGraph Quickstart
+# bench_message_log.py
+# add_messagesとMessageLog(message_log.py)のマイクロベンチマーク
+#
+# 1. reducer    -> n件の履歴に1件追加する時間
+#                  add_messages / merge_messages / MessageLogChannel.update
+#                  (チャンネルはステップごとにcheckpointされる前提で計測する)
+#                  in_placeは参照されていないMessageLogへの追加
+# 2. graph      -> n件の履歴を持つスレッドで1ターン(chatbotノード1回)を実行する時間
+#                  State(add_messages) / IndexedState(MessageLogChannel)
+#                  モデルはFakeToolCallingModel、checkpointerはSqliteDeltaSaver(一時ファイル)
+#
+# 実行例)
+# python bench_message_log.py --sizes 100,1000,5000
+######################################################################
+import argparse
+import asyncio
+import os
+import tempfile
+import time
+import uuid
+
+from langchain_core.messages import AIMessage, HumanMessage
+from langgraph.graph.message import add_messages
+
+from message_log import MessageLog, MessageLogChannel, merge_messages
+from sqlite_delta_saver import SqliteDeltaSaver
+
+
+def history(n: int) -> list:
+    return [
+        HumanMessage(f"question {i}", id=str(uuid.uuid4())) if i % 2 == 0 else AIMessage(f"answer {i}", id=str(uuid.uuid4()))
+        for i in range(n)
+    ]
+
+
+def per_call_us(fn, repeat: int) -> float:
+    start = time.perf_counter()
+    for _ in range(repeat):
+        fn()
+    return (time.perf_counter() - start) / repeat * 1e6
+
+
+def bench_reducer(n: int, repeat: int) -> dict:
+    messages = history(n)
+    log = MessageLog(messages)
+    channel = MessageLogChannel().from_checkpoint(messages)
+
+    # get・checkpointで参照された後の更新(コピーしてから追加する)
+    def channel_step():
+        channel.checkpoint()
+        channel.update([[HumanMessage("new")]])
+
+    return {
+        "add_messages": per_call_us(lambda: add_messages(messages, [HumanMessage("new")]), repeat),
+        "merge_messages": per_call_us(lambda: merge_messages(log, [HumanMessage("new")]), repeat),
+        "channel": per_call_us(channel_step, repeat),
+        "in_place": per_call_us(lambda: log.merge([HumanMessage("new")]), repeat),
+    }
+
+
+def bench_graph(n: int, turns: int) -> dict:
+    from chatbot_graph import IndexedState, State, build_chatbot_graph
+    from fakes import FakeToolCallingModel
+    from history_trimmer import HistoryTrimmer
+
+    results = {}
+    directory = tempfile.mkdtemp()
+    for label, schema in (("add_messages", State), ("MessageLogChannel", IndexedState)):
+        # 履歴の削減の影響を除くため、上限を十分大きくする
+        graph = build_chatbot_graph(
+            llm=FakeToolCallingModel(),
+            tools=[],
+            checkpointer=SqliteDeltaSaver(os.path.join(directory, f"{label}-{n}.sqlite")),
+            trimmer=HistoryTrimmer(max_tokens=10 ** 9),
+            state_schema=schema,
+        )
+        config = {"configurable": {"thread_id": label}}
+
+        async def run():
+            await graph.aupdate_state(config, {"messages": history(n)}, as_node="chatbot")
+            start = time.perf_counter()
+            for turn in range(turns):
+                await graph.ainvoke({"messages": [{"role": "user", "content": f"turn {turn}"}]}, config)
+            return (time.perf_counter() - start) / turns * 1000
+
+        results[label] = asyncio.run(run())
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="add_messagesとMessageLogの比較")
+    parser.add_argument("--sizes", default="100,1000,5000", help="履歴の件数(カンマ区切り)")
+    parser.add_argument("--repeat", type=int, default=200, help="reducerの計測の繰り返し回数")
+    parser.add_argument("--turns", type=int, default=20, help="グラフの計測のターン数")
+    args = parser.parse_args()
+    sizes = [int(size) for size in args.sizes.split(",")]
+
+    print("reducer: 1件追加あたりの時間(us)")
+    print(f"{'n':>8} {'add_messages':>14} {'merge_messages':>15} {'channel':>10} {'in_place':>10}")
+    for n in sizes:
+        r = bench_reducer(n, args.repeat)
+        print(f"{n:>8} {r['add_messages']:>14.1f} {r['merge_messages']:>15.1f} {r['channel']:>10.1f} {r['in_place']:>10.1f}")
+
+    print()
+    print("graph: 1ターンあたりの時間(ms)")
+    print(f"{'n':>8} {'add_messages':>14} {'MessageLogChannel':>18}")
+    for n in sizes:
+        r = bench_graph(n, args.turns)
+        print(f"{n:>8} {r['add_messages']:>14.2f} {r['MessageLogChannel']:>18.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,321 @@
+######################################################################
+# LangGraph Quickstart
+# bench_vector_store.py
+# ベクトルインデックス(faiss / Chroma)のベンチマーク
+#
+# 比較するインデックス
+# - flat   -> faiss.IndexFlatIP(全件検索、recallの基準)
+# - ivf    -> faiss.IndexIVFFlat(nlist個のクラスタのうちnprobe個だけを検索)
+# - hnsw   -> faiss.IndexHNSWFlat(グラフ探索、efSearchで精度と速度を調整)
+# - chroma -> chromadb.PersistentClient(HNSW、ディスクに保存)
+#
+# 計測する項目
+# - build     -> インデックスの作成(IVFの学習を含む)・全件の追加にかかった時間
+# - p50 / p99 -> 1件ずつ検索した時のレイテンシ
+# - recall@k  -> 全件検索(正解)の上位k件のうち、検索結果に含まれた割合
+# - memory    -> 作成前後の常駐メモリ(RSS)の増加量
+# - disk      -> 保存したインデックスのサイズ
+#
+# ベクトルはNumPyで作った合成データ(クラスタの中心 + ノイズ、L2正規化済み)で、
+# バッチごとに乱数のシードを決めて生成するため、コーパス全体をメモリに置かずに
+# 追加・正解の計算の両方で同じベクトルを作り直せる
+# インデックスごとに別プロセスで計測するため、メモリの計測は互いに影響しない
+# (プロセスが結果を返さずに終了した場合(メモリ不足でkillされたなど)は、終了コードをエラーとして出力する)
+#
+# 実行例)
+# python bench_vector_store.py --sizes 10000,100000 --dim 128
+# python bench_vector_store.py --sizes 10000000 --backends ivf,hnsw --batch-size 100000
+######################################################################
+import argparse
+import json
+import multiprocessing
+import os
+import queue
+import resource
+import shutil
+import tempfile
+import time
+from typing import Iterator
+
+import numpy as np
+
+BACKENDS = ("flat", "ivf", "hnsw", "chroma")
+
+
+######################################################################
+# 合成データ
+# クラスタの中心・batch番目のバッチ・クエリは、それぞれ(seed, 種類, batch)のシードで生成する
+######################################################################
+class SyntheticCorpus:
+    def __init__(self, n: int, dim: int, batch_size: int = 50000, clusters: int = 256, noise: float = 1.5, seed: int = 0):
+        self.n = n
+        self.dim = dim
+        self.batch_size = batch_size
+        self.noise = noise
+        self.seed = seed
+        self.centers = np.random.default_rng([seed, 0]).standard_normal((clusters, dim)).astype(np.float32)
+
+    def _sample(self, rng: np.random.Generator, size: int) -> np.ndarray:
+        labels = rng.integers(len(self.centers), size=size)
+        vectors = self.centers[labels] + self.noise * rng.standard_normal((size, self.dim), dtype=np.float32)
+        vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+        return vectors
+
+    def batches(self) -> Iterator[np.ndarray]:
+        for batch, start in enumerate(range(0, self.n, self.batch_size)):
+            rng = np.random.default_rng([self.seed, 1, batch])
+            yield self._sample(rng, min(self.batch_size, self.n - start))
+
+    def head(self, size: int) -> np.ndarray:
+        # IVFの学習用に先頭のsize件を返す
+        parts, total = [], 0
+        for batch in self.batches():
+            parts.append(batch[: size - total])
+            total += len(parts[-1])
+            if total >= size:
+                break
+        return np.concatenate(parts)
+
+    def queries(self, size: int) -> np.ndarray:
+        return self._sample(np.random.default_rng([self.seed, 2]), size)
+
+
+######################################################################
+# 正解(内積の上位k件)
+# バッチごとに上位k件を求め、それまでの上位k件とまとめて選び直す
+######################################################################
+def ground_truth(corpus: SyntheticCorpus, queries: np.ndarray, k: int) -> np.ndarray:
+    best_scores = np.full((len(queries), k), -np.inf, dtype=np.float32)
+    best_ids = np.full((len(queries), k), -1, dtype=np.int64)
+    offset = 0
+    for batch in corpus.batches():
+        scores = queries @ batch.T
+        top = min(k, len(batch))
+        ids = np.argpartition(-scores, top - 1, axis=1)[:, :top]
+        merged_scores = np.concatenate([best_scores, np.take_along_axis(scores, ids, axis=1)], axis=1)
+        merged_ids = np.concatenate([best_ids, ids + offset], axis=1)
+        order = np.argsort(-merged_scores, axis=1)[:, :k]
+        best_scores = np.take_along_axis(merged_scores, order, axis=1)
+        best_ids = np.take_along_axis(merged_ids, order, axis=1)
+        offset += len(batch)
+    return best_ids
+
+
+def recall_at_k(found: list, truth: np.ndarray) -> float:
+    hits = sum(len(set(ids) & set(row.tolist())) for ids, row in zip(found, truth))
+    return hits / truth.size
+
+
+def rss_bytes() -> int:
+    with open("/proc/self/statm") as f:
+        return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+
+
+def dir_size(path: str) -> int:
+    if os.path.isfile(path):
+        return os.path.getsize(path)
+    return sum(os.path.getsize(os.path.join(root, name)) for root, _, files in os.walk(path) for name in files)
+
+
+######################################################################
+# インデックス
+# build(corpus)でバッチごとに追加し、search(query, k)はIDのリストを返す
+######################################################################
+class FaissIndex:
+    def __init__(self, kind: str, dim: int, n: int, params: dict):
+        import faiss
+
+        self.faiss = faiss
+        self.kind = kind
+        self.params = params
+        if kind == "ivf":
+            # 学習にはクラスタあたり39件以上のベクトルが必要
+            self.nlist = params.get("nlist") or max(1, min(int(4 * np.sqrt(n)), n // 39))
+            self.index = faiss.IndexIVFFlat(faiss.IndexFlatIP(dim), dim, self.nlist, faiss.METRIC_INNER_PRODUCT)
+        elif kind == "hnsw":
+            self.index = faiss.IndexHNSWFlat(dim, params.get("m", 32), faiss.METRIC_INNER_PRODUCT)
+            self.index.hnsw.efConstruction = params.get("ef_construction", 64)
+        else:
+            self.index = faiss.IndexFlatIP(dim)
+
+    def build(self, corpus: SyntheticCorpus) -> None:
+        if self.kind == "ivf":
+            self.index.train(corpus.head(min(corpus.n, self.nlist * 64)))
+            self.index.nprobe = self.params.get("nprobe", 16)
+        elif self.kind == "hnsw":
+            self.index.hnsw.efSearch = self.params.get("ef_search", 64)
+        for batch in corpus.batches():
+            self.index.add(batch)
+
+    def search(self, query: np.ndarray, k: int) -> list[int]:
+        _, ids = self.index.search(query.reshape(1, -1), k)
+        return ids[0].tolist()
+
+    def save(self, directory: str) -> str:
+        path = os.path.join(directory, f"{self.kind}.faiss")
+        self.faiss.write_index(self.index, path)
+        return path
+
+
+class ChromaIndex:
+    def __init__(self, kind: str, dim: int, n: int, params: dict):
+        import chromadb
+
+        self.directory = params["directory"]
+        self.client = chromadb.PersistentClient(path=self.directory)
+        self.collection = self.client.get_or_create_collection(
+            "bench",
+            metadata={
+                "hnsw:space": "ip",
+                "hnsw:M": params.get("m", 32),
+                "hnsw:construction_ef": params.get("ef_construction", 64),
+                "hnsw:search_ef": params.get("ef_search", 64),
+            },
+        )
+
+    def build(self, corpus: SyntheticCorpus) -> None:
+        step = self.client.get_max_batch_size()
+        offset = 0
+        for batch in corpus.batches():
+            for start in range(0, len(batch), step):
+                part = batch[start:start + step]
+                ids = [str(offset + start + i) for i in range(len(part))]
+                self.collection.add(ids=ids, embeddings=part)
+            offset += len(batch)
+
+    def search(self, query: np.ndarray, k: int) -> list[int]:
+        result = self.collection.query(query_embeddings=query.reshape(1, -1), n_results=k, include=[])
+        return [int(i) for i in result["ids"][0]]
+
+    def save(self, directory: str) -> str:
+        return self.directory
+
+
+######################################################################
+# 1つのインデックスの計測(子プロセスで実行する)
+######################################################################
+def run_backend(backend: str, args: dict, truth: np.ndarray, output) -> None:
+    import faiss
+
+    # レイテンシは1件ずつの検索なので、スレッドの切り替えの影響を除く
+    faiss.omp_set_num_threads(args["threads"])
+    directory = tempfile.mkdtemp(prefix=f"bench-{backend}-")
+    try:
+        corpus = SyntheticCorpus(args["n"], args["dim"], args["batch_size"], noise=args["noise"])
+        queries = corpus.queries(args["queries"])
+        params = dict(args["params"], directory=os.path.join(directory, "chroma"))
+        index_class = ChromaIndex if backend == "chroma" else FaissIndex
+        before = rss_bytes()
+        start = time.perf_counter()
+        index = index_class(backend, args["dim"], args["n"], params)
+        index.build(corpus)
+        build = time.perf_counter() - start
+        memory = rss_bytes() - before
+
+        k = args["k"]
+        for query in queries[: min(10, len(queries))]:
+            index.search(query, k)
+        latencies, found = [], []
+        for query in queries:
+            start = time.perf_counter()
+            found.append(index.search(query, k))
+            latencies.append(time.perf_counter() - start)
+        latencies = np.array(latencies) * 1000
+        disk = dir_size(index.save(directory))
+        output.put({
+            "backend": backend,
+            "n": args["n"],
+            "build_s": build,
+            "p50_ms": float(np.percentile(latencies, 50)),
+            "p99_ms": float(np.percentile(latencies, 99)),
+            "recall": recall_at_k(found, truth),
+            "memory_mb": memory / 2 ** 20,
+            "peak_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+            "disk_mb": disk / 2 ** 20,
+        })
+    except Exception as e:
+        output.put({"backend": backend, "n": args["n"], "error": f"{type(e).__name__}: {e}"})
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+def wait_result(process, output, backend: str, n: int, poll: float = 1.0) -> dict:
+    # 結果を待ちながら、プロセスが結果を書き込まずに終了していないかを確認する
+    while True:
+        try:
+            return output.get(timeout=poll)
+        except queue.Empty:
+            if process.is_alive():
+                continue
+        # 終了の直前に書き込んだ結果がまだ届いていない場合があるため、もう一度だけ待つ
+        try:
+            return output.get(timeout=poll)
+        except queue.Empty:
+            return {"backend": backend, "n": n, "error": f"process exited with code {process.exitcode}"}
+
+
+def bench(n: int, backends: list[str], args: dict) -> list[dict]:
+    corpus = SyntheticCorpus(n, args["dim"], args["batch_size"], noise=args["noise"])
+    truth = ground_truth(corpus, corpus.queries(args["queries"]), args["k"])
+    context = multiprocessing.get_context("spawn")
+    results = []
+    for backend in backends:
+        output = context.Queue()
+        process = context.Process(target=run_backend, args=(backend, dict(args, n=n), truth, output))
+        process.start()
+        result = wait_result(process, output, backend, n)
+        process.join()
+        results.append(result)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="faiss(flat / IVF / HNSW)とChromaの比較")
+    parser.add_argument("--sizes", default="10000,100000", help="コーパスの件数(カンマ区切り)")
+    parser.add_argument("--backends", default=",".join(BACKENDS), help=f"計測するインデックス({'/'.join(BACKENDS)})")
+    parser.add_argument("--dim", type=int, default=128, help="ベクトルの次元数")
+    parser.add_argument("--noise", type=float, default=1.5, help="クラスタの中心からのばらつき(大きいほど近傍探索が難しい)")
+    parser.add_argument("--k", type=int, default=10, help="recall@kのk")
+    parser.add_argument("--queries", type=int, default=200, help="検索するクエリの数")
+    parser.add_argument("--batch-size", type=int, default=50000, help="1回に生成・追加するベクトルの数")
+    parser.add_argument("--threads", type=int, default=1, help="faissのスレッド数")
+    parser.add_argument("--nlist", type=int, default=0, help="IVFのクラスタ数(0の場合は4*sqrt(n))")
+    parser.add_argument("--nprobe", type=int, default=16, help="IVFで検索するクラスタ数")
+    parser.add_argument("--m", type=int, default=32, help="HNSWの接続数")
+    parser.add_argument("--ef-construction", type=int, default=64, help="HNSWの作成時の候補数")
+    parser.add_argument("--ef-search", type=int, default=64, help="HNSWの検索時の候補数")
+    parser.add_argument("--json", action="store_true", help="結果をJSON Lines形式で出力する")
+    args = parser.parse_args()
+
+    options = {
+        "dim": args.dim,
+        "noise": args.noise,
+        "k": args.k,
+        "queries": args.queries,
+        "batch_size": args.batch_size,
+        "threads": args.threads,
+        "params": {
+            "nlist": args.nlist,
+            "nprobe": args.nprobe,
+            "m": args.m,
+            "ef_construction": args.ef_construction,
+            "ef_search": args.ef_search,
+        },
+    }
+    backends = [backend for backend in args.backends.split(",") if backend]
+    if not args.json:
+        print(f"{'n':>10} {'backend':>8} {'build(s)':>9} {'p50(ms)':>8} {'p99(ms)':>8} "
+              f"{'recall@' + str(args.k):>10} {'mem(MB)':>8} {'peak(MB)':>9} {'disk(MB)':>9}")
+    for n in (int(size) for size in args.sizes.split(",")):
+        for r in bench(n, backends, options):
+            if args.json:
+                print(json.dumps(r))
+            elif "error" in r:
+                print(f"{r['n']:>10} {r['backend']:>8} {r['error']}")
+            else:
+                print(f"{r['n']:>10} {r['backend']:>8} {r['build_s']:>9.2f} {r['p50_ms']:>8.3f} {r['p99_ms']:>8.3f} "
+                      f"{r['recall']:>10.3f} {r['memory_mb']:>8.1f} {r['peak_mb']:>9.1f} {r['disk_mb']:>9.1f}")
+
+
+if __name__ == "__main__":
+    main()
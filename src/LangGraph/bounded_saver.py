@@ -0,0 +1,263 @@
+######################################################################
+# LangGraph Quickstart
+# bounded_saver.py
+# メモリ使用量の上限つきのMemorySaver
+#
+# MemorySaverは全てのthread_idの会話をプロセスが終了するまで保持し続けるため、
+# 長時間動かし続けるとユーザーが増えるほどメモリ使用量が増える
+# このcheckpointerでは
+# - メモリ上の会話の合計サイズ(バイト数)とスレッド数に上限を設ける
+# - 上限を超えた場合・一定時間使われていない場合は、最も長く使われていないスレッドを
+#   丸ごとローカルのSQLiteファイルに退避(spill)してメモリから削除する
+# - 退避したスレッドが再び使われた場合はSQLiteから読み込んでメモリに戻す
+# - 退避先のファイルはメモリの延長として使うため、起動時に中身を削除する
+#   (メモリ上の会話と同じく、再起動すると退避した会話も残らない)
+#
+# 使用例)
+# memory = BoundedMemorySaver(max_bytes=64 * 1024 * 1024, idle_ttl=600, spill_path="spill.sqlite")
+# graph = graph_builder.compile(checkpointer=memory)
+# memory.stats() -> 常駐スレッド数・バイト数・再読み込みのレイテンシなど
+######################################################################
+import pickle
+import sqlite3
+import threading
+import time
+from collections import OrderedDict, defaultdict
+from typing import Any, Iterator, Optional, Sequence
+
+from langchain_core.runnables import RunnableConfig
+
+from langgraph.checkpoint.base import ChannelVersions, Checkpoint, CheckpointMetadata, CheckpointTuple
+from langgraph.checkpoint.memory import InMemorySaver
+
+
+class BoundedMemorySaver(InMemorySaver):
+    ##################################################################
+    # max_bytes   -> メモリ上に保持する会話の合計サイズ(シリアライズ後のバイト数)
+    # max_threads -> メモリ上に保持するスレッド数(Noneの場合は無制限)
+    # idle_ttl    -> この秒数使われていないスレッドは退避する(Noneの場合は退避しない)
+    # spill_path  -> 退避先のSQLiteファイルのパス
+    ##################################################################
+    def __init__(
+        self,
+        max_bytes: int = 64 * 1024 * 1024,
+        max_threads: Optional[int] = None,
+        idle_ttl: Optional[float] = None,
+        spill_path: str = "spill.sqlite",
+        serde=None,
+    ):
+        super().__init__(serde=serde)
+        self.max_bytes = max_bytes
+        self.max_threads = max_threads
+        self.idle_ttl = idle_ttl
+        self._lock = threading.RLock()
+        # thread_id -> 最後に使われた時刻(古い順)
+        self._resident: OrderedDict[str, float] = OrderedDict()
+        self._bytes: dict[str, int] = defaultdict(int)
+        self._total_bytes = 0
+        # thread_id -> そのスレッドのblobs/writesのキー(退避時に全体を走査しないため)
+        self._blob_keys: dict[str, set] = defaultdict(set)
+        self._write_keys: dict[str, set] = defaultdict(set)
+        self._conn = sqlite3.connect(spill_path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS spilled (thread_id TEXT PRIMARY KEY, data BLOB, bytes INTEGER)"
+        )
+        # 前回のプロセスが退避したスレッドは読み込まない(常駐していたスレッドは既に失われているため)
+        self._conn.execute("DELETE FROM spilled")
+        self._conn.commit()
+        self._counters = {"evictions": 0, "idle_evictions": 0, "reloads": 0}
+        self._reload_seconds: list[float] = []
+
+    ##################################################################
+    # スレッドの使用
+    # 退避済みの場合は読み込み、LRUの順番を更新する
+    ##################################################################
+    def _touch(self, thread_id: str) -> None:
+        now = time.monotonic()
+        reloaded = thread_id not in self._resident
+        if reloaded:
+            self._reload(thread_id)
+        self._resident[thread_id] = now
+        self._resident.move_to_end(thread_id)
+        if reloaded:
+            self._enforce_budget(thread_id)
+        if self.idle_ttl is not None:
+            while self._resident:
+                oldest, last_used = next(iter(self._resident.items()))
+                if oldest == thread_id or now - last_used < self.idle_ttl:
+                    break
+                self._spill(oldest)
+                self._counters["idle_evictions"] += 1
+
+    def _enforce_budget(self, current: str) -> None:
+        while len(self._resident) > 1 and (
+            self._total_bytes > self.max_bytes
+            or (self.max_threads is not None and len(self._resident) > self.max_threads)
+        ):
+            oldest = next(iter(self._resident))
+            if oldest == current:
+                self._resident.move_to_end(current)
+                oldest = next(iter(self._resident))
+            self._spill(oldest)
+            self._counters["evictions"] += 1
+
+    ##################################################################
+    # 退避(spill)と再読み込み(reload)
+    # InMemorySaverが保持しているシリアライズ済みのデータをそのままpickleで保存する
+    ##################################################################
+    def _spill(self, thread_id: str) -> None:
+        storage = {ns: dict(checkpoints) for ns, checkpoints in self.storage.pop(thread_id, {}).items()}
+        writes = {key: self.writes.pop(key) for key in self._write_keys.pop(thread_id, ()) if key in self.writes}
+        blobs = {key: self.blobs.pop(key) for key in self._blob_keys.pop(thread_id, ()) if key in self.blobs}
+        size = self._bytes.pop(thread_id, 0)
+        self._total_bytes -= size
+        self._resident.pop(thread_id, None)
+        self._conn.execute(
+            "INSERT OR REPLACE INTO spilled (thread_id, data, bytes) VALUES (?, ?, ?)",
+            (thread_id, pickle.dumps((storage, writes, blobs), pickle.HIGHEST_PROTOCOL), size),
+        )
+        self._conn.commit()
+
+    def _reload(self, thread_id: str) -> None:
+        start = time.perf_counter()
+        row = self._conn.execute("SELECT data, bytes FROM spilled WHERE thread_id = ?", (thread_id,)).fetchone()
+        if row is None:
+            return
+        storage, writes, blobs = pickle.loads(row[0])
+        for ns, checkpoints in storage.items():
+            self.storage[thread_id][ns].update(checkpoints)
+        self.writes.update(writes)
+        self.blobs.update(blobs)
+        self._write_keys[thread_id].update(writes)
+        self._blob_keys[thread_id].update(blobs)
+        self._bytes[thread_id] = row[1]
+        self._total_bytes += row[1]
+        self._conn.execute("DELETE FROM spilled WHERE thread_id = ?", (thread_id,))
+        self._conn.commit()
+        self._counters["reloads"] += 1
+        self._reload_seconds = (self._reload_seconds + [time.perf_counter() - start])[-1000:]
+
+    def _spilled_threads(self) -> list[str]:
+        return [row[0] for row in self._conn.execute("SELECT thread_id FROM spilled")]
+
+    ##################################################################
+    # InMemorySaverのメソッド
+    # 対象のスレッドをメモリに載せてから元の処理を呼び出す
+    # 非同期版(aget_tupleなど)はInMemorySaverで同期版を呼び出している
+    ##################################################################
+    def get_tuple(self, config: RunnableConfig) -> Optional[CheckpointTuple]:
+        with self._lock:
+            self._touch(config["configurable"]["thread_id"])
+            return super().get_tuple(config)
+
+    def get_delta_channel_history(self, *, config: RunnableConfig, channels: Sequence[str]):
+        with self._lock:
+            self._touch(config["configurable"]["thread_id"])
+            return super().get_delta_channel_history(config=config, channels=channels)
+
+    def list(
+        self,
+        config: Optional[RunnableConfig],
+        *,
+        filter: Optional[dict[str, Any]] = None,
+        before: Optional[RunnableConfig] = None,
+        limit: Optional[int] = None,
+    ) -> Iterator[CheckpointTuple]:
+        if config is not None:
+            with self._lock:
+                self._touch(config["configurable"]["thread_id"])
+                items = list(super().list(config, filter=filter, before=before, limit=limit))
+            yield from items
+            return
+        # 全スレッドが対象の場合は、退避済みのスレッドも1つずつ読み込んで返す
+        with self._lock:
+            thread_ids = list(self._resident) + self._spilled_threads()
+        for thread_id in thread_ids:
+            if limit is not None and limit <= 0:
+                break
+            thread_config = {"configurable": {"thread_id": thread_id}}
+            with self._lock:
+                self._touch(thread_id)
+                items = list(super().list(thread_config, filter=filter, before=before, limit=limit))
+            if limit is not None:
+                limit -= len(items)
+            yield from items
+
+    def put(
+        self,
+        config: RunnableConfig,
+        checkpoint: Checkpoint,
+        metadata: CheckpointMetadata,
+        new_versions: ChannelVersions,
+    ) -> RunnableConfig:
+        thread_id = config["configurable"]["thread_id"]
+        checkpoint_ns = config["configurable"]["checkpoint_ns"]
+        with self._lock:
+            self._touch(thread_id)
+            result = super().put(config, checkpoint, metadata, new_versions)
+            # storageの値は(checkpoint, metadata, 親のID)で、前の2つはserdeの(型, バイト列)
+            size = sum(len(part[1]) for part in self.storage[thread_id][checkpoint_ns][checkpoint["id"]][:2])
+            for channel, version in new_versions.items():
+                key = (thread_id, checkpoint_ns, channel, version)
+                if key not in self._blob_keys[thread_id]:
+                    self._blob_keys[thread_id].add(key)
+                    size += len(self.blobs[key][1])
+            self._bytes[thread_id] += size
+            self._total_bytes += size
+            self._enforce_budget(thread_id)
+        return result
+
+    def put_writes(
+        self,
+        config: RunnableConfig,
+        writes: Sequence[tuple[str, Any]],
+        task_id: str,
+        task_path: str = "",
+    ) -> None:
+        thread_id = config["configurable"]["thread_id"]
+        outer_key = (thread_id, config["configurable"].get("checkpoint_ns", ""), config["configurable"]["checkpoint_id"])
+        with self._lock:
+            self._touch(thread_id)
+            before = self._writes_size(outer_key)
+            super().put_writes(config, writes, task_id, task_path)
+            self._write_keys[thread_id].add(outer_key)
+            size = self._writes_size(outer_key) - before
+            self._bytes[thread_id] += size
+            self._total_bytes += size
+            self._enforce_budget(thread_id)
+
+    def _writes_size(self, outer_key: tuple) -> int:
+        return sum(len(value[2][1]) for value in self.writes.get(outer_key, {}).values())
+
+    def delete_thread(self, thread_id: str) -> None:
+        with self._lock:
+            super().delete_thread(thread_id)
+            self._resident.pop(thread_id, None)
+            self._total_bytes -= self._bytes.pop(thread_id, 0)
+            self._blob_keys.pop(thread_id, None)
+            self._write_keys.pop(thread_id, None)
+            self._conn.execute("DELETE FROM spilled WHERE thread_id = ?", (thread_id,))
+            self._conn.commit()
+
+    ##################################################################
+    # 計測値
+    ##################################################################
+    def stats(self) -> dict:
+        with self._lock:
+            spilled = self._conn.execute("SELECT COUNT(*), COALESCE(SUM(bytes), 0) FROM spilled").fetchone()
+            latencies = sorted(self._reload_seconds)
+            return {
+                "resident_threads": len(self._resident),
+                "resident_bytes": self._total_bytes,
+                "max_bytes": self.max_bytes,
+                "spilled_threads": spilled[0],
+                "spilled_bytes": spilled[1],
+                **self._counters,
+                "reload_ms_avg": sum(latencies) / len(latencies) * 1000 if latencies else 0.0,
+                "reload_ms_max": latencies[-1] * 1000 if latencies else 0.0,
+            }
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
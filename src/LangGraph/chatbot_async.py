@@ -0,0 +1,106 @@
+######################################################################
+# LangGraph Quickstart
+# chatbot_async.py
+# 非同期版のチャットボット(chatbot_graph.py)で多数の会話を同時に実行する
+#
+# --threads個のthread_idの会話を1つのイベントループで同時に実行し、
+# 各会話で--turns回のやり取りをgraph.astreamで行う
+# --fakeを指定した場合はモデルと検索ツールをローカルのもの(fakes.py)に差し替える
+# 会話はバッチ処理としてBULKの優先度で実行する(--interactiveの会話は先に処理される)
+# --deadlineを指定した場合は、やり取りごとにその期限を付けて実行する(tool_guard.py)
+#
+# 実行例)
+# python chatbot_async.py --fake --threads 300 --turns 3 --latency 0.5
+# PROVIDER_CONCURRENCY=anthropic=16,tavily=8 python chatbot_async.py --threads 50
+# PROVIDER_RPM=fake=600 python chatbot_async.py --fake --threads 100 --fake-rpm 600 --interactive 5
+# TOOL_CACHE=false python chatbot_async.py --fake --threads 50 --tool-latency 10 --deadline 2
+######################################################################
+import argparse
+import asyncio
+import os
+import statistics
+import time
+import uuid
+
+
+async def conversation(graph, thread_id: str, turns: int, latencies: list, priority: int, deadline=None) -> None:
+    from provider_limits import request_priority
+    from tool_guard import request_config, with_deadline
+
+    config = {"configurable": {"thread_id": thread_id}}
+    for turn in range(turns):
+        # 偶数ターンは検索ツールを使う質問にする
+        text = f"What is new in topic {turn}?" if turn % 2 == 0 else f"Thanks, that was turn {turn}."
+        start = time.perf_counter()
+        turn_config = with_deadline(config, deadline) if deadline else request_config(config)
+        with request_priority(priority):
+            async for event in graph.astream({"messages": [{"role": "user", "content": text}]}, turn_config, stream_mode="values"):
+                last = event["messages"][-1]
+        latencies.append(time.perf_counter() - start)
+    if os.getenv("CHATBOT_ASYNC_VERBOSE"):
+        last.pretty_print()
+
+
+async def run(args) -> None:
+    from chatbot_graph import TOOL_PROVIDERS, build_chatbot_graph
+    from chatbot_tools import get_tool_guard
+    from provider_limits import BULK, INTERACTIVE, ProviderLimiter, parse_limits
+
+    limiter = ProviderLimiter.from_env(TOOL_PROVIDERS)
+    limiter.limits.update(parse_limits(args.limits or ""))
+    guard = get_tool_guard()
+    graph = build_chatbot_graph(limiter=limiter, guard=guard, name="chatbot_async")
+
+    latencies: list[float] = []
+    interactive: list[float] = []
+    prefix = uuid.uuid4().hex[:8]
+    start = time.perf_counter()
+    await asyncio.gather(
+        *(conversation(graph, f"{prefix}-{i}", args.turns, latencies, BULK, args.deadline) for i in range(args.threads)),
+        *(conversation(graph, f"{prefix}-i{i}", args.turns, interactive, INTERACTIVE, args.deadline) for i in range(args.interactive)),
+    )
+    elapsed = time.perf_counter() - start
+
+    latencies.sort()
+    print(f"threads={args.threads} turns={args.turns} elapsed={elapsed:.2f}s "
+          f"turns/s={len(latencies) / elapsed:.1f}")
+    print(f"turn latency p50={statistics.median(latencies) * 1000:.0f}ms "
+          f"max={latencies[-1] * 1000:.0f}ms")
+    if interactive:
+        interactive.sort()
+        print(f"interactive turn latency p50={statistics.median(interactive) * 1000:.0f}ms "
+              f"max={interactive[-1] * 1000:.0f}ms")
+    for provider, stat in limiter.stats().items():
+        print(f"  {provider:<10} limit={stat['limit']} adaptive={stat['adaptive_limit']} calls={stat['calls']} "
+              f"wait={stat['wait_seconds']:.2f}s p95={stat['wait_p95_ms']:.0f}ms throttled={stat['throttled']}")
+    for name, stat in guard.stats().items():
+        print(f"  {name:<28} state={stat['state']} calls={stat['calls']} timeouts={stat['timeouts']} "
+              f"rejected={stat['rejected']} trips={stat['trips']}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="非同期版チャットボットの同時実行")
+    parser.add_argument("--threads", type=int, default=100, help="同時に実行する会話(thread_id)の数")
+    parser.add_argument("--turns", type=int, default=2, help="1つの会話のやり取りの回数")
+    parser.add_argument("--fake", action="store_true", help="ローカルのモデルと検索ツールを使う")
+    parser.add_argument("--latency", type=float, default=0.2, help="--fakeの場合のモデル・ツールの応答時間(秒)")
+    parser.add_argument("--limits", help="プロバイダごとの同時実行数の上限(例: fake=32,tavily=8)")
+    parser.add_argument("--interactive", type=int, default=0, help="INTERACTIVEの優先度で同時に実行する会話の数")
+    parser.add_argument("--tool-latency", type=float, help="--fakeの場合の検索ツールの応答時間(秒、省略時は--latency)")
+    parser.add_argument("--deadline", type=float, help="1回のやり取りの期限(秒、省略時はREQUEST_DEADLINE)")
+    parser.add_argument("--fake-rpm", type=float, default=0, help="--fakeの場合のモデルの1分あたりの呼び出し数の上限(超えると429)")
+    args = parser.parse_args()
+
+    if args.fake:
+        os.environ["CHAT_MODEL"] = "fake"
+        os.environ["SEARCH_TOOL"] = "fake"
+        os.environ["FAKE_MODEL_LATENCY"] = str(args.latency)
+        os.environ["FAKE_TOOL_LATENCY"] = str(args.latency if args.tool_latency is None else args.tool_latency)
+        os.environ["FAKE_MODEL_RPM"] = str(args.fake_rpm)
+        os.environ.setdefault("TOOL_CACHE_PATH", "")
+        os.environ.setdefault("LANGGRAPH_CHECKPOINTER", "memory")
+    asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    main()
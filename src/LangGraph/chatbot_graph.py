@@ -0,0 +1,159 @@
+######################################################################
+# LangGraph Quickstart
+# chatbot_graph.py
+# part3~5のチャットボットの非同期版(1つのイベントループで多数の会話を処理する)
+#
+# part3~5のchatbotノードはllm_with_tools.invokeを呼び、graph.streamで実行するため、
+# 1つの会話が1つのOSスレッドをブロックする
+# build_chatbot_graph()で作成するグラフは
+# - chatbotノードがasync関数で、llm_with_tools.ainvokeを呼び出す(応答はllm_cache.pyでキャッシュする)
+# - ツールはToolNodeからainvokeで呼び出される(parallel_tools.py)
+# - モデル・ツールの呼び出しはプロバイダごとの同時実行数・レート制限の範囲内で、
+#   優先度の高いものから行う(provider_limits.py)
+# - ツール呼び出しは枠の待ち時間を含めてTOOL_TIMEOUT・リクエストの期限(config["configurable"]["deadline"])
+#   で打ち切り、失敗が続くツールは呼ばずに"tool_unavailable"を返す(tool_guard.py)
+# - モデルの呼び出し枠を待つのも期限までにし、期限を過ぎたらツールなしで回答する
+# graph.astream / graph.ainvokeで実行すれば、1つのイベントループで数百の
+# thread_idの会話を同時に処理できる
+#
+# 使用例)
+# graph = build_chatbot_graph()
+# async for event in graph.astream({"messages": [...]}, config, stream_mode="values"):
+#     ...
+######################################################################
+import os
+from typing import Annotated, Optional
+
+from langchain_core.runnables import RunnableConfig
+from langgraph.graph import START, StateGraph
+from langgraph.graph.message import add_messages
+from typing_extensions import TypedDict
+
+from chatbot_tools import create_retrieval_tools, create_search_tool, get_tool_guard
+from checkpointer import create_checkpointer
+from history_trimmer import HistoryTrimmer
+from llm_cache import cache_llm
+from message_log import MessageLogChannel
+from parallel_tools import add_tool_node
+from provider_limits import ProviderLimiter, QueueTimeout
+from tool_guard import ToolGuard, time_left
+
+# ツール名 -> プロバイダ名(同時実行数の上限の単位)
+TOOL_PROVIDERS = {"tavily_search_results_json": "tavily"}
+# モデルの応答のトークン数の見積もり(実際の使用量は応答のusage_metadataで補正する)
+OUTPUT_TOKENS_ESTIMATE = int(os.getenv("OUTPUT_TOKENS_ESTIMATE", "500"))
+
+
+######################################################################
+# State定義
+######################################################################
+class State(TypedDict):
+    messages: Annotated[list, add_messages]
+
+
+# messagesをIDの索引付きで保持するステート(message_log.py)
+class IndexedState(TypedDict):
+    messages: Annotated[list, MessageLogChannel()]
+
+
+######################################################################
+# ステートの選択
+# LANGGRAPH_MESSAGE_LOG=indexedの場合はIndexedStateを使う
+######################################################################
+def default_state_schema():
+    return IndexedState if os.getenv("LANGGRAPH_MESSAGE_LOG", "") == "indexed" else State
+
+
+######################################################################
+# チャットモデルの作成
+# CHAT_MODEL=fakeの場合はFakeToolCallingModel(fakes.py)を使う
+# FAKE_MODEL_LATENCY -> FakeToolCallingModelの応答時間(秒)
+# FAKE_MODEL_TOKENS_PER_SECOND -> FakeToolCallingModelのトークンの生成速度
+######################################################################
+def create_chat_model():
+    if os.getenv("CHAT_MODEL", "anthropic") == "fake":
+        from fakes import FakeToolCallingModel
+
+        return FakeToolCallingModel(
+            latency=float(os.getenv("FAKE_MODEL_LATENCY", "0")),
+            tokens_per_second=float(os.getenv("FAKE_MODEL_TOKENS_PER_SECOND", "0")),
+            requests_per_minute=float(os.getenv("FAKE_MODEL_RPM", "0")),
+        )
+    from langchain_anthropic import ChatAnthropic
+
+    return ChatAnthropic(model=os.getenv("ANTHROPIC_MODEL", "claude-3-5-sonnet-20240620"))
+
+
+def model_provider(llm) -> str:
+    llm_type = getattr(llm, "_llm_type", "model")
+    for provider in ("anthropic", "openai", "fake"):
+        if provider in llm_type:
+            return provider
+    return llm_type
+
+
+######################################################################
+# グラフの作成
+# 引数を省略した場合はpart3~5と同じもの(環境変数で切り替え)を使う
+# llm          -> チャットモデル
+# tools        -> ツールのリスト
+# checkpointer -> checkpointer(Noneの場合はcreate_checkpointer(name))
+# limiter      -> プロバイダごとの呼び出しのスケジューラ(同時実行数・レート制限・優先度)
+# guard        -> ツール呼び出しの期限・サーキットブレーカー(Noneの場合はget_tool_guard())
+# state_schema -> ステートの型(Noneの場合はdefault_state_schema())
+######################################################################
+def build_chatbot_graph(
+    llm=None,
+    tools: Optional[list] = None,
+    checkpointer=None,
+    trimmer: Optional[HistoryTrimmer] = None,
+    limiter: Optional[ProviderLimiter] = None,
+    guard: Optional[ToolGuard] = None,
+    state_schema=None,
+    name: str = "chatbot",
+):
+    llm = llm if llm is not None else create_chat_model()
+    tools = tools if tools is not None else create_retrieval_tools() + [create_search_tool(max_results=2)]
+    trimmer = trimmer if trimmer is not None else HistoryTrimmer.from_env(summarizer=llm)
+    limiter = limiter if limiter is not None else ProviderLimiter.from_env(TOOL_PROVIDERS)
+    guard = guard if guard is not None else get_tool_guard()
+    provider = model_provider(llm)
+    llm_with_tools = cache_llm(llm.bind_tools(tools), llm, tools)
+
+    ##################################################################
+    # チャットボットのノード関数定義(非同期)
+    # configはモデル・要約の呼び出しにそのまま渡す(Python 3.10以前の非同期実行では
+    # コールバックがcontextvarで引き継がれず、stream_mode="messages"のトークンが流れないため)
+    # 呼び出し枠を待つのはリクエストの期限まで。期限を過ぎた場合(または枠を待つ間に過ぎた場合)は
+    # 待ち行列に並ばずにツールなしのモデルで回答する(ツール呼び出しとその後の再呼び出しをしない)
+    ##################################################################
+    async def chatbot(state: dict, config: RunnableConfig):
+        messages = await trimmer.atrim(state["messages"], config)
+        # 入力のトークン数(trimmerのキャッシュを使う)と応答の分を見積もり、PROVIDER_TPMの消費に使う
+        tokens = sum(trimmer.count(m) for m in messages) + OUTPUT_TOKENS_ESTIMATE
+        left = time_left(config)
+        if left is None or left > 0:
+            try:
+                message = await limiter.call(
+                    provider, lambda: llm_with_tools.ainvoke(messages, config), tokens=tokens, timeout=left
+                )
+                return {"messages": [message]}
+            except QueueTimeout:
+                pass
+        return {"messages": [await llm.ainvoke(messages, config)]}
+
+    ##################################################################
+    # ツール呼び出し
+    # 期限は呼び出し枠の確保(limiter)を含めた時間に適用する
+    # (遅い呼び出しの判定とサーキットブレーカーには枠を待った時間を含めない)
+    ##################################################################
+    async def tool_call(request, execute):
+        return await guard.awrap_tool_call(request, execute, slot=limiter.tool_limit(request))
+
+    graph_builder = StateGraph(state_schema or default_state_schema())
+    graph_builder.add_node("chatbot", chatbot)
+    add_tool_node(graph_builder, tools, awrap_tool_call=tool_call)
+    graph_builder.add_edge(START, "chatbot")
+    if checkpointer is None:
+        checkpointer = create_checkpointer(name)
+    return graph_builder.compile(checkpointer=checkpointer)
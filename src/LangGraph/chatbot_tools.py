@@ -0,0 +1,81 @@
+######################################################################
+# LangGraph Quickstart
+# chatbot_tools.py
+# part2~5のチャットボットで使うツールの作成
+#
+# SEARCH_TOOL=fakeの場合はTavilyの代わりにFakeSearchTool(fakes.py)を使う
+# (APIキーなしでの動作確認・テスト用、応答時間はFAKE_TOOL_LATENCY(秒))
+# 検索結果はToolResultCache(tool_cache.py)でキャッシュされ、
+# 同じクエリの検索はTavilyを呼ばずに返される(TOOL_CACHE=falseで無効化)
+# ローカルのインデックス(RETRIEVER_INDEX)が作成済みの場合は、
+# その検索ツール(local_retriever.py)を検索ツールより前に追加する
+# ツール呼び出しはget_tool_guard()のToolGuard(tool_guard.py)で期限付きで実行し、
+# 失敗・遅延が続くツールは遮断する
+######################################################################
+import os
+
+from langchain_core.tools import tool
+from langgraph.types import interrupt
+
+from local_retriever import create_retrieval_tools
+
+_cache = None
+_guard = None
+
+
+def get_tool_cache():
+    global _cache
+    if _cache is None:
+        from tool_cache import ToolResultCache
+
+        _cache = ToolResultCache.from_env()
+    return _cache
+
+
+def get_tool_guard():
+    global _guard
+    if _guard is None:
+        from tool_guard import ToolGuard
+
+        _guard = ToolGuard.from_env()
+    return _guard
+
+
+######################################################################
+# 検索ツールの作成
+# TOOL_CACHE_SEARCH_TTL -> 検索結果の有効期限(秒)。未指定の場合はTOOL_CACHE_TTL
+######################################################################
+def create_search_tool(max_results: int = 2):
+    if os.getenv("SEARCH_TOOL", "tavily") == "fake":
+        from fakes import FakeSearchTool
+
+        tool = FakeSearchTool(max_results=max_results, latency=float(os.getenv("FAKE_TOOL_LATENCY", "0")))
+    else:
+        from langchain_community.tools.tavily_search import TavilySearchResults
+
+        tool = TavilySearchResults(max_results=max_results)
+    if os.getenv("TOOL_CACHE", "true").lower() in ("0", "false", "no", "off"):
+        return tool
+    ttl = os.getenv("TOOL_CACHE_SEARCH_TTL")
+    return get_tool_cache().wrap(tool, ttl=float(ttl) if ttl else None)
+
+
+######################################################################
+# 人間へのエスカレーション(part4と同じ)
+# interruptでグラフの実行を中断し、Command(resume={"data": ...})で再開した時の値を返す
+######################################################################
+@tool
+def human_assistance(query: str) -> str:
+    """Request assistance from a human."""
+    human_response = interrupt({"query": query})
+    return human_response["data"]
+
+
+######################################################################
+# チャットボットで使うツールの一覧
+######################################################################
+def create_tools(human: bool = True) -> list:
+    tools = create_retrieval_tools() + [create_search_tool(max_results=2)]
+    if human:
+        tools.append(human_assistance)
+    return tools
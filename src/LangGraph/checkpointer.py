@@ -0,0 +1,40 @@
+######################################################################
+# LangGraph Quickstart
+# checkpointer.py
+# part3~5で使うcheckpointerの作成(環境変数で切り替える)
+#
+# LANGGRAPH_CHECKPOINTER=sqlite(デフォルト) -> SqliteDeltaSaver(sqlite_delta_saver.py)
+#                                              会話をSQLiteに保存し、再起動後も保持する
+# LANGGRAPH_CHECKPOINTER=memory             -> BoundedMemorySaver(bounded_saver.py)
+#                                              会話をメモリに保持し、上限を超えたらSQLiteに退避する
+######################################################################
+import os
+
+
+def _env_float(name: str, default):
+    value = os.getenv(name)
+    return float(value) if value else default
+
+
+######################################################################
+# checkpointerの作成
+# name -> ファイル名に使う名前(part3など)
+######################################################################
+def create_checkpointer(name: str):
+    directory = os.getenv("LANGGRAPH_CHECKPOINT_DIR", ".")
+    kind = os.getenv("LANGGRAPH_CHECKPOINTER", "sqlite")
+    if kind == "memory":
+        from bounded_saver import BoundedMemorySaver
+
+        max_threads = os.getenv("LANGGRAPH_MEMORY_MAX_THREADS")
+        return BoundedMemorySaver(
+            max_bytes=int(_env_float("LANGGRAPH_MEMORY_BUDGET_MB", 64) * 1024 * 1024),
+            max_threads=int(max_threads) if max_threads else None,
+            idle_ttl=_env_float("LANGGRAPH_THREAD_IDLE_TTL", None),
+            spill_path=os.path.join(directory, f"{name}.spill.sqlite"),
+        )
+    if kind == "sqlite":
+        from sqlite_delta_saver import SqliteDeltaSaver
+
+        return SqliteDeltaSaver(os.path.join(directory, f"{name}.sqlite"))
+    raise ValueError(f"unknown LANGGRAPH_CHECKPOINTER: {kind}")
@@ -0,0 +1,93 @@
+######################################################################
+# LangGraph Quickstart
+# embeddings.py
+# ローカルで実行できる埋め込み(ベクトル化)
+#
+# HashingEmbeddings -> 単語と文字n-gramをハッシュで固定次元のベクトルに割り当てる
+#                      (feature hashing)。モデルのダウンロードや外部APIが不要で、
+#                      同じテキストは常に同じベクトルになる(プロセスをまたいでも同じ)
+#                      意味的な近さではなく表記の近さを測るため、言い回しがほぼ同じ
+#                      質問の検出などに向いている
+# LangChainのEmbeddingsと同じインターフェースなので、OpenAIEmbeddingsなどと差し替えられる
+#
+# 使用例)
+# embedder = create_embeddings()          # 環境変数EMBEDDINGSで切り替え
+# vector = embedder.embed_query("What is LangGraph?")
+######################################################################
+import math
+import os
+import re
+import unicodedata
+import zlib
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+_WORD = re.compile(r"\w+")
+
+
+class HashingEmbeddings(Embeddings):
+    ##################################################################
+    # dim   -> ベクトルの次元数
+    # ngram -> 文字n-gramの長さ(0の場合は単語のみ)
+    ##################################################################
+    def __init__(self, dim: int = 512, ngram: int = 3):
+        self.dim = dim
+        self.ngram = ngram
+
+    def _features(self, text: str) -> dict[str, float]:
+        text = unicodedata.normalize("NFKC", text).casefold()
+        counts: dict[str, float] = {}
+        for word in _WORD.findall(text):
+            counts["w:" + word] = counts.get("w:" + word, 0.0) + 1.0
+            if self.ngram:
+                # 日本語のように空白で区切られない文でも一致するように文字n-gramも使う
+                padded = f"<{word}>"
+                for i in range(max(len(padded) - self.ngram + 1, 1)):
+                    gram = "c:" + padded[i:i + self.ngram]
+                    counts[gram] = counts.get(gram, 0.0) + 0.5
+        return counts
+
+    ##################################################################
+    # ベクトル化
+    # 特徴のCRC32で次元と符号を決め、出現回数は対数で抑えてからL2正規化する
+    ##################################################################
+    def embed(self, text: str) -> np.ndarray:
+        vector = np.zeros(self.dim, dtype=np.float32)
+        for feature, count in self._features(text).items():
+            h = zlib.crc32(feature.encode("utf-8"))
+            vector[h % self.dim] += (1.0 if h & 0x80000000 else -1.0) * (1.0 + math.log(count + 1.0))
+        norm = float(np.linalg.norm(vector))
+        return vector / norm if norm else vector
+
+    def embed_documents(self, texts: list[str]) -> list[list[float]]:
+        return [self.embed(text).tolist() for text in texts]
+
+    def embed_query(self, text: str) -> list[float]:
+        return self.embed(text).tolist()
+
+
+######################################################################
+# 埋め込みの作成
+# EMBEDDINGS=hashing(デフォルト) -> HashingEmbeddings(次元数はEMBEDDINGS_DIM)
+# EMBEDDINGS=openai              -> OpenAIEmbeddings(モデルはEMBEDDINGS_MODEL)
+######################################################################
+def create_embeddings(kind: str = None) -> Embeddings:
+    kind = kind or os.getenv("EMBEDDINGS", "hashing")
+    if kind == "openai":
+        from langchain_openai import OpenAIEmbeddings
+
+        return OpenAIEmbeddings(model=os.getenv("EMBEDDINGS_MODEL", "text-embedding-3-small"))
+    return HashingEmbeddings(dim=int(os.getenv("EMBEDDINGS_DIM", "512")))
+
+
+######################################################################
+# 埋め込みをfaissで使える形(float32の2次元配列、L2正規化済み)にする
+######################################################################
+def to_matrix(vectors) -> np.ndarray:
+    matrix = np.asarray(vectors, dtype=np.float32)
+    if matrix.ndim == 1:
+        matrix = matrix.reshape(1, -1)
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return np.ascontiguousarray(matrix / norms)
@@ -0,0 +1,212 @@
+######################################################################
+# LangGraph Quickstart
+# fakes.py
+# 動作確認・テスト用のローカルなツール・チャットモデル(外部APIを呼ばない)
+#
+# FakeSearchTool        -> TavilySearchResultsと同じ名前・引数・戻り値の形式で、
+#                          クエリから決まった検索結果を返す
+# FakeToolCallingModel  -> bind_toolsに対応したチャットモデル
+#                          ユーザーのメッセージが"?"で終わる場合は検索ツール(local_knowledge_searchを優先)を、
+#                          "human"/"expert"を含む場合はhuman_assistanceツールを呼び出し、
+#                          ツールの結果を受け取ったらその内容を使って応答する
+#                          requests_per_minuteを指定すると、直近60秒の呼び出しが
+#                          それを超えた場合にFakeRateLimitError(429)を送出する
+######################################################################
+import asyncio
+import hashlib
+import json
+import threading
+import time
+import uuid
+from collections import deque
+from typing import Any, AsyncIterator, Iterator, List
+
+from langchain_core.language_models import BaseChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk, BaseMessage, HumanMessage, ToolMessage
+from langchain_core.messages.ai import UsageMetadata
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+from langchain_core.tools import BaseTool
+from langchain_core.utils.function_calling import convert_to_openai_tool
+from pydantic import BaseModel, Field
+
+
+class FakeSearchInput(BaseModel):
+    query: str = Field(description="search query to look up")
+
+
+class FakeSearchTool(BaseTool):
+    name: str = "tavily_search_results_json"
+    description: str = (
+        "A search engine optimized for comprehensive, accurate, and trusted results. "
+        "Useful for when you need to answer questions about current events. "
+        "Input should be a search query."
+    )
+    args_schema: type[BaseModel] = FakeSearchInput
+    response_format: str = "content_and_artifact"
+    max_results: int = 2
+    # 1回の検索にかかる時間(秒)
+    latency: float = 0.0
+    # 呼び出し回数(キャッシュなどの確認用)
+    calls: int = 0
+
+    def model_post_init(self, __context) -> None:
+        self._lock = threading.Lock()
+
+    def _results(self, query: str) -> tuple[list, dict]:
+        with self._lock:
+            self.calls += 1
+        digest = hashlib.sha256(query.encode("utf-8")).hexdigest()[:8]
+        results = [
+            {
+                "url": f"https://example.com/{digest}/{i}",
+                "content": f"Result {i + 1} for '{query}'.",
+            }
+            for i in range(self.max_results)
+        ]
+        return results, {"query": query, "results": results}
+
+    def _run(self, query: str, run_manager=None) -> tuple[list, dict]:
+        if self.latency:
+            time.sleep(self.latency)
+        return self._results(query)
+
+    async def _arun(self, query: str, run_manager=None) -> tuple[list, dict]:
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        return self._results(query)
+
+
+class FakeRateLimitError(Exception):
+    status_code = 429
+
+
+# モデル名 -> 直近60秒の呼び出し時刻(bind_toolsで作ったコピーとも共有する)
+_quota_calls: dict[str, deque] = {}
+_quota_lock = threading.Lock()
+
+
+class FakeToolCallingModel(BaseChatModel):
+    model_name: str = "fake-tool-caller"
+    # 最初のトークンを返すまでの時間(秒)
+    latency: float = 0.0
+    # トークンの生成速度(0以下の場合は待たない)
+    tokens_per_second: float = 0.0
+    # bind_toolsで渡されたツールの名前
+    tool_names: List[str] = []
+    # 1分あたりの呼び出し数の上限(0の場合は無制限)
+    requests_per_minute: float = 0.0
+
+    @property
+    def _llm_type(self) -> str:
+        return "fake-tool-calling-model"
+
+    def bind_tools(self, tools, **kwargs: Any):
+        names = [convert_to_openai_tool(tool)["function"]["name"] for tool in tools]
+        return self.model_copy(update={"tool_names": names})
+
+    ##################################################################
+    # 応答の生成
+    # 最後のメッセージがユーザーのメッセージの場合はツールを呼び出すかどうかを決め、
+    # ツールの結果の場合はその先頭を引用し、それ以外は入力をそのまま返す
+    ##################################################################
+    def _reply(self, messages: List[BaseMessage]) -> AIMessage:
+        last = messages[-1] if messages else HumanMessage("")
+        text = last.text
+        # ローカルの知識検索(local_knowledge_search)があればWeb検索より優先する
+        search = next((name for name in self.tool_names if "knowledge" in name), None) or next(
+            (name for name in self.tool_names if "search" in name), None
+        )
+        if isinstance(last, HumanMessage):
+            name = None
+            if "human_assistance" in self.tool_names and any(w in text.lower() for w in ("human", "expert")):
+                name = "human_assistance"
+            elif search and text.rstrip().endswith("?"):
+                name = search
+            if name:
+                tool_call = {"name": name, "args": {"query": text}, "id": f"call_{uuid.uuid4().hex[:12]}"}
+                return AIMessage("", tool_calls=[tool_call], usage_metadata=self._usage(messages, 1))
+        if isinstance(last, ToolMessage):
+            reply = f"Here is what I found: {text[:200]}"
+        else:
+            reply = f"You said: {text}"
+        return AIMessage(reply, usage_metadata=self._usage(messages, len(reply.split())))
+
+    def _usage(self, messages: List[BaseMessage], output_tokens: int) -> UsageMetadata:
+        input_tokens = sum(len(m.text.split()) for m in messages)
+        return UsageMetadata(
+            input_tokens=input_tokens,
+            output_tokens=output_tokens,
+            total_tokens=input_tokens + output_tokens,
+        )
+
+    def _check_quota(self) -> None:
+        if self.requests_per_minute <= 0:
+            return
+        now = time.monotonic()
+        with _quota_lock:
+            calls = _quota_calls.setdefault(self.model_name, deque())
+            while calls and now - calls[0] >= 60.0:
+                calls.popleft()
+            if len(calls) >= self.requests_per_minute:
+                raise FakeRateLimitError(f"{self.model_name}: rate limit exceeded ({self.requests_per_minute:g}/min)")
+            calls.append(now)
+
+    def _delay(self, message: AIMessage) -> float:
+        per_token = 1.0 / self.tokens_per_second if self.tokens_per_second > 0 else 0.0
+        return self.latency + per_token * len(message.text.split())
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs: Any) -> ChatResult:
+        self._check_quota()
+        message = self._reply(messages)
+        time.sleep(self._delay(message))
+        return ChatResult(generations=[ChatGeneration(message=message)])
+
+    async def _agenerate(self, messages, stop=None, run_manager=None, **kwargs: Any) -> ChatResult:
+        self._check_quota()
+        message = self._reply(messages)
+        await asyncio.sleep(self._delay(message))
+        return ChatResult(generations=[ChatGeneration(message=message)])
+
+    ##################################################################
+    # ストリーミング
+    # テキストは単語単位のチャンクで返し、ツール呼び出しは1つのチャンクで返す
+    ##################################################################
+    def _chunks(self, message: AIMessage) -> List[AIMessageChunk]:
+        if message.tool_calls:
+            tool_call_chunks = [
+                {"name": call["name"], "args": json.dumps(call["args"]), "id": call["id"], "index": i}
+                for i, call in enumerate(message.tool_calls)
+            ]
+            return [AIMessageChunk(content="", tool_call_chunks=tool_call_chunks, usage_metadata=message.usage_metadata)]
+        words = message.text.split(" ")
+        return [
+            AIMessageChunk(
+                content=word if i == 0 else " " + word,
+                usage_metadata=message.usage_metadata if i == len(words) - 1 else None,
+            )
+            for i, word in enumerate(words)
+        ]
+
+    def _stream(self, messages, stop=None, run_manager=None, **kwargs: Any) -> Iterator[ChatGenerationChunk]:
+        self._check_quota()
+        message = self._reply(messages)
+        per_token = 1.0 / self.tokens_per_second if self.tokens_per_second > 0 else 0.0
+        time.sleep(self.latency)
+        for i, chunk in enumerate(self._chunks(message)):
+            if i:
+                time.sleep(per_token)
+            if run_manager:
+                run_manager.on_llm_new_token(chunk.text, chunk=ChatGenerationChunk(message=chunk))
+            yield ChatGenerationChunk(message=chunk)
+
+    async def _astream(self, messages, stop=None, run_manager=None, **kwargs: Any) -> AsyncIterator[ChatGenerationChunk]:
+        self._check_quota()
+        message = self._reply(messages)
+        per_token = 1.0 / self.tokens_per_second if self.tokens_per_second > 0 else 0.0
+        await asyncio.sleep(self.latency)
+        for i, chunk in enumerate(self._chunks(message)):
+            if i:
+                await asyncio.sleep(per_token)
+            if run_manager:
+                await run_manager.on_llm_new_token(chunk.text, chunk=ChatGenerationChunk(message=chunk))
+            yield ChatGenerationChunk(message=chunk)
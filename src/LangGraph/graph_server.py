@@ -0,0 +1,317 @@
+#!/usr/bin/env python
+
+######################################################################
+# LangGraph Quickstart
+# graph_server.py
+# チェックポイント付きチャットボットのグラフ(chatbot_graph.py)をHTTPで提供する
+#
+# - 会話はURLのthread_idごとに分かれ、checkpointerに保存される
+# - /streamはSSE、/wsはWebSocketでモデルのトークンを逐次返す
+# - interrupt()で中断した会話は/resumeでCommand(resume=...)を渡して再開する
+# - 同じthread_idへのリクエストはスレッドごとのロックで1つずつ実行し、
+#   異なるthread_idのリクエストは並行して実行する
+# - モデル・ツールの呼び出しは対話的な優先度で行う(バッチ処理より先に割り当てられる)
+#   プロバイダごとの待ち行列の長さ・待ち時間は/metricsで確認できる
+# - REQUEST_DEADLINE(秒)を指定した場合は、リクエストごとにその期限を付けて実行する
+#   期限までに終わらないツール呼び出しは打ち切られ、モデルはそのツールなしで回答する(tool_guard.py)
+#
+# 実行例)
+# python graph_server.py --fake
+# curl -N -X POST localhost:8002/threads/1/stream -H 'Content-Type: application/json' \
+#      -d '{"message": "What is LangGraph?"}'
+######################################################################
+import argparse
+import asyncio
+import contextlib
+import json
+import os
+from typing import Any, AsyncIterator, Optional
+
+from fastapi import FastAPI, HTTPException, WebSocket, WebSocketDisconnect
+from fastapi.responses import PlainTextResponse, StreamingResponse
+from langchain_core.messages import BaseMessage
+from langgraph.types import Command
+from pydantic import BaseModel
+
+from token_stream import astream_events
+from tool_guard import request_config
+
+
+class ChatRequest(BaseModel):
+    message: str
+
+
+class ResumeRequest(BaseModel):
+    resume: Any = None
+
+
+######################################################################
+# スレッドごとのロック
+# 同じthread_idのグラフの実行が重なるとcheckpointerの書き込みが競合するため、
+# 実行中は他のリクエストを待たせる
+# 誰も使っていないthread_idのロックは削除する(dictが増え続けないように)
+######################################################################
+class ThreadLocks:
+    def __init__(self):
+        # thread_id -> [ロック, 使用中・待機中のリクエスト数]
+        self._locks: dict[str, list] = {}
+        self._stats = {"acquired": 0, "contended": 0}
+
+    @contextlib.asynccontextmanager
+    async def hold(self, thread_id: str):
+        entry = self._locks.setdefault(thread_id, [asyncio.Lock(), 0])
+        entry[1] += 1
+        if entry[0].locked():
+            self._stats["contended"] += 1
+        try:
+            async with entry[0]:
+                self._stats["acquired"] += 1
+                yield
+        finally:
+            entry[1] -= 1
+            if not entry[1]:
+                del self._locks[thread_id]
+
+    def stats(self) -> dict:
+        return dict(
+            self._stats,
+            threads=len(self._locks),
+            running=sum(1 for lock, _ in self._locks.values() if lock.locked()),
+            waiting=sum(max(users - 1, 0) for _, users in self._locks.values()),
+        )
+
+
+######################################################################
+# メッセージ・中断をJSONで返せる形に変換する
+######################################################################
+def message_to_dict(message: BaseMessage) -> dict:
+    data = {"type": message.type, "id": message.id, "content": message.text}
+    if getattr(message, "tool_calls", None):
+        data["tool_calls"] = [
+            {"id": call["id"], "name": call["name"], "args": call["args"]} for call in message.tool_calls
+        ]
+    if message.type == "tool":
+        data["tool_call_id"] = message.tool_call_id
+        data["name"] = message.name
+    return data
+
+
+def interrupts_to_list(interrupts) -> list:
+    return [{"id": item.id, "value": item.value} for item in interrupts]
+
+
+######################################################################
+# グラフの実行をイベントの列に変換する(token_stream.py)
+# token     -> chatbotノードのモデルが生成したテキストの断片
+# message   -> ノードが追加したメッセージ(AIMessage / ToolMessage)
+# interrupt -> interrupt()で中断した(/resumeで再開する)
+######################################################################
+async def graph_events(graph, graph_input, config: dict) -> AsyncIterator[tuple[str, Any]]:
+    async for event in astream_events(graph, graph_input, config):
+        if event[0] == "token":
+            yield "token", {"id": event[1].id, "content": event[1].text}
+        elif event[0] == "message":
+            yield "message", dict(message_to_dict(event[2]), node=event[1])
+        else:
+            yield "interrupt", interrupts_to_list(event[1])
+
+
+def sse(event: str, data: Any) -> str:
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False, default=str)}\n\n"
+
+
+def create_app(graph=None) -> FastAPI:
+    locks = ThreadLocks()
+    limiter = None
+
+    # 1. Create graph
+    # グラフ(モデル・checkpointerを含む)は起動時に作成する
+    @contextlib.asynccontextmanager
+    async def lifespan(app: FastAPI):
+        nonlocal graph, limiter
+        if graph is None:
+            from chatbot_graph import TOOL_PROVIDERS, build_chatbot_graph
+            from chatbot_tools import create_tools
+            from provider_limits import ProviderLimiter
+
+            limiter = ProviderLimiter.from_env(TOOL_PROVIDERS)
+            graph = build_chatbot_graph(tools=create_tools(), limiter=limiter, name="graph_server")
+        yield
+
+    # 2. App definition
+    app = FastAPI(
+        title="LangGraph Server",
+        version="1.0",
+        description="A chatbot graph server with per-thread checkpoints",
+        lifespan=lifespan,
+    )
+
+    def thread_config(thread_id: str) -> dict:
+        return {"configurable": {"thread_id": thread_id}}
+
+    ##################################################################
+    # 3. 入力の作成
+    # 再開の場合は中断中でなければ409を返す(ロックを取得した後に確認する)
+    ##################################################################
+    async def graph_input(thread_id: str, message: Optional[str] = None, resume: Any = None, resuming: bool = False):
+        if not resuming:
+            return {"messages": [{"role": "user", "content": message}]}
+        snapshot = await graph.aget_state(thread_config(thread_id))
+        if not snapshot.interrupts:
+            raise HTTPException(status_code=409, detail=f"thread {thread_id} is not interrupted")
+        return Command(resume=resume)
+
+    ##################################################################
+    # 4. 実行
+    # ロックを取得してからグラフを実行し、イベントを順に返す
+    # 最後に"end"イベント(中断した場合はinterrupted=True)を返す
+    ##################################################################
+    async def run(thread_id: str, **kwargs) -> AsyncIterator[tuple[str, Any]]:
+        async with locks.hold(thread_id):
+            config = request_config(thread_config(thread_id))
+            interrupted = False
+            async for event, data in graph_events(graph, await graph_input(thread_id, **kwargs), config):
+                interrupted = interrupted or event == "interrupt"
+                yield event, data
+            yield "end", {"thread_id": thread_id, "interrupted": interrupted}
+
+    async def collect(thread_id: str, **kwargs) -> dict:
+        result = {"thread_id": thread_id, "messages": [], "interrupts": []}
+        async for event, data in run(thread_id, **kwargs):
+            if event == "message":
+                result["messages"].append(data)
+            elif event == "interrupt":
+                result["interrupts"].extend(data)
+        return result
+
+    def stream(thread_id: str, **kwargs) -> StreamingResponse:
+        async def body():
+            try:
+                async for event, data in run(thread_id, **kwargs):
+                    yield sse(event, data)
+            except HTTPException as e:
+                yield sse("error", {"status": e.status_code, "detail": e.detail})
+            except Exception as e:
+                yield sse("error", {"status": 500, "detail": str(e)})
+
+        return StreamingResponse(body(), media_type="text/event-stream", headers={"Cache-Control": "no-cache"})
+
+    # 5. Adding thread routes
+    @app.post("/threads/{thread_id}/invoke")
+    async def invoke(thread_id: str, request: ChatRequest):
+        return await collect(thread_id, message=request.message)
+
+    @app.post("/threads/{thread_id}/stream")
+    async def stream_message(thread_id: str, request: ChatRequest):
+        return stream(thread_id, message=request.message)
+
+    @app.post("/threads/{thread_id}/resume")
+    async def resume(thread_id: str, request: ResumeRequest):
+        return await collect(thread_id, resume=request.resume, resuming=True)
+
+    @app.post("/threads/{thread_id}/resume/stream")
+    async def resume_stream(thread_id: str, request: ResumeRequest):
+        return stream(thread_id, resume=request.resume, resuming=True)
+
+    @app.get("/threads/{thread_id}/state")
+    async def get_state(thread_id: str):
+        snapshot = await graph.aget_state(thread_config(thread_id))
+        return {
+            "thread_id": thread_id,
+            "messages": [message_to_dict(m) for m in snapshot.values.get("messages", [])],
+            "next": list(snapshot.next),
+            "interrupts": interrupts_to_list(snapshot.interrupts),
+        }
+
+    @app.delete("/threads/{thread_id}")
+    async def delete_thread(thread_id: str):
+        async with locks.hold(thread_id):
+            await graph.checkpointer.adelete_thread(thread_id)
+        return {"thread_id": thread_id, "deleted": True}
+
+    ##################################################################
+    # 6. WebSocket
+    # クライアントは{"message": ...}または{"resume": ...}を送り、
+    # {"event": ..., "data": ...}をSSEと同じ順番で受け取る
+    # 不正なリクエスト・実行中のエラーは"error"のイベントを送り、接続はそのまま使える
+    ##################################################################
+    @app.websocket("/threads/{thread_id}/ws")
+    async def websocket_thread(websocket: WebSocket, thread_id: str):
+        await websocket.accept()
+
+        async def send_error(status: int, detail: Any):
+            await websocket.send_json({"event": "error", "data": {"status": status, "detail": detail}})
+
+        try:
+            while True:
+                try:
+                    request = await websocket.receive_json()
+                except ValueError:
+                    await send_error(400, "invalid JSON")
+                    continue
+                if not isinstance(request, dict):
+                    await send_error(400, 'expected {"message": ...} or {"resume": ...}')
+                    continue
+                if "resume" in request:
+                    kwargs = {"resume": request["resume"], "resuming": True}
+                else:
+                    kwargs = {"message": request.get("message", "")}
+                try:
+                    async for event, data in run(thread_id, **kwargs):
+                        await websocket.send_json({"event": event, "data": data})
+                except WebSocketDisconnect:
+                    raise
+                except HTTPException as e:
+                    await send_error(e.status_code, e.detail)
+                except Exception as e:
+                    await send_error(500, str(e))
+        except WebSocketDisconnect:
+            pass
+
+    # 7. Statistics
+    @app.get("/health")
+    def health():
+        return {"status": "ok"}
+
+    @app.get("/stats")
+    def stats():
+        from chatbot_tools import get_tool_guard
+        from llm_cache import get_llm_cache
+
+        result = {"threads": locks.stats()}
+        if limiter is not None:
+            result["providers"] = limiter.stats()
+            result["llm_cache"] = get_llm_cache().stats()
+            result["tools"] = get_tool_guard().stats()
+        checkpointer_stats = getattr(graph.checkpointer, "stats", None) if graph is not None else None
+        if checkpointer_stats is not None:
+            result["checkpointer"] = checkpointer_stats() if callable(checkpointer_stats) else checkpointer_stats
+        return result
+
+    # プロバイダごとの待ち行列の長さ・待ち時間など(Prometheus形式)
+    @app.get("/metrics", response_class=PlainTextResponse)
+    def metrics():
+        return limiter.render_metrics() if limiter is not None else ""
+
+    return app
+
+
+def main():
+    parser = argparse.ArgumentParser(description="チャットボットのグラフのHTTPサーバー")
+    parser.add_argument("--host", default=os.getenv("GRAPH_SERVE_HOST", "localhost"))
+    parser.add_argument("--port", type=int, default=int(os.getenv("GRAPH_SERVE_PORT", "8002")))
+    parser.add_argument("--fake", action="store_true", help="ローカルのモデルと検索ツールを使う")
+    args = parser.parse_args()
+
+    if args.fake:
+        os.environ["CHAT_MODEL"] = "fake"
+        os.environ["SEARCH_TOOL"] = "fake"
+        os.environ.setdefault("FAKE_MODEL_TOKENS_PER_SECOND", "20")
+
+    import uvicorn
+
+    uvicorn.run(create_app(), host=args.host, port=args.port)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,258 @@
+######################################################################
+# LangGraph Quickstart
+# history_trimmer.py
+# チャットボットのノードでモデルに渡すメッセージ履歴をトークン数の上限内に収める
+#
+# part3~5のchatbotノードはstate["messages"]の全てをモデルに渡しているため、
+# 会話が長くなるほどプロンプトのサイズ・レイテンシ・コストが増え続ける
+# HistoryTrimmerでは
+# - 新しいメッセージから順にトークン数の上限(max_tokens)まで残し、古いメッセージを削る
+#   ツール呼び出し(tool_callsを持つAIMessage)と対応するToolMessageは分割しない
+# - summarizerを指定した場合は、削ったメッセージを要約(rolling summary)に置き換える
+#   要約は区切り位置のメッセージIDごとにキャッシュし、区切り位置は上限の
+#   low_watermarkの割合まで一度に進めるため、要約のためのモデル呼び出しは時々しか発生しない
+# 履歴は後ろから上限に達するまでしか走査せず、トークン数もメッセージIDごとにキャッシュするため、
+# 会話が長くなっても1ターンあたりの処理時間は増えない
+#
+# 使用例)
+# trimmer = HistoryTrimmer(max_tokens=4000, summarizer=llm)
+# message = llm_with_tools.invoke(trimmer.trim(state["messages"]))
+######################################################################
+import os
+import threading
+from collections import OrderedDict
+from typing import Callable, Optional
+
+from langchain_core.messages import AIMessage, BaseMessage, HumanMessage, SystemMessage, ToolMessage
+from langchain_core.messages.utils import count_tokens_approximately
+from langchain_core.runnables import RunnableConfig
+from langchain_core.runnables.config import merge_configs
+
+SUMMARY_PROMPT = (
+    "Summarize the conversation below for the assistant that will continue it. "
+    "Keep names, facts the user provided, decisions and open questions. "
+    "If a previous summary is given, update it with the new messages. "
+    "Answer with the summary only."
+)
+SUMMARY_PREFIX = "Summary of the earlier conversation:"
+# 要約の呼び出しの設定(グラフのトークンのストリーミングから除外する)
+_SUMMARY_CONFIG = {"tags": ["nostream"]}
+
+
+class _LRU(OrderedDict):
+    def __init__(self, maxsize: int):
+        super().__init__()
+        self.maxsize = maxsize
+
+    def get(self, key, default=None):
+        if key not in self:
+            return default
+        self.move_to_end(key)
+        return self[key]
+
+    def put(self, key, value) -> None:
+        self[key] = value
+        self.move_to_end(key)
+        while len(self) > self.maxsize:
+            self.popitem(last=False)
+
+
+class HistoryTrimmer:
+    ##################################################################
+    # max_tokens      -> モデルに渡すメッセージの合計トークン数の上限
+    # summarizer      -> 削ったメッセージを要約するチャットモデル(Noneの場合は削るだけ)
+    # summary_tokens  -> 要約に割り当てるトークン数(max_tokensから差し引く)
+    # low_watermark   -> 要約する場合、区切り位置をmax_tokensのこの割合まで進める
+    # token_counter   -> メッセージ1件のトークン数を数える関数(デフォルトは文字数からの概算)
+    ##################################################################
+    def __init__(
+        self,
+        max_tokens: int = 4000,
+        summarizer=None,
+        summary_tokens: int = 500,
+        low_watermark: float = 0.6,
+        token_counter: Optional[Callable[[BaseMessage], int]] = None,
+        cache_size: int = 10000,
+    ):
+        self.max_tokens = max_tokens
+        self.summarizer = summarizer
+        self.summary_tokens = summary_tokens if summarizer is not None else 0
+        self.low_watermark = low_watermark
+        self.token_counter = token_counter or (lambda message: count_tokens_approximately([message]))
+        self._tokens = _LRU(cache_size)
+        # 区切り位置(残す最初のメッセージのID) -> 区切り位置より前の要約
+        self._summaries = _LRU(cache_size)
+        self._lock = threading.Lock()
+        self._stats = {"calls": 0, "trimmed": 0, "dropped_messages": 0, "summaries": 0, "summary_reuses": 0}
+
+    ##################################################################
+    # 環境変数から作成する
+    # HISTORY_MAX_TOKENS -> トークン数の上限(デフォルト4000)
+    # HISTORY_SUMMARY    -> trueの場合は削ったメッセージをsummarizerで要約する
+    ##################################################################
+    @classmethod
+    def from_env(cls, summarizer=None) -> "HistoryTrimmer":
+        value = os.getenv("HISTORY_SUMMARY", "")
+        summarize = value.lower() not in ("", "0", "false", "no", "off")
+        return cls(
+            max_tokens=int(os.getenv("HISTORY_MAX_TOKENS", "4000")),
+            summarizer=summarizer if summarize else None,
+        )
+
+    def count(self, message: BaseMessage) -> int:
+        if message.id is None:
+            return self.token_counter(message)
+        with self._lock:
+            tokens = self._tokens.get(message.id)
+        if tokens is None:
+            tokens = self.token_counter(message)
+            with self._lock:
+                self._tokens.put(message.id, tokens)
+        return tokens
+
+    ##################################################################
+    # メッセージのグループ分け(後ろから)
+    # tool_callsを持つAIMessageと、その後ろのToolMessageを1つのグループにする
+    # (start, end) -> messages[start:end]が1つのグループ
+    ##################################################################
+    @staticmethod
+    def _groups_backward(messages: list, stop: int):
+        i = len(messages) - 1
+        while i >= stop:
+            start = i
+            if isinstance(messages[i], ToolMessage):
+                j = i
+                while j >= stop and isinstance(messages[j], ToolMessage):
+                    j -= 1
+                has_call = j >= stop and isinstance(messages[j], AIMessage) and messages[j].tool_calls
+                start = j if has_call else j + 1
+            yield start, i + 1
+            i = start - 1
+
+    ##################################################################
+    # 上限内に収まる区切り位置を探す
+    # 戻り値 -> (区切り位置, 区切り位置以降にある要約済みの区切り位置)
+    # 最後のグループは上限を超えていても必ず残す
+    ##################################################################
+    def _find_cut(self, messages: list, head: int, budget: int):
+        cut, used, cached = len(messages), 0, None
+        for start, end in self._groups_backward(messages, head):
+            tokens = sum(self.count(message) for message in messages[start:end])
+            if used + tokens > budget and cut < len(messages):
+                break
+            used += tokens
+            cut = start
+            if self.summarizer is not None and messages[start].id in self._summaries:
+                cached = start
+        if cut <= head:
+            return cut, cached
+        # 残す履歴はユーザーのメッセージから始める
+        aligned = cut
+        while aligned < len(messages) - 1 and not isinstance(messages[aligned], HumanMessage):
+            aligned += 1
+        if isinstance(messages[aligned], HumanMessage):
+            cut = aligned
+        return cut, cached
+
+    ##################################################################
+    # メッセージ履歴を上限内に収める
+    # 非同期のノードからはatrim()を使う(要約の作成でイベントループを止めないため)
+    # 要約の呼び出しには"nostream"タグを付け、stream_mode="messages"のトークンに含めない
+    # config -> ノードのconfig(コールバックを引き継ぐ。Python 3.10以前の非同期実行では
+    #           contextvarで引き継がれないため、ノードから渡す)
+    ##################################################################
+    def trim(self, messages: list, config: Optional[RunnableConfig] = None) -> list:
+        plan = self._plan(messages)
+        if plan[0] != "summarize":
+            return plan[1]
+        _, system, messages, head, cut = plan
+        response = self.summarizer.invoke(
+            self._summary_prompt(messages, head, cut), merge_configs(config, _SUMMARY_CONFIG)
+        )
+        return self._with_summary(system, messages, cut, self._save_summary(messages, cut, response))
+
+    async def atrim(self, messages: list, config: Optional[RunnableConfig] = None) -> list:
+        plan = self._plan(messages)
+        if plan[0] != "summarize":
+            return plan[1]
+        _, system, messages, head, cut = plan
+        response = await self.summarizer.ainvoke(
+            self._summary_prompt(messages, head, cut), merge_configs(config, _SUMMARY_CONFIG)
+        )
+        return self._with_summary(system, messages, cut, self._save_summary(messages, cut, response))
+
+    ##################################################################
+    # 削る位置の決定
+    # 戻り値 -> ("done", 結果のメッセージ) または
+    #           ("summarize", システムメッセージ, メッセージ, 先頭, 区切り位置)
+    ##################################################################
+    def _plan(self, messages: list) -> tuple:
+        head = 0
+        while head < len(messages) and isinstance(messages[head], SystemMessage):
+            head += 1
+        system = messages[:head]
+        budget = self.max_tokens - self.summary_tokens - sum(self.count(message) for message in system)
+        with self._lock:
+            self._stats["calls"] += 1
+
+        cut, cached = self._find_cut(messages, head, budget)
+        if cut <= head:
+            return "done", messages
+        with self._lock:
+            self._stats["trimmed"] += 1
+
+        if self.summarizer is None:
+            with self._lock:
+                self._stats["dropped_messages"] += cut - head
+            return "done", system + messages[cut:]
+
+        if cached is not None:
+            with self._lock:
+                self._stats["summary_reuses"] += 1
+                self._stats["dropped_messages"] += cached - head
+            summary = self._summaries.get(messages[cached].id)
+            return "done", self._with_summary(system, messages, cached, summary)
+
+        # 新しい区切り位置は少し多めに進めて、次の数ターンはその要約を使い回す
+        cut, _ = self._find_cut(messages, head, int(budget * self.low_watermark))
+        cut = max(cut, head + 1)
+        with self._lock:
+            self._stats["dropped_messages"] += cut - head
+        return "summarize", system, messages, head, cut
+
+    @staticmethod
+    def _with_summary(system: list, messages: list, cut: int, summary: str) -> list:
+        return system + [SystemMessage(f"{SUMMARY_PREFIX}\n{summary}")] + messages[cut:]
+
+    ##################################################################
+    # 要約の作成
+    # 直前の区切り位置の要約に、その区切り位置からcutまでのメッセージを追加して要約し直す
+    ##################################################################
+    def _summary_prompt(self, messages: list, head: int, cut: int) -> list:
+        previous, start = None, head
+        for index in range(cut - 1, head - 1, -1):
+            if messages[index].id is not None and messages[index].id in self._summaries:
+                previous, start = self._summaries.get(messages[index].id), index
+                break
+        lines = []
+        if previous:
+            lines.append(f"Previous summary:\n{previous}\n")
+        lines.append("New messages:")
+        for message in messages[start:cut]:
+            text = message.text
+            if isinstance(message, AIMessage) and message.tool_calls:
+                text += " " + ", ".join(f"[called {call['name']}({call['args']})]" for call in message.tool_calls)
+            lines.append(f"{message.type}: {text}")
+        return [SystemMessage(SUMMARY_PROMPT), HumanMessage("\n".join(lines))]
+
+    def _save_summary(self, messages: list, cut: int, response) -> str:
+        summary = response.text.strip()
+        with self._lock:
+            if messages[cut].id is not None:
+                self._summaries.put(messages[cut].id, summary)
+            self._stats["summaries"] += 1
+        return summary
+
+    def stats(self) -> dict:
+        with self._lock:
+            return dict(self._stats, max_tokens=self.max_tokens, cached_summaries=len(self._summaries))
@@ -0,0 +1,365 @@
+######################################################################
+# LangGraph Quickstart
+# llm_cache.py
+# chatbotノードのモデル呼び出し(llm_with_tools.invoke)の応答キャッシュ
+#
+# - 完全一致 : (削った後の)履歴・バインドしたツール・モデルのハッシュをキーにする
+#              メッセージIDやツール呼び出しID(contentのブロックのid / tool_use_idなど)は
+#              毎回変わるためキーに含めない
+# - 意味検索 : 最後のメッセージがユーザーの質問の場合、その埋め込み(embeddings.py)を
+#              faissのインデックスで検索し、類似度がthreshold以上の過去の質問の応答を返す
+#              (同じモデル・ツールの組み合わせで、それ以前の会話が完全に一致するものの中だけで
+#               検索する。LLM_CACHE_SEMANTIC=trueの場合のみ有効にする)
+# - 削除     : 件数の上限(LRU)と有効期限。削除した応答は意味検索のインデックスからも外す
+# - 統計     : stats()でヒット率などを取得する
+#
+# ヒットした場合はモデルを呼び出さず、保存した応答をIDを振り直して返す
+# (同じIDのメッセージはadd_messagesで置き換えられ、同じツール呼び出しIDは
+#  ToolMessageの対応が崩れるため)
+#
+# 使用例)
+# llm_with_tools = get_llm_cache().wrap(llm.bind_tools(tools), llm, tools)
+######################################################################
+import hashlib
+import json
+import os
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from typing import Any, Optional
+
+from langchain_core.messages import AIMessage, BaseMessage, HumanMessage, convert_to_messages
+from langchain_core.runnables import Runnable, RunnableConfig
+from langchain_core.utils.function_calling import convert_to_openai_tool
+
+
+######################################################################
+# キーの作成
+# contentのブロック(Anthropicのtool_use / tool_resultなど)のIDと
+# ストリーミングの結合で付く値は除く
+######################################################################
+_VOLATILE_BLOCK_KEYS = ("id", "tool_use_id", "index", "partial_json")
+
+
+def _content_key(content: Any) -> Any:
+    if not isinstance(content, list):
+        return content
+    return [
+        {k: v for k, v in block.items() if k not in _VOLATILE_BLOCK_KEYS} if isinstance(block, dict) else block
+        for block in content
+    ]
+
+
+def _message_key(message: BaseMessage) -> list:
+    item = [message.type, _content_key(message.content)]
+    if getattr(message, "tool_calls", None):
+        item.append([[call["name"], call["args"]] for call in message.tool_calls])
+    if message.type == "tool":
+        item.append(message.name)
+    return item
+
+
+def namespace_key(llm: Any, tools: Optional[list] = None) -> str:
+    model = [getattr(llm, "_llm_type", type(llm).__name__)]
+    for attr in ("model", "model_name", "temperature"):
+        value = getattr(llm, attr, None)
+        if value is not None:
+            model.append([attr, value])
+    schemas = [convert_to_openai_tool(tool) for tool in tools or []]
+    raw = json.dumps([model, schemas], ensure_ascii=False, sort_keys=True, default=str)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()[:16]
+
+
+def llm_cache_key(namespace: str, messages: list[BaseMessage]) -> str:
+    raw = json.dumps(
+        [namespace, [_message_key(m) for m in messages]],
+        ensure_ascii=False,
+        sort_keys=True,
+        separators=(",", ":"),
+        default=str,
+    )
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+######################################################################
+# 応答のIDの振り直し
+# ツール呼び出しIDはtool_calls・content(Anthropicのtool_useブロック)・
+# additional_kwargs(OpenAIのtool_calls)の全てで同じ値に置き換える
+######################################################################
+def _fresh_copy(message: AIMessage, tier: str) -> AIMessage:
+    ids = {call["id"]: f"call_{uuid.uuid4().hex[:24]}" for call in message.tool_calls if call.get("id")}
+
+    def renamed(value):
+        if isinstance(value, dict):
+            return {k: ids.get(v, v) if k in ("id", "tool_call_id") and isinstance(v, str) else renamed(v)
+                    for k, v in value.items()}
+        if isinstance(value, list):
+            return [renamed(v) for v in value]
+        return value
+
+    return message.model_copy(update={
+        "id": f"cache-{uuid.uuid4()}",
+        "content": renamed(message.content) if ids else message.content,
+        "tool_calls": [dict(call, id=ids.get(call["id"], call["id"])) for call in message.tool_calls],
+        "additional_kwargs": renamed(message.additional_kwargs) if ids else message.additional_kwargs,
+        "response_metadata": dict(message.response_metadata, llm_cache=tier),
+        # モデルを呼び出していないのでトークン数は計上しない
+        "usage_metadata": None,
+    })
+
+
+######################################################################
+# 意味検索の段(faiss)
+# 内積(正規化したベクトルなのでコサイン類似度)で検索する
+# faissはこの段を使う場合にだけ読み込む
+######################################################################
+class _SemanticTier:
+    def __init__(self, embedder, threshold: float, k: int = 8):
+        import faiss
+
+        self._faiss = faiss
+        self.embedder = embedder
+        self.threshold = threshold
+        self.k = k
+        self._index = None
+        self._next_id = 0
+        # faissのID -> (scope, key) / key -> faissのID
+        self._entries: dict[int, tuple[str, str]] = {}
+        self._ids: dict[str, int] = {}
+
+    def embed(self, text: str):
+        from embeddings import to_matrix
+
+        return to_matrix(self.embedder.embed_query(text))
+
+    def add(self, scope: str, key: str, vector) -> None:
+        if key in self._ids:
+            return
+        if self._index is None:
+            self._index = self._faiss.IndexIDMap2(self._faiss.IndexFlatIP(vector.shape[1]))
+        faiss_id = self._next_id
+        self._next_id += 1
+        self._index.add_with_ids(vector, _ids_array(faiss_id))
+        self._entries[faiss_id] = (scope, key)
+        self._ids[key] = faiss_id
+
+    def search(self, scope: str, vector) -> Optional[tuple[str, float]]:
+        if self._index is None or not self._entries:
+            return None
+        scores, ids = self._index.search(vector, min(self.k, len(self._entries)))
+        for score, faiss_id in zip(scores[0], ids[0]):
+            if faiss_id < 0 or score < self.threshold:
+                break
+            entry = self._entries.get(int(faiss_id))
+            if entry and entry[0] == scope:
+                return entry[1], float(score)
+        return None
+
+    def remove(self, key: str) -> None:
+        faiss_id = self._ids.pop(key, None)
+        if faiss_id is not None:
+            del self._entries[faiss_id]
+            self._index.remove_ids(_ids_array(faiss_id))
+
+    def clear(self) -> None:
+        if self._index is not None:
+            self._index.reset()
+        self._entries.clear()
+        self._ids.clear()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+def _ids_array(faiss_id: int):
+    import numpy as np
+
+    return np.array([faiss_id], dtype="int64")
+
+
+######################################################################
+# 応答キャッシュ本体
+# maxsize   -> 保持する応答の最大件数(LRU)
+# ttl       -> 有効期限(秒)。0以下の場合は期限なし
+# semantic  -> Trueの場合は意味検索の段を使う
+# embedder  -> 意味検索の埋め込み(Noneの場合はcreate_embeddings())
+# threshold -> 意味検索でヒットとみなすコサイン類似度
+######################################################################
+class LLMResponseCache:
+    def __init__(
+        self,
+        maxsize: int = 1024,
+        ttl: float = 3600.0,
+        semantic: bool = False,
+        embedder=None,
+        threshold: float = 0.92,
+    ):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        # key -> (応答, 有効期限)
+        self._entries: "OrderedDict[str, tuple[AIMessage, float]]" = OrderedDict()
+        self._semantic = None
+        if semantic:
+            if embedder is None:
+                from embeddings import create_embeddings
+
+                embedder = create_embeddings()
+            self._semantic = _SemanticTier(embedder, threshold)
+        self._stats = {
+            "hits": 0, "semantic_hits": 0, "misses": 0,
+            "evictions": 0, "expirations": 0, "lookup_seconds": 0.0,
+        }
+
+    ##################################################################
+    # 環境変数から作成する
+    # LLM_CACHE_SIZE / LLM_CACHE_TTL / LLM_CACHE_SEMANTIC / LLM_CACHE_THRESHOLD
+    ##################################################################
+    @classmethod
+    def from_env(cls) -> "LLMResponseCache":
+        return cls(
+            maxsize=int(os.getenv("LLM_CACHE_SIZE", "1024")),
+            ttl=float(os.getenv("LLM_CACHE_TTL", "3600")),
+            semantic=os.getenv("LLM_CACHE_SEMANTIC", "false").lower() == "true",
+            threshold=float(os.getenv("LLM_CACHE_THRESHOLD", "0.92")),
+        )
+
+    def _semantic_text(self, messages: list[BaseMessage]) -> Optional[str]:
+        if self._semantic is None or not messages or not isinstance(messages[-1], HumanMessage):
+            return None
+        return messages[-1].text.strip() or None
+
+    ##################################################################
+    # 取得
+    # 戻り値 -> (IDを振り直した応答, "exact" / "semantic") または None
+    # 意味検索の段を使う場合は、保存用に(範囲, 埋め込み)も返す(missの後のset()で使う)
+    # 範囲は最後の質問より前の会話のキーで、会話の途中の質問は同じ会話の続きとしか一致しない
+    ##################################################################
+    def lookup(self, namespace: str, messages: list[BaseMessage]) -> tuple[str, Any, Optional[tuple[AIMessage, str]]]:
+        start = time.perf_counter()
+        key = llm_cache_key(namespace, messages)
+        text = self._semantic_text(messages)
+        semantic = None
+        if text:
+            semantic = (llm_cache_key(namespace, messages[:-1]), self._semantic.embed(text))
+        with self._lock:
+            try:
+                message = self._get(key)
+                if message is not None:
+                    self._stats["hits"] += 1
+                    return key, semantic, (_fresh_copy(message, "exact"), "exact")
+                if semantic is not None:
+                    found = self._semantic.search(*semantic)
+                    message = self._get(found[0]) if found else None
+                    if message is not None:
+                        self._stats["semantic_hits"] += 1
+                        return key, semantic, (_fresh_copy(message, "semantic"), "semantic")
+                self._stats["misses"] += 1
+                return key, semantic, None
+            finally:
+                self._stats["lookup_seconds"] += time.perf_counter() - start
+
+    def _get(self, key: str) -> Optional[AIMessage]:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        message, expires_at = entry
+        if expires_at and time.time() >= expires_at:
+            self._drop(key)
+            self._stats["expirations"] += 1
+            return None
+        self._entries.move_to_end(key)
+        return message
+
+    def _drop(self, key: str) -> None:
+        self._entries.pop(key, None)
+        if self._semantic is not None:
+            self._semantic.remove(key)
+
+    def set(self, namespace: str, key: str, message: AIMessage, semantic: Optional[tuple[str, Any]] = None) -> None:
+        expires_at = time.time() + self.ttl if self.ttl > 0 else 0.0
+        with self._lock:
+            self._entries[key] = (message, expires_at)
+            self._entries.move_to_end(key)
+            if semantic is not None:
+                scope, vector = semantic
+                self._semantic.add(scope, key, vector)
+            while len(self._entries) > self.maxsize:
+                oldest = next(iter(self._entries))
+                self._drop(oldest)
+                self._stats["evictions"] += 1
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            if self._semantic is not None:
+                self._semantic.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            stats = dict(self._stats)
+            stats["size"] = len(self._entries)
+            stats["semantic"] = self._semantic is not None
+            stats["semantic_size"] = len(self._semantic) if self._semantic is not None else 0
+        lookups = stats["hits"] + stats["semantic_hits"] + stats["misses"]
+        stats["hit_rate"] = (lookups - stats["misses"]) / lookups if lookups else 0.0
+        stats["lookup_ms_avg"] = stats.pop("lookup_seconds") / lookups * 1000 if lookups else 0.0
+        return stats
+
+    ##################################################################
+    # llm_with_toolsをキャッシュ付きにする
+    # llm   -> キーに含めるモデル(bind_tools前のもの)
+    # tools -> bind_toolsに渡したツール
+    ##################################################################
+    def wrap(self, runnable: Runnable, llm: Any = None, tools: Optional[list] = None) -> "CachedChatRunnable":
+        return CachedChatRunnable(runnable, self, namespace_key(llm if llm is not None else runnable, tools))
+
+
+######################################################################
+# キャッシュ付きのモデル呼び出し
+# invoke / ainvokeでキャッシュを確認し、ヒットしなかった場合だけ元のRunnableを呼ぶ
+# (configはそのまま渡すので、stream_mode="messages"のトークンもそのまま流れる)
+######################################################################
+class CachedChatRunnable(Runnable):
+    def __init__(self, runnable: Runnable, cache: LLMResponseCache, namespace: str):
+        self.runnable = runnable
+        self.cache = cache
+        self.namespace = namespace
+
+    def _store(self, key: str, semantic, result: Any) -> Any:
+        if isinstance(result, AIMessage) and (result.content or result.tool_calls):
+            self.cache.set(self.namespace, key, result, semantic)
+        return result
+
+    def invoke(self, input: Any, config: Optional[RunnableConfig] = None, **kwargs: Any) -> Any:
+        key, semantic, hit = self.cache.lookup(self.namespace, convert_to_messages(input))
+        if hit is not None:
+            return hit[0]
+        return self._store(key, semantic, self.runnable.invoke(input, config, **kwargs))
+
+    async def ainvoke(self, input: Any, config: Optional[RunnableConfig] = None, **kwargs: Any) -> Any:
+        key, semantic, hit = self.cache.lookup(self.namespace, convert_to_messages(input))
+        if hit is not None:
+            return hit[0]
+        return self._store(key, semantic, await self.runnable.ainvoke(input, config, **kwargs))
+
+
+######################################################################
+# プロセス内で共有するキャッシュ
+# LLM_CACHE=trueの場合のみキャッシュする。未指定の場合はllm_with_toolsをそのまま返す
+######################################################################
+_llm_cache: Optional[LLMResponseCache] = None
+
+
+def get_llm_cache() -> LLMResponseCache:
+    global _llm_cache
+    if _llm_cache is None:
+        _llm_cache = LLMResponseCache.from_env()
+    return _llm_cache
+
+
+def cache_llm(llm_with_tools: Runnable, llm: Any = None, tools: Optional[list] = None) -> Runnable:
+    if os.getenv("LLM_CACHE", "false").lower() in ("", "0", "false", "no", "off"):
+        return llm_with_tools
+    return get_llm_cache().wrap(llm_with_tools, llm, tools)
@@ -0,0 +1,519 @@
+######################################################################
+# LangGraph Quickstart
+# local_retriever.py
+# ローカルのベクトルインデックスを検索するツール(Web検索の代わりに手元の文書を引く)
+#
+# - インデックス : faiss(デフォルト)またはChroma(RETRIEVER_BACKEND=chroma)
+#                  faissのインデックスはファイルに保存し、起動時はメモリマップで開くため、
+#                  文書の量に関係なくすぐに使い始められる
+#                  チャンクの本文・出典はSQLite(chunks.sqlite)に保存する
+# - 取り込み     : ファイルをチャンクに分割し、batch_size件ずつまとめて埋め込みを計算して
+#                  インデックスに追加する。同じ内容のチャンクは取り込み直さない
+# - 埋め込み     : embeddings.pyのcreate_embeddings()。取り込み時の設定はmeta.jsonに保存し、
+#                  検索時も同じものを使う
+# - ツール       : LocalKnowledgeSearch(ToolNode / tools_conditionでそのまま使える)
+#
+# 実行例)
+# python local_retriever.py ingest ./docs --index knowledge_index
+# python local_retriever.py query "LangGraphのcheckpointerとは" --index knowledge_index
+######################################################################
+import argparse
+import asyncio
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from typing import Iterable, Iterator, Optional
+
+from langchain_core.tools import BaseTool
+from pydantic import BaseModel, Field
+
+DEFAULT_INDEX = "knowledge_index"
+TEXT_EXTENSIONS = (".txt", ".md", ".rst")
+
+
+######################################################################
+# チャンク分割
+# 段落(空行)の区切りを優先してchunk_size文字以内にまとめ、
+# 長い段落はoverlap文字ずつ重ねて切る
+######################################################################
+def split_text(text: str, chunk_size: int = 800, overlap: int = 100) -> list[str]:
+    chunks: list[str] = []
+    current = ""
+    for paragraph in (p.strip() for p in text.split("\n\n")):
+        if not paragraph:
+            continue
+        if current and len(current) + len(paragraph) + 2 > chunk_size:
+            chunks.append(current)
+            current = ""
+        while len(paragraph) > chunk_size:
+            chunks.append(paragraph[:chunk_size])
+            paragraph = paragraph[chunk_size - overlap:]
+        current = f"{current}\n\n{paragraph}" if current else paragraph
+    if current:
+        chunks.append(current)
+    return chunks
+
+
+def iter_files(paths: Iterable[str]) -> Iterator[str]:
+    for path in paths:
+        if os.path.isdir(path):
+            for root, _, files in os.walk(path):
+                for name in sorted(files):
+                    if name.endswith(TEXT_EXTENSIONS):
+                        yield os.path.join(root, name)
+        elif os.path.isfile(path):
+            yield path
+
+
+def iter_chunks(paths: Iterable[str], chunk_size: int, overlap: int) -> Iterator[dict]:
+    for path in iter_files(paths):
+        with open(path, encoding="utf-8", errors="replace") as f:
+            text = f.read()
+        for i, chunk in enumerate(split_text(text, chunk_size, overlap)):
+            yield {"source": path, "chunk": i, "text": chunk}
+
+
+######################################################################
+# チャンクの保存(SQLite)
+# idはfaissのIDとしても使う
+######################################################################
+class _ChunkStore:
+    def __init__(self, path: str):
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS chunks ("
+            " id INTEGER PRIMARY KEY, hash TEXT UNIQUE NOT NULL,"
+            " source TEXT NOT NULL, chunk INTEGER NOT NULL, text TEXT NOT NULL)"
+        )
+        self._conn.commit()
+
+    def new_chunks(self, chunks: list[dict], pending: Iterable[str] = ()) -> list[dict]:
+        # 取り込み済み(同じ内容)のチャンクと、pending(追加済みで未保存のハッシュ)を除く
+        hashes = [hashlib.sha256(c["text"].encode("utf-8")).hexdigest() for c in chunks]
+        with self._lock:
+            placeholders = ",".join("?" * len(hashes))
+            known = {row[0] for row in self._conn.execute(
+                f"SELECT hash FROM chunks WHERE hash IN ({placeholders})", hashes
+            )}
+        seen = set(pending)
+        result = []
+        for chunk, digest in zip(chunks, hashes):
+            if digest not in known and digest not in seen:
+                seen.add(digest)
+                result.append(dict(chunk, hash=digest))
+        return result
+
+    def max_id(self) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT COALESCE(MAX(id), -1) FROM chunks").fetchone()[0]
+
+    def add(self, chunks: list[dict], ids: Optional[list[int]] = None, before_commit=None) -> list[int]:
+        # before_commitはINSERTの後・コミットの前に呼び、失敗した場合はINSERTも取り消す
+        with self._lock:
+            if ids is None:
+                cursor = self._conn.execute("SELECT COALESCE(MAX(id), -1) FROM chunks")
+                start = cursor.fetchone()[0] + 1
+                ids = list(range(start, start + len(chunks)))
+            try:
+                self._conn.executemany(
+                    "INSERT INTO chunks (id, hash, source, chunk, text) VALUES (?, ?, ?, ?, ?)",
+                    [(i, c["hash"], c["source"], c["chunk"], c["text"]) for i, c in zip(ids, chunks)],
+                )
+                if before_commit is not None:
+                    before_commit()
+                self._conn.commit()
+            except BaseException:
+                self._conn.rollback()
+                raise
+        return ids
+
+    def get(self, ids: list[int]) -> dict[int, dict]:
+        if not ids:
+            return {}
+        with self._lock:
+            placeholders = ",".join("?" * len(ids))
+            rows = self._conn.execute(
+                f"SELECT id, source, chunk, text FROM chunks WHERE id IN ({placeholders})", ids
+            ).fetchall()
+        return {row[0]: {"source": row[1], "chunk": row[2], "text": row[3]} for row in rows}
+
+    def count(self) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM chunks").fetchone()[0]
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+
+######################################################################
+# faissのインデックス
+# 内積(正規化したベクトルなのでコサイン類似度)で検索する
+# nlistを指定した場合はIVF(転置インデックス)で、nprobe個のクラスタだけを検索する
+# 検索用はメモリマップ・読み取り専用で開き、取り込み時は全体を読み込んで
+# 一時ファイルに書き出してから置き換える
+# チャンクの行はsave()でインデックスを置き換えてから同じトランザクションでコミットする
+# (途中で落ちた場合はどちらにも残らないか、インデックスにだけ残ったIDを次の取り込みで削除する)
+######################################################################
+class FaissStore:
+    def __init__(self, directory: str, nlist: int = 0, nprobe: int = 8, writable: bool = False):
+        import faiss
+
+        self._faiss = faiss
+        self.directory = directory
+        self.nlist = nlist
+        self.nprobe = nprobe
+        self.path = os.path.join(directory, "index.faiss")
+        self.chunks = _ChunkStore(os.path.join(directory, "chunks.sqlite"))
+        self.index = None
+        self._pending: list = []
+        self._unsaved: list[dict] = []
+        self._unsaved_ids: list[int] = []
+        self._unsaved_hashes: set[str] = set()
+        self._dirty = False
+        if os.path.exists(self.path):
+            flags = 0 if writable else faiss.IO_FLAG_MMAP_IFC | faiss.IO_FLAG_READ_ONLY
+            self.index = faiss.read_index(self.path, flags)
+            ivf = faiss.try_extract_index_ivf(self.index)
+            if ivf is not None:
+                ivf.nprobe = nprobe
+        self._next_id = self.chunks.max_id() + 1
+        if writable and self.index is not None:
+            self._remove_orphans()
+
+    def _remove_orphans(self) -> None:
+        # チャンクの行をコミットする前に落ちた場合、インデックスにだけIDが残る
+        import numpy as np
+
+        ids = self._faiss.vector_to_array(self.index.id_map)
+        orphans = ids[ids >= self._next_id]
+        if len(orphans):
+            self.index.remove_ids(np.asarray(orphans, dtype="int64"))
+            self._dirty = True
+
+    def _create(self, vectors) -> None:
+        faiss = self._faiss
+        dim = vectors.shape[1]
+        if self.nlist and len(vectors) >= self.nlist * 39:
+            quantizer = faiss.IndexFlatIP(dim)
+            ivf = faiss.IndexIVFFlat(quantizer, dim, self.nlist, faiss.METRIC_INNER_PRODUCT)
+            ivf.train(vectors)
+            ivf.nprobe = self.nprobe
+            self.index = faiss.IndexIDMap2(ivf)
+        else:
+            self.index = faiss.IndexIDMap2(faiss.IndexFlatIP(dim))
+
+    def new_chunks(self, chunks: list[dict]) -> list[dict]:
+        return self.chunks.new_chunks(chunks, pending=self._unsaved_hashes)
+
+    def add(self, chunks: list[dict], vectors) -> None:
+        import numpy as np
+
+        ids = list(range(self._next_id, self._next_id + len(chunks)))
+        self._next_id += len(chunks)
+        self._unsaved.extend(chunks)
+        self._unsaved_ids.extend(ids)
+        self._unsaved_hashes.update(c["hash"] for c in chunks)
+        if self.index is None:
+            if self.nlist:
+                # IVFの学習用に、最初の取り込みのベクトルをまとめてから作成する
+                self._pending.append((ids, vectors))
+                return
+            self._create(vectors)
+        self.index.add_with_ids(vectors, np.asarray(ids, dtype="int64"))
+
+    def save(self) -> None:
+        import numpy as np
+
+        if self._pending:
+            vectors = np.concatenate([v for _, v in self._pending])
+            self._create(vectors)
+            for ids, batch in self._pending:
+                self.index.add_with_ids(batch, np.asarray(ids, dtype="int64"))
+            self._pending = []
+        if self.index is None or not (self._unsaved or self._dirty):
+            return
+        tmp = self.path + ".tmp"
+        self._faiss.write_index(self.index, tmp)
+        self.chunks.add(self._unsaved, self._unsaved_ids, before_commit=lambda: os.replace(tmp, self.path))
+        self._unsaved, self._unsaved_ids = [], []
+        self._unsaved_hashes.clear()
+        self._dirty = False
+
+    def search(self, vector, k: int) -> list[tuple[int, float]]:
+        if self.index is None or self.index.ntotal == 0:
+            return []
+        scores, ids = self.index.search(vector, k)
+        return [(int(i), float(s)) for s, i in zip(scores[0], ids[0]) if i >= 0]
+
+    def count(self) -> int:
+        return 0 if self.index is None else int(self.index.ntotal)
+
+
+######################################################################
+# Chromaのインデックス
+# 埋め込みはこちらで計算して渡す(Chromaの埋め込み関数は使わない)
+# チャンクの本文は検索結果を揃えるため、faissと同じくSQLiteに保存する
+######################################################################
+class ChromaStore:
+    def __init__(self, directory: str, **kwargs):
+        import chromadb
+
+        self.directory = directory
+        self.chunks = _ChunkStore(os.path.join(directory, "chunks.sqlite"))
+        client = chromadb.PersistentClient(path=os.path.join(directory, "chroma"))
+        self.collection = client.get_or_create_collection("chunks", metadata={"hnsw:space": "cosine"})
+
+    def new_chunks(self, chunks: list[dict]) -> list[dict]:
+        return self.chunks.new_chunks(chunks)
+
+    def add(self, chunks: list[dict], vectors) -> None:
+        # Chromaへの追加が成功してからチャンクをコミットする(失敗した場合は取り込み直せるようにする)
+        # コミットに失敗して残ったベクトルは、次回同じidで上書きされる
+        start = self.chunks.max_id() + 1
+        ids = list(range(start, start + len(chunks)))
+        self.chunks.add(
+            chunks,
+            ids,
+            before_commit=lambda: self.collection.upsert(ids=[str(i) for i in ids], embeddings=vectors.tolist()),
+        )
+
+    def save(self) -> None:
+        pass
+
+    def search(self, vector, k: int) -> list[tuple[int, float]]:
+        if self.collection.count() == 0:
+            return []
+        result = self.collection.query(query_embeddings=vector.tolist(), n_results=k, include=["distances"])
+        return [(int(i), 1.0 - float(d)) for i, d in zip(result["ids"][0], result["distances"][0])]
+
+    def count(self) -> int:
+        return self.collection.count()
+
+
+######################################################################
+# インデックスを開く
+# 取り込み時の設定(バックエンド・埋め込み)はmeta.jsonに保存し、次回以降はそれに従う
+######################################################################
+def _read_meta(directory: str) -> dict:
+    path = os.path.join(directory, "meta.json")
+    if not os.path.exists(path):
+        return {}
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def _write_meta(directory: str, meta: dict) -> None:
+    with open(os.path.join(directory, "meta.json"), "w", encoding="utf-8") as f:
+        json.dump(meta, f, ensure_ascii=False, indent=2)
+
+
+def open_store(directory: str, backend: Optional[str] = None, writable: bool = False, **kwargs):
+    meta = _read_meta(directory)
+    backend = meta.get("backend") or backend or os.getenv("RETRIEVER_BACKEND", "faiss")
+    if backend == "chroma":
+        return ChromaStore(directory, **kwargs)
+    return FaissStore(directory, writable=writable, **kwargs)
+
+
+def _embedder_for(meta: dict):
+    from embeddings import HashingEmbeddings, create_embeddings
+
+    if meta.get("embeddings", "hashing") == "hashing":
+        return HashingEmbeddings(dim=meta.get("dim", 512))
+    return create_embeddings(meta["embeddings"])
+
+
+######################################################################
+# 取り込み
+# paths      -> ファイルまたはディレクトリ(.txt / .md / .rst)
+# batch_size -> 1回にまとめて埋め込みを計算・追加するチャンク数
+######################################################################
+def ingest(
+    paths: Iterable[str],
+    directory: str = DEFAULT_INDEX,
+    backend: Optional[str] = None,
+    batch_size: int = 256,
+    chunk_size: int = 800,
+    overlap: int = 100,
+    nlist: int = 0,
+) -> dict:
+    from embeddings import to_matrix
+
+    os.makedirs(directory, exist_ok=True)
+    meta = _read_meta(directory)
+    if not meta:
+        kind = os.getenv("EMBEDDINGS", "hashing")
+        meta = {
+            "backend": backend or os.getenv("RETRIEVER_BACKEND", "faiss"),
+            "embeddings": kind,
+            "dim": int(os.getenv("EMBEDDINGS_DIM", "512")),
+        }
+        _write_meta(directory, meta)
+    embedder = _embedder_for(meta)
+    store = open_store(directory, writable=True, **({"nlist": nlist} if meta["backend"] == "faiss" else {}))
+
+    stats = {"chunks": 0, "added": 0, "skipped": 0}
+    start = time.perf_counter()
+    batch: list[dict] = []
+
+    def flush():
+        new = store.new_chunks(batch)
+        stats["skipped"] += len(batch) - len(new)
+        if new:
+            store.add(new, to_matrix(embedder.embed_documents([c["text"] for c in new])))
+            stats["added"] += len(new)
+        batch.clear()
+
+    for chunk in iter_chunks(paths, chunk_size, overlap):
+        stats["chunks"] += 1
+        batch.append(chunk)
+        if len(batch) >= batch_size:
+            flush()
+    if batch:
+        flush()
+    store.save()
+    stats["total"] = store.count()
+    stats["seconds"] = time.perf_counter() - start
+    return stats
+
+
+######################################################################
+# 検索
+# インデックス(メモリマップ)は最初の検索の時に開く
+######################################################################
+class LocalRetriever:
+    def __init__(self, directory: str = DEFAULT_INDEX, k: int = 4, min_score: float = 0.0):
+        self.directory = directory
+        self.k = k
+        self.min_score = min_score
+        self._lock = threading.Lock()
+        self._store = None
+        self._embedder = None
+        self._stats = {"queries": 0, "seconds": 0.0}
+
+    def _open(self):
+        with self._lock:
+            if self._store is None:
+                meta = _read_meta(self.directory)
+                self._embedder = _embedder_for(meta)
+                self._store = open_store(self.directory)
+        return self._store
+
+    def search(self, query: str, k: Optional[int] = None) -> list[dict]:
+        from embeddings import to_matrix
+
+        store = self._open()
+        start = time.perf_counter()
+        hits = store.search(to_matrix(self._embedder.embed_query(query)), k or self.k)
+        hits = [(i, score) for i, score in hits if score >= self.min_score]
+        chunks = store.chunks.get([i for i, _ in hits])
+        results = [dict(chunks[i], score=round(score, 4)) for i, score in hits if i in chunks]
+        self._stats["queries"] += 1
+        self._stats["seconds"] += time.perf_counter() - start
+        return results
+
+    def embeds_locally(self) -> bool:
+        # HashingEmbeddingsはプロセス内で計算するため、外部APIを呼ばない
+        from embeddings import HashingEmbeddings
+
+        self._open()
+        return isinstance(self._embedder, HashingEmbeddings)
+
+    def stats(self) -> dict:
+        queries = self._stats["queries"]
+        return {
+            "queries": queries,
+            "latency_ms_avg": self._stats["seconds"] / queries * 1000 if queries else 0.0,
+            "chunks": self._store.count() if self._store is not None else None,
+        }
+
+
+######################################################################
+# ツール
+# 戻り値はTavilySearchResultsと同じく(content, artifact)の形式にする
+######################################################################
+class LocalKnowledgeInput(BaseModel):
+    query: str = Field(description="question or keywords to look up in the local knowledge base")
+
+
+class LocalKnowledgeSearch(BaseTool):
+    name: str = "local_knowledge_search"
+    description: str = (
+        "Search the local knowledge base of ingested documents. "
+        "Prefer this over web search for questions the documents may cover. "
+        "Input should be a search query."
+    )
+    args_schema: type[BaseModel] = LocalKnowledgeInput
+    response_format: str = "content_and_artifact"
+    retriever: LocalRetriever
+
+    def _run(self, query: str, run_manager=None) -> tuple[str, dict]:
+        results = self.retriever.search(query)
+        content = json.dumps(
+            [{"source": r["source"], "content": r["text"], "score": r["score"]} for r in results],
+            ensure_ascii=False,
+        )
+        return content, {"query": query, "results": results}
+
+    async def _arun(self, query: str, run_manager=None) -> tuple[str, dict]:
+        # HashingEmbeddingsなら数ミリ秒で終わるため、イベントループ上でそのまま実行する
+        # それ以外(OpenAIなど)は埋め込みAPIの呼び出しでイベントループを止めないよう、別スレッドで実行する
+        if self.retriever.embeds_locally():
+            return self._run(query)
+        return await asyncio.to_thread(self._run, query)
+
+
+######################################################################
+# part2~5用
+# RETRIEVER_INDEXのインデックスが作成済みの場合だけツールを返す
+# (faiss / chromadbは最初の検索まで読み込まない)
+######################################################################
+def create_retrieval_tools(directory: Optional[str] = None, k: Optional[int] = None) -> list:
+    directory = directory or os.getenv("RETRIEVER_INDEX", DEFAULT_INDEX)
+    if not os.path.exists(os.path.join(directory, "meta.json")):
+        return []
+    k = k or int(os.getenv("RETRIEVER_K", "4"))
+    min_score = float(os.getenv("RETRIEVER_MIN_SCORE", "0.2"))
+    return [LocalKnowledgeSearch(retriever=LocalRetriever(directory, k=k, min_score=min_score))]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="ローカルのベクトルインデックスの取り込み・検索")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    ingest_parser = subparsers.add_parser("ingest", help="ファイルを取り込む")
+    ingest_parser.add_argument("paths", nargs="+", help="ファイルまたはディレクトリ")
+    ingest_parser.add_argument("--index", default=os.getenv("RETRIEVER_INDEX", DEFAULT_INDEX))
+    ingest_parser.add_argument("--backend", choices=["faiss", "chroma"])
+    ingest_parser.add_argument("--batch-size", type=int, default=256)
+    ingest_parser.add_argument("--chunk-size", type=int, default=800)
+    ingest_parser.add_argument("--overlap", type=int, default=100)
+    ingest_parser.add_argument("--nlist", type=int, default=0, help="faissのIVFのクラスタ数(0の場合は全件検索)")
+    query_parser = subparsers.add_parser("query", help="検索する")
+    query_parser.add_argument("query")
+    query_parser.add_argument("--index", default=os.getenv("RETRIEVER_INDEX", DEFAULT_INDEX))
+    query_parser.add_argument("-k", type=int, default=4)
+    args = parser.parse_args()
+
+    if args.command == "ingest":
+        stats = ingest(
+            args.paths, args.index, backend=args.backend, batch_size=args.batch_size,
+            chunk_size=args.chunk_size, overlap=args.overlap, nlist=args.nlist,
+        )
+        print(f"chunks={stats['chunks']} added={stats['added']} skipped={stats['skipped']} "
+              f"total={stats['total']} seconds={stats['seconds']:.2f}")
+    else:
+        retriever = LocalRetriever(args.index, k=args.k)
+        for result in retriever.search(args.query):
+            print(f"[{result['score']:.3f}] {result['source']}#{result['chunk']}")
+            print("    " + result["text"][:200].replace("\n", " "))
+        print(f"latency={retriever.stats()['latency_ms_avg']:.2f}ms")
+
+
+if __name__ == "__main__":
+    main()
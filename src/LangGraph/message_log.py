@@ -0,0 +1,241 @@
+######################################################################
+# LangGraph Quickstart
+# message_log.py
+# メッセージIDで索引を持つメッセージ履歴(add_messagesの代替)
+#
+# add_messagesは更新のたびに、既存の全メッセージの変換・IDの辞書の作成・
+# リストのコピーをPythonのループで行うため、1ステップごとに履歴の長さに比例した
+# 時間がかかる(数千件のメッセージ・ツール結果を持つスレッドでは無視できない)
+# MessageLogは
+# - ID -> 位置の索引を保持し、追加は償却O(1)、IDによる置き換えはO(1)で行う
+# - 削除はまとめて1回の詰め直しと索引の再作成で行う
+# - listのサブクラスなので、checkpointerにはそのままリストとして保存される
+#
+# グラフのステートで使う場合は、チャンネルにMessageLogChannelを指定する
+# class State(TypedDict):
+#     messages: Annotated[list, MessageLogChannel()]
+#
+# チャンネルの値はノードへの受け渡しやcheckpointの作成で外部から参照されるため、
+# 参照された後の最初の更新では1回だけコピー(C実装のlist/dictのコピー)してから
+# 書き換える(コピーオンライト)
+# 通常のreducerとして使う場合は add_messages の代わりに merge_messages を指定する
+# (こちらは毎回コピーするが、既存のメッセージをPythonのループで処理しない)
+######################################################################
+import uuid
+from typing import Any, Iterable, Optional, Sequence
+
+from langchain_core.messages import BaseMessage, BaseMessageChunk, RemoveMessage, convert_to_messages, message_chunk_to_message
+from langgraph.channels.base import BaseChannel
+from langgraph.graph.message import REMOVE_ALL_MESSAGES
+
+
+def _coerce(messages: Any) -> list[BaseMessage]:
+    if not isinstance(messages, (list, tuple)):
+        messages = [messages]
+    result = []
+    for message in convert_to_messages(messages):
+        if isinstance(message, BaseMessageChunk):
+            message = message_chunk_to_message(message)
+        if message.id is None:
+            message.id = str(uuid.uuid4())
+        result.append(message)
+    return result
+
+
+class MessageLog(list):
+    ##################################################################
+    # messages -> 初期値(メッセージ、またはconvert_to_messagesで変換できるもの)
+    ##################################################################
+    def __init__(self, messages: Iterable = ()):
+        super().__init__(_coerce(list(messages)) if messages else ())
+        self._index: Optional[dict[str, int]] = None
+        # Trueの場合は外部から参照されているため、書き換える前にコピーする
+        self._shared = False
+
+    ##################################################################
+    # 変換済みのメッセージ(checkpointから読み込んだものなど)から作成する
+    # IDが付いたBaseMessageのリストであることを前提とし、変換・確認は行わない
+    ##################################################################
+    @classmethod
+    def from_messages(cls, messages: list) -> "MessageLog":
+        log = cls()
+        list.extend(log, messages)
+        return log
+
+    ##################################################################
+    # 索引
+    # listのメソッドで直接書き換えられた場合は破棄し、次に使う時に作り直す
+    ##################################################################
+    @property
+    def id_index(self) -> dict[str, int]:
+        if self._index is None:
+            self._index = {message.id: i for i, message in enumerate(self)}
+        return self._index
+
+    def position(self, message_id: str) -> Optional[int]:
+        return self.id_index.get(message_id)
+
+    def get(self, message_id: str, default: Optional[BaseMessage] = None) -> Optional[BaseMessage]:
+        i = self.id_index.get(message_id)
+        return default if i is None else self[i]
+
+    def has(self, message_id: str) -> bool:
+        return message_id in self.id_index
+
+    ##################################################################
+    # 追加・置き換え・削除(add_messagesと同じ規則)
+    # - IDが既にあるメッセージはその位置で置き換える
+    # - RemoveMessage(id)はそのメッセージを削除する(存在しないIDはValueError)
+    # - RemoveMessage(REMOVE_ALL_MESSAGES)はそれ以前の全てを削除する
+    # このオブジェクト自体を書き換えて返す
+    ##################################################################
+    def merge(self, messages: Any) -> "MessageLog":
+        right = _coerce(messages)
+        for i in range(len(right) - 1, -1, -1):
+            if isinstance(right[i], RemoveMessage) and right[i].id == REMOVE_ALL_MESSAGES:
+                self.clear()
+                right = right[i + 1:]
+                break
+        index = self.id_index
+        removed: set[str] = set()
+        for message in right:
+            position = index.get(message.id)
+            if position is None:
+                if isinstance(message, RemoveMessage):
+                    raise ValueError(f"Attempting to delete a message with an ID that doesn't exist ('{message.id}')")
+                index[message.id] = len(self)
+                super().append(message)
+            elif isinstance(message, RemoveMessage):
+                removed.add(message.id)
+            else:
+                removed.discard(message.id)
+                super().__setitem__(position, message)
+        if removed:
+            self.remove_ids(removed)
+        return self
+
+    def append(self, message: Any) -> None:
+        self.merge([message])
+
+    def extend(self, messages: Iterable) -> None:
+        self.merge(list(messages))
+
+    def replace(self, message: BaseMessage) -> None:
+        position = self.id_index.get(message.id)
+        if position is None:
+            raise KeyError(message.id)
+        super().__setitem__(position, message)
+
+    def remove_ids(self, message_ids: Iterable[str]) -> None:
+        message_ids = set(message_ids)
+        kept = [message for message in self if message.id not in message_ids]
+        super().__setitem__(slice(None), kept)
+        self._index = None
+
+    ##################################################################
+    # listのメソッドで直接書き換えた場合は索引を作り直す
+    ##################################################################
+    def _invalidate(name):
+        method = getattr(list, name)
+
+        def wrapper(self, *args, **kwargs):
+            result = method(self, *args, **kwargs)
+            self._index = None
+            return result
+
+        wrapper.__name__ = name
+        return wrapper
+
+    __setitem__ = _invalidate("__setitem__")
+    __delitem__ = _invalidate("__delitem__")
+    __iadd__ = _invalidate("__iadd__")
+    insert = _invalidate("insert")
+    pop = _invalidate("pop")
+    remove = _invalidate("remove")
+    clear = _invalidate("clear")
+    sort = _invalidate("sort")
+    reverse = _invalidate("reverse")
+    del _invalidate
+
+    ##################################################################
+    # コピー(list・索引ともにC実装のコピーで、メッセージは共有する)
+    ##################################################################
+    def copy(self) -> "MessageLog":
+        clone = MessageLog.from_messages(self)
+        clone._index = self.id_index.copy()
+        return clone
+
+    __copy__ = copy
+
+    def __reduce__(self):
+        return (MessageLog, (list(self),))
+
+
+######################################################################
+# reducer版
+# Annotated[list, merge_messages]のように、add_messagesの代わりに使う
+# leftを書き換えないように毎回コピーしてから追加する
+######################################################################
+def merge_messages(left: Sequence, right: Any) -> MessageLog:
+    log = left.copy() if isinstance(left, MessageLog) else MessageLog(left)
+    return log.merge(right)
+
+
+######################################################################
+# チャンネル版
+# 値(MessageLog)を外部に渡した後(get / checkpoint / copy)の最初の更新でだけコピーし、
+# 同じステップ内の複数の更新や、参照されていない間の更新はその場で追加する
+######################################################################
+class MessageLogChannel(BaseChannel):
+    __slots__ = ("value",)
+
+    def __init__(self, typ: Any = list, key: str = ""):
+        super().__init__(typ, key)
+        self.value = MessageLog()
+
+    def __eq__(self, other: object) -> bool:
+        return isinstance(other, MessageLogChannel)
+
+    def __hash__(self) -> int:
+        return hash(MessageLogChannel)
+
+    @property
+    def ValueType(self) -> Any:
+        return list
+
+    @property
+    def UpdateType(self) -> Any:
+        return Any
+
+    def _share(self) -> MessageLog:
+        self.value._shared = True
+        return self.value
+
+    def copy(self) -> "MessageLogChannel":
+        channel = MessageLogChannel(self.typ, self.key)
+        channel.value = self._share()
+        return channel
+
+    def from_checkpoint(self, checkpoint: Any) -> "MessageLogChannel":
+        channel = MessageLogChannel(self.typ, self.key)
+        if isinstance(checkpoint, list):
+            channel.value = MessageLog.from_messages(checkpoint)
+        return channel
+
+    def checkpoint(self) -> MessageLog:
+        return self._share()
+
+    def get(self) -> MessageLog:
+        return self._share()
+
+    def is_available(self) -> bool:
+        return True
+
+    def update(self, values: Sequence[Any]) -> bool:
+        if not values:
+            return False
+        if self.value._shared:
+            self.value = self.value.copy()
+        for value in values:
+            self.value.merge(value)
+        return True
@@ -0,0 +1,65 @@
+######################################################################
+# LangGraph Quickstart
+# parallel_tools.py
+# 複数のツール呼び出しを並列に実行する
+#
+# ToolNodeはモデルが返した全てのツール呼び出しを1つのタスクとして実行するため、
+# その中の1つがinterrupt()で中断すると、再開時(Command(resume=...))に
+# 完了済みのツールも含めて全て実行し直される
+# (part4/part5ではこれを避けるため、ツール呼び出しを1回に制限していた)
+# ここではSend APIでツール呼び出しを1つずつ別のタスクとして実行する
+# - 同じステップのタスクは並列に実行されるため、複数の検索は最も遅いツールの時間で終わる
+# - 完了したタスクの結果はcheckpointerに保存されるため、
+#   再開時には中断したツール呼び出しだけが実行し直される
+#
+# 使用例)
+# add_tool_node(graph_builder, tools)   # chatbot -> tools -> chatbot のエッジも追加する
+######################################################################
+from langchain_core.messages import AIMessage
+from langgraph.graph import END
+from langgraph.prebuilt import ToolNode, tools_condition
+from langgraph.prebuilt.tool_node import ToolCallWithContext
+from langgraph.types import Send
+
+
+######################################################################
+# ツール呼び出しの振り分け(条件付きエッジ)
+# 最後のメッセージのツール呼び出しごとにSendを作成する
+# 各タスクに渡すステートは、ツール呼び出しを含むメッセージだけにする
+# (履歴全体を渡すと、ツール呼び出しの数だけcheckpointに履歴がコピーされるため)
+######################################################################
+def route_tool_calls(tools_node: str = "tools"):
+    def route(state):
+        messages = state["messages"] if isinstance(state, dict) else state
+        message = messages[-1] if messages else None
+        if not isinstance(message, AIMessage) or not message.tool_calls:
+            return END
+        return [
+            Send(
+                tools_node,
+                ToolCallWithContext(
+                    __type="tool_call_with_context",
+                    tool_call=tool_call,
+                    state={"messages": [message]},
+                ),
+            )
+            for tool_call in message.tool_calls
+        ]
+
+    return route
+
+
+######################################################################
+# ツールノードとエッジの追加
+# parallel=Falseの場合は従来どおりToolNodeで全てのツール呼び出しをまとめて実行する
+# tool_node_kwargs -> ToolNodeに渡す引数(awrap_tool_callなど)
+######################################################################
+def add_tool_node(
+    graph_builder, tools, source: str = "chatbot", name: str = "tools", parallel: bool = True, **tool_node_kwargs
+):
+    graph_builder.add_node(name, ToolNode(tools=tools, **tool_node_kwargs))
+    if parallel:
+        graph_builder.add_conditional_edges(source, route_tool_calls(name), [name, END])
+    else:
+        graph_builder.add_conditional_edges(source, tools_condition, {"tools": name, END: END})
+    graph_builder.add_edge(name, source)
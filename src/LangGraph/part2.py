@@ -9,7 +9,6 @@
 from typing import Annotated
 
 from langchain_anthropic import ChatAnthropic
-from langchain_community.tools.tavily_search import TavilySearchResults
 from langchain_core.messages import BaseMessage
 from typing_extensions import TypedDict
 
@@ -17,6 +16,9 @@ from langgraph.graph import StateGraph
 from langgraph.graph.message import add_messages
 from langgraph.prebuilt import ToolNode, tools_condition
 
+from chatbot_tools import create_retrieval_tools, create_search_tool, get_tool_guard
+from tool_guard import request_config
+
 ######################################################################
 # State定義
 ######################################################################
@@ -33,9 +35,11 @@ graph_builder = StateGraph(State)
 # memo1
 # TravilySearchResultsを実行するとTravilySearchAPIに対してクエリを実行し、
 # 結果をJSON形式で返却する。
+# 同じクエリの検索結果はキャッシュから返される(chatbot_tools.py)
 ######################################################################
-tool = TavilySearchResults(max_results=2)
-tools = [tool]
+tool = create_search_tool(max_results=2)
+# ローカルのインデックスが作成済みの場合は、その検索ツールを先に追加する(local_retriever.py)
+tools = create_retrieval_tools() + [tool]
 
 ######################################################################
 # 言語モデル（Anthropic LLM）の初期化
@@ -55,7 +59,10 @@ def chatbot(state: State):
 # ノードの追加
 ######################################################################
 graph_builder.add_node("chatbot", chatbot)
-tool_node = ToolNode(tools=[tool])
+# ツール呼び出しはTOOL_TIMEOUT・リクエストの期限(REQUEST_DEADLINE)で打ち切り、
+# 失敗が続くツールは呼ばずに"tool_unavailable"を返す(tool_guard.py)
+guard = get_tool_guard()
+tool_node = ToolNode(tools=tools, wrap_tool_call=guard.wrap_tool_call, awrap_tool_call=guard.awrap_tool_call)
 graph_builder.add_node("tools", tool_node)
 
 ######################################################################
@@ -92,5 +99,6 @@ graph = graph_builder.compile()
 # グラフの実行
 ######################################################################
 state = {"messages": [{"role": "user", "content": "What's a 'node' in LangGraph? Please tell me in Japanese."}]}
-result = graph.invoke(state)
+# REQUEST_DEADLINE(秒)を指定した場合は、その期限をconfigで全てのノード・ツールに渡す
+result = graph.invoke(state, request_config({}))
 print(result)
\ No newline at end of file
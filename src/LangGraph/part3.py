@@ -9,15 +9,19 @@
 from typing import Annotated
 
 from langchain_anthropic import ChatAnthropic
-from langchain_community.tools.tavily_search import TavilySearchResults
 from langchain_core.messages import BaseMessage
 from typing_extensions import TypedDict
 
-from langgraph.checkpoint.memory import MemorySaver
 from langgraph.graph import StateGraph
 from langgraph.graph.message import add_messages
 from langgraph.prebuilt import ToolNode, tools_condition
 
+from chatbot_tools import create_retrieval_tools, create_search_tool, get_tool_guard
+from checkpointer import create_checkpointer
+from history_trimmer import HistoryTrimmer
+from llm_cache import cache_llm
+from token_stream import stream_chat
+
 ######################################################################
 # State定義
 ######################################################################
@@ -34,9 +38,11 @@ graph_builder = StateGraph(State)
 # memo1
 # TravilySearchResultsを実行するとTravilySearchAPIに対してクエリを実行し、
 # 結果をJSON形式で返却する。
+# 同じクエリの検索結果はキャッシュから返される(chatbot_tools.py)
 ######################################################################
-tool = TavilySearchResults(max_results=2)
-tools = [tool]
+tool = create_search_tool(max_results=2)
+# ローカルのインデックスが作成済みの場合は、その検索ツールを先に追加する(local_retriever.py)
+tools = create_retrieval_tools() + [tool]
 
 ######################################################################
 # 言語モデル（Anthropic LLM）の初期化
@@ -46,17 +52,34 @@ tools = [tool]
 llm = ChatAnthropic(model="claude-3-5-sonnet-20240620")
 llm_with_tools = llm.bind_tools(tools)
 
+######################################################################
+# モデルの応答キャッシュ
+# 同じ履歴(LLM_CACHE_SEMANTIC=trueの場合はほぼ同じ質問)にはモデルを呼ばずに
+# 以前の応答を返す(llm_cache.py)。LLM_CACHE=trueで有効にする
+######################################################################
+llm_with_tools = cache_llm(llm_with_tools, llm, tools)
+
+######################################################################
+# モデルに渡す履歴の上限
+# 古いメッセージはトークン数の上限(HISTORY_MAX_TOKENS)に収まるように削る
+# HISTORY_SUMMARY=trueの場合は削ったメッセージをllmで要約して渡す(history_trimmer.py)
+######################################################################
+trimmer = HistoryTrimmer.from_env(summarizer=llm)
+
 ######################################################################
 # チャットボットのノード関数定義
 ######################################################################
 def chatbot(state: State):
-    return {"messages": [llm_with_tools.invoke(state["messages"])]}
+    return {"messages": [llm_with_tools.invoke(trimmer.trim(state["messages"]))]}
 
 ######################################################################
 # ノードの追加
 ######################################################################
 graph_builder.add_node("chatbot", chatbot)
-tool_node = ToolNode(tools=[tool])
+# ツール呼び出しはTOOL_TIMEOUT・リクエストの期限(REQUEST_DEADLINE)で打ち切り、
+# 失敗が続くツールは呼ばずに"tool_unavailable"を返す(tool_guard.py)
+guard = get_tool_guard()
+tool_node = ToolNode(tools=tools, wrap_tool_call=guard.wrap_tool_call, awrap_tool_call=guard.awrap_tool_call)
 graph_builder.add_node("tools", tool_node)
 
 ######################################################################
@@ -75,8 +98,11 @@ graph_builder.set_entry_point("chatbot")
 
 ######################################################################
 # checkpointerの定義
+# デフォルトではSQLiteに保存するため、再起動しても会話は保持される
+# messagesは前のステップとの差分だけが保存される(sqlite_delta_saver.py)
+# LANGGRAPH_CHECKPOINTER=memoryの場合はメモリに保持し、上限を超えたスレッドは退避する(bounded_saver.py)
 ######################################################################
-memory = MemorySaver()
+memory = create_checkpointer("part3")
 
 ######################################################################
 # グラフのコンパイル
@@ -94,19 +120,10 @@ config = {"configurable": {"thread_id": "1"} }
 user_input = "Hi there! My name is Will. Let's talk in Japanese!"
 
 ######################################################################
-# AIが生成した応答をストリーミングで逐次受信
+# AIが生成した応答をストリーミングで逐次受信して表示
+# トークンは届いた順に表示し、ステートは各ノードの差分だけを受け取る(token_stream.py)
 ######################################################################
-events = graph.stream(
-    {"messages": [{"role": "user", "content": user_input}]},
-    config,
-    stream_mode="values",
-)
-
-######################################################################
-# 受信結果を表示
-######################################################################
-for event in events:
-    event["messages"][-1].pretty_print()
+stream_chat(graph, {"messages": [{"role": "user", "content": user_input}]}, config)
 
 ######################################################################
 # 2番目のメッセージを定義
@@ -114,19 +131,10 @@ for event in events:
 user_input = "Remember my name?"
 
 ######################################################################
-# AIが生成した応答をストリーミングで逐次受信
-######################################################################
-events = graph.stream(
-    {"messages": [{"role": "user", "content": user_input}]},
-    config,
-    stream_mode="values",
-)
-######################################################################
-# 受信結果を表示
+# AIが生成した応答をストリーミングで逐次受信して表示
 # １回目のやり取りをAIが覚えているのでWillと返ってくる
 ######################################################################
-for event in events:
-    event["messages"][-1].pretty_print()
+stream_chat(graph, {"messages": [{"role": "user", "content": user_input}]}, config)
 
 ######################################################################
 # 3番目のメッセージを定義
@@ -134,18 +142,12 @@ for event in events:
 user_input = "Remember my name?"
 
 ######################################################################
-# AIが生成した応答をストリーミングで逐次受信
+# AIが生成した応答をストリーミングで逐次受信して表示
 # thread_idを異なる値にする
+# 1~2回目のthread_idとは異なる値を設定したため、会話内容を保持していない
 ######################################################################
-events = graph.stream(
+stream_chat(
+    graph,
     {"messages": [{"role": "user", "content": user_input}]},
     {"configurable": {"thread_id": "2"}},
-    stream_mode="values",
 )
-
-######################################################################
-# 受信結果を表示
-# 1~2回目のthread_idとは異なる値を設定したため、会話内容を保持していない
-######################################################################
-for event in events:
-    event["messages"][-1].pretty_print()
\ No newline at end of file
@@ -8,17 +8,21 @@
 from typing import Annotated
 
 from langchain_anthropic import ChatAnthropic
-from langchain_community.tools.tavily_search import TavilySearchResults
 from langchain_core.tools import tool
 from typing_extensions import TypedDict
 
-from langgraph.checkpoint.memory import MemorySaver
 from langgraph.graph import StateGraph, START, END
 from langgraph.graph.message import add_messages
-from langgraph.prebuilt import ToolNode, tools_condition
 
 from langgraph.types import Command, interrupt
 
+from chatbot_tools import create_retrieval_tools, create_search_tool, get_tool_guard
+from checkpointer import create_checkpointer
+from history_trimmer import HistoryTrimmer
+from llm_cache import cache_llm
+from parallel_tools import add_tool_node
+from token_stream import stream_chat
+
 ######################################################################
 # State定義
 ######################################################################
@@ -45,8 +49,9 @@ def human_assistance(query: str) -> str:
     human_response = interrupt({"query": query})
     return human_response["data"]
 
-tool = TavilySearchResults(max_results=2)
-tools = [tool, human_assistance]
+tool = create_search_tool(max_results=2)
+# ローカルのインデックスが作成済みの場合は、その検索ツールを先に追加する(local_retriever.py)
+tools = create_retrieval_tools() + [tool, human_assistance]
 
 ######################################################################
 # 言語モデル（Anthropic LLM）の初期化
@@ -56,40 +61,51 @@ tools = [tool, human_assistance]
 llm = ChatAnthropic(model="claude-3-5-sonnet-20240620")
 llm_with_tools = llm.bind_tools(tools)
 
+######################################################################
+# モデルの応答キャッシュ
+# 同じ履歴(LLM_CACHE_SEMANTIC=trueの場合はほぼ同じ質問)にはモデルを呼ばずに
+# 以前の応答を返す(llm_cache.py)。LLM_CACHE=trueで有効にする
+######################################################################
+llm_with_tools = cache_llm(llm_with_tools, llm, tools)
+
+######################################################################
+# モデルに渡す履歴の上限
+# 古いメッセージはトークン数の上限(HISTORY_MAX_TOKENS)に収まるように削る
+# HISTORY_SUMMARY=trueの場合は削ったメッセージをllmで要約して渡す(history_trimmer.py)
+######################################################################
+trimmer = HistoryTrimmer.from_env(summarizer=llm)
+
 ######################################################################
 # チャットボットのノード関数定義
-# message.tool_cellsが1つ以下であることを確認することで、並列ツール呼び出し
-# を防ぐ
+# 複数のツール呼び出しは1つずつ別のタスクとして並列に実行されるため、
+# 再開時に完了済みのツールが実行し直されることはない(parallel_tools.py)
 ######################################################################
 def chatbot(state: State):
-    message = llm_with_tools.invoke(state["messages"])
-    # Because we will be interrupting during tool execution,
-    # we disable parallel tool calling to avoid repeating any
-    # tool invocations when we resume.
-    assert len(message.tool_calls) <= 1
+    message = llm_with_tools.invoke(trimmer.trim(state["messages"]))
     return {"messages": [message]}
 
 ######################################################################
 # ノードの追加
 ######################################################################
 graph_builder.add_node("chatbot", chatbot)
-tool_node = ToolNode(tools=tools)
-graph_builder.add_node("tools", tool_node)
 
 ######################################################################
-# 条件付きエッジを追加
+# ツールノードと条件付きエッジを追加
+# ツール呼び出しごとにSendでtoolsノードを実行し、終わったらchatbotに戻る
+# ツール呼び出しはTOOL_TIMEOUT・リクエストの期限(REQUEST_DEADLINE)で打ち切り、
+# 失敗が続くツールは呼ばずに"tool_unavailable"を返す(tool_guard.py)
 ######################################################################
-graph_builder.add_conditional_edges(
-    "chatbot",
-    tools_condition,
-)
-graph_builder.add_edge("tools", "chatbot")
+guard = get_tool_guard()
+add_tool_node(graph_builder, tools, wrap_tool_call=guard.wrap_tool_call, awrap_tool_call=guard.awrap_tool_call)
 graph_builder.add_edge(START, "chatbot")
 
 ######################################################################
 # checkpointerの定義
+# デフォルトではSQLiteに保存するため、再起動しても会話は保持される
+# messagesは前のステップとの差分だけが保存される(sqlite_delta_saver.py)
+# LANGGRAPH_CHECKPOINTER=memoryの場合はメモリに保持し、上限を超えたスレッドは退避する(bounded_saver.py)
 ######################################################################
-memory = MemorySaver()
+memory = create_checkpointer("part4")
 
 ######################################################################
 # グラフのコンパイル
@@ -108,15 +124,9 @@ config = {"configurable": {"thread_id": "1"}}
 
 ######################################################################
 # AIが生成した応答をストリーミングで逐次受信
+# トークンは届いた順に表示し、ステートは各ノードの差分だけを受け取る(token_stream.py)
 ######################################################################
-events = graph.stream(
-    {"messages": [{"role": "user", "content": user_input}]},
-    config,
-    stream_mode="values",
-)
-for event in events:
-    if "messages" in event:
-        event["messages"][-1].pretty_print()
+stream_chat(graph, {"messages": [{"role": "user", "content": user_input}]}, config)
 
 ######################################################################
 # 外部からの回答をを定義
@@ -134,7 +144,4 @@ human_command = Command(resume={"data": human_response})
 ######################################################################
 # AIが生成した応答をストリーミングで逐次受信
 ######################################################################
-events = graph.stream(human_command, config, stream_mode="values")
-for event in events:
-    if "messages" in event:
-        event["messages"][-1].pretty_print()
\ No newline at end of file
+stream_chat(graph, human_command, config)
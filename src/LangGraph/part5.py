@@ -12,10 +12,14 @@ from langchain_core.messages import ToolMessage
 from langchain_core.tools import InjectedToolCallId, tool
 from langgraph.types import Command, interrupt
 from langchain_anthropic import ChatAnthropic
-from langchain_community.tools.tavily_search import TavilySearchResults
-from langgraph.checkpoint.memory import MemorySaver
 from langgraph.graph import StateGraph, START, END
-from langgraph.prebuilt import ToolNode, tools_condition
+
+from chatbot_tools import create_retrieval_tools, create_search_tool, get_tool_guard
+from checkpointer import create_checkpointer
+from history_trimmer import HistoryTrimmer
+from llm_cache import cache_llm
+from parallel_tools import add_tool_node
+from token_stream import stream_chat
 
 ######################################################################
 # State定義
@@ -81,9 +85,11 @@ def human_assistance(
 ######################################################################
 # ツールの定義２
 # TravilySearchAPIに対してクエリを実行し、Web検索を行った結果をJSONで取得
+# 同じクエリの検索結果はキャッシュから返される(chatbot_tools.py)
 ######################################################################
-tool = TavilySearchResults(max_results=2)
-tools = [tool, human_assistance]
+tool = create_search_tool(max_results=2)
+# ローカルのインデックスが作成済みの場合は、その検索ツールを先に追加する(local_retriever.py)
+tools = create_retrieval_tools() + [tool, human_assistance]
 
 ######################################################################
 # 言語モデル（Anthropic LLM）の初期化
@@ -92,15 +98,28 @@ tools = [tool, human_assistance]
 llm = ChatAnthropic(model="claude-3-5-sonnet-20240620")
 llm_with_tools = llm.bind_tools(tools)
 
+######################################################################
+# モデルの応答キャッシュ
+# 同じ履歴(LLM_CACHE_SEMANTIC=trueの場合はほぼ同じ質問)にはモデルを呼ばずに
+# 以前の応答を返す(llm_cache.py)。LLM_CACHE=trueで有効にする
+######################################################################
+llm_with_tools = cache_llm(llm_with_tools, llm, tools)
+
+######################################################################
+# モデルに渡す履歴の上限
+# 古いメッセージはトークン数の上限(HISTORY_MAX_TOKENS)に収まるように削る
+# HISTORY_SUMMARY=trueの場合は削ったメッセージをllmで要約して渡す(history_trimmer.py)
+######################################################################
+trimmer = HistoryTrimmer.from_env(summarizer=llm)
+
 ######################################################################
 # チャットボットのノード関数定義
-# llm_with_tools.invoke() -> Stateのメッセージ履歴を元にLLMを呼び出し、
+# llm_with_tools.invoke() -> Stateのメッセージ履歴(上限内に削ったもの)を元にLLMを呼び出し、
 #                            応答を生成
-# tool_calls <= 1         -> ツール呼び出しを一回に制限
+# 複数のツール呼び出しは並列に実行され、再開時は中断したものだけが実行し直される
 ######################################################################
 def chatbot(state: State):
-    message = llm_with_tools.invoke(state["messages"])
-    assert len(message.tool_calls) <= 1
+    message = llm_with_tools.invoke(trimmer.trim(state["messages"]))
     return {"messages": [message]}
 
 ######################################################################
@@ -108,20 +127,17 @@ def chatbot(state: State):
 ######################################################################
 graph_builder = StateGraph(State)
 graph_builder.add_node("chatbot", chatbot)
-tool_node = ToolNode(tools=tools)
-graph_builder.add_node("tools", tool_node)
-graph_builder.add_conditional_edges(
-    "chatbot",
-    tools_condition,
-)
-graph_builder.add_edge("tools", "chatbot")
+# ツール呼び出しは期限付きで実行し、失敗が続くツールは遮断する(tool_guard.py)
+guard = get_tool_guard()
+add_tool_node(graph_builder, tools, wrap_tool_call=guard.wrap_tool_call, awrap_tool_call=guard.awrap_tool_call)
 graph_builder.add_edge(START, "chatbot")
 
 ######################################################################
 # メモリ管理定義
 # グラフの状態を保存し、セッションをまたいでも状態を維持可能に
+# デフォルトではSQLiteに保存するため、再起動しても会話は保持される(checkpointer.py)
 ######################################################################
-memory = MemorySaver()
+memory = create_checkpointer("part5")
 graph = graph_builder.compile(checkpointer=memory)
 
 ######################################################################
@@ -133,14 +149,7 @@ user_input = (
 )
 config = {"configurable": {"thread_id": "1"}}
 
-events = graph.stream(
-    {"messages": [{"role": "user", "content": user_input}]},
-    config,
-    stream_mode="values",
-)
-for event in events:
-    if "messages" in event:
-        event["messages"][-1].pretty_print()
+stream_chat(graph, {"messages": [{"role": "user", "content": user_input}]}, config)
 
 ######################################################################
 # 人間の介入
@@ -151,10 +160,7 @@ human_command = Command(
         "birthday": "Jan 17, 2024",
     },
 )
-events = graph.stream(human_command, config, stream_mode="values")
-for event in events:
-    if "messages" in event:
-        event["messages"][-1].pretty_print()
+stream_chat(graph, human_command, config)
 
 # 以下実行時のログ
 # ================================ Human Message =================================
@@ -0,0 +1,399 @@
+######################################################################
+# LangGraph Quickstart
+# provider_limits.py
+# プロバイダ(モデル・ツールの提供元)ごとの呼び出しのスケジューラ(asyncio)
+#
+# 1つのイベントループで多数の会話を同時に処理する場合に、
+# プロバイダの上限(同時実行数・1分あたりのリクエスト数/トークン数)を超えないように
+# 呼び出しを待たせ、空いた枠は優先度の高い呼び出しから順に割り当てる
+#
+# - 同時実行数   -> PROVIDER_CONCURRENCYで指定した値を上限に、AIMDで増減させる
+#                   成功するたびに少しずつ増やし(+1/上限)、429(レート制限)を受けた場合や
+#                   レイテンシがPROVIDER_LATENCY_TARGETを超えた場合は半分・0.8倍に減らす
+# - トークンバケット -> PROVIDER_RPM(リクエスト数/分)・PROVIDER_TPM(トークン数/分)
+#                   トークン数は呼び出し前の見積もりで消費し、実際の使用量で補正する
+#                   429を受けた場合はバケットを空にして、補充されるまで待つ
+#                   (バケットの指定がない場合も、連続した429の回数に応じて1秒から倍々で
+#                   最大PROVIDER_MAX_BACKOFF秒まで、そのプロバイダへの割り当てを止める)
+# - 再試行       -> call()は429を受けた呼び出しを待ち行列に戻し、枠が空いてから
+#                   PROVIDER_RETRIES回まで実行し直す(すぐに再送しない)
+# - 待ち時間の上限 -> limit() / call()のtimeoutを過ぎても枠が割り当てられない場合はQueueTimeout
+#                   (リクエストの期限までしか待たないようにするため)
+# - 優先度       -> request_priority(BULK)の中で実行した呼び出しは、
+#                   対話的な呼び出し(INTERACTIVE、デフォルト)の後に回される
+# - 計測         -> 待ち行列の長さ・待ち時間(平均/p95/最大)・429の回数など(stats / render_metrics)
+# 指定のないプロバイダは無制限(待ち時間などの計測のみ行う)
+#
+# 実行例)
+# PROVIDER_CONCURRENCY=anthropic=16,tavily=8
+# PROVIDER_RPM=anthropic=50 PROVIDER_TPM=anthropic=40000 PROVIDER_LATENCY_TARGET=anthropic=10
+######################################################################
+import asyncio
+import contextvars
+import heapq
+import itertools
+import math
+import os
+import time
+from collections import deque
+from contextlib import asynccontextmanager, contextmanager
+from typing import Optional
+
+INTERACTIVE = 0
+BULK = 10
+
+_priority: contextvars.ContextVar[int] = contextvars.ContextVar("provider_priority", default=INTERACTIVE)
+
+
+######################################################################
+# 優先度の指定
+# with request_priority(BULK):
+#     await graph.ainvoke(...)   # この中のモデル・ツールの呼び出しは後回しにされる
+# (asyncioのタスクはcontextvarを引き継ぐため、グラフの中の呼び出しにも適用される)
+######################################################################
+@contextmanager
+def request_priority(priority: int):
+    token = _priority.set(priority)
+    try:
+        yield
+    finally:
+        _priority.reset(token)
+
+
+def parse_limits(value: str, type=int) -> dict:
+    limits = {}
+    for item in value.split(","):
+        name, _, limit = item.partition("=")
+        if name.strip() and limit.strip():
+            limits[name.strip()] = type(limit)
+    return limits
+
+
+class QueueTimeout(Exception):
+    # 枠が割り当てられる前にtimeoutを過ぎた(呼び出しは実行していない)
+    pass
+
+
+def is_rate_limit_error(error: BaseException) -> bool:
+    # openai.RateLimitError / anthropic.RateLimitError / httpxのレスポンスなど
+    status = getattr(error, "status_code", None) or getattr(getattr(error, "response", None), "status_code", None)
+    return status == 429 or "RateLimit" in type(error).__name__
+
+
+class _Bucket:
+    # 1分あたりper_minuteずつ補充されるトークンバケット(容量はper_minute)
+    def __init__(self, per_minute: float):
+        self.capacity = per_minute
+        self.rate = per_minute / 60.0
+        self.tokens = per_minute
+        self.updated = time.monotonic()
+
+    def _refill(self, now: float) -> None:
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, amount: float, now: float) -> float:
+        self._refill(now)
+        # 容量を超える見積もりは、満杯になれば通す
+        need = min(amount, self.capacity)
+        return 0.0 if self.tokens >= need else (need - self.tokens) / self.rate
+
+    def take(self, amount: float) -> None:
+        self.tokens -= amount
+
+    def empty(self, now: float) -> None:
+        self._refill(now)
+        self.tokens = min(self.tokens, 0.0)
+
+
+class _Slot:
+    # limit()のwithの中で使う。実際に使ったトークン数を記録する
+    def __init__(self, estimated: int):
+        self.estimated = estimated
+        self.used: Optional[int] = None
+
+    def record_tokens(self, tokens: Optional[int]) -> None:
+        self.used = tokens
+
+
+class _Lane:
+    def __init__(
+        self,
+        limit: Optional[int],
+        rpm: Optional[float],
+        tpm: Optional[float],
+        latency_target: Optional[float],
+        max_backoff: float = 30.0,
+    ):
+        self.max_limit = limit
+        self.limit = float(limit) if limit else None
+        self.rpm = _Bucket(rpm) if rpm else None
+        self.tpm = _Bucket(tpm) if tpm else None
+        self.latency_target = latency_target
+        self.queue: list = []
+        self.in_flight = 0
+        self.timer: Optional[asyncio.TimerHandle] = None
+        self.last_decrease = 0.0
+        self.paused_until = 0.0
+        self.backoff = 0.0
+        self.max_backoff = max_backoff
+        self.stats = {
+            "calls": 0,
+            "wait_seconds": 0.0,
+            "wait_max": 0.0,
+            "throttled": 0,
+            "slow": 0,
+            "decreases": 0,
+            "queue_timeouts": 0,
+        }
+        self.waits: deque = deque(maxlen=1000)
+
+    ##################################################################
+    # 枠の割り当て
+    # 待ち行列の先頭(優先度が最も高く、最も古い呼び出し)から順に、
+    # 同時実行数・バケットに空きがある間だけ割り当てる
+    # バケットが足りない場合は補充される時刻に割り当て直す
+    ##################################################################
+    def dispatch(self) -> None:
+        if self.timer is not None:
+            self.timer.cancel()
+            self.timer = None
+        while self.queue:
+            _, _, future, tokens = self.queue[0]
+            if future.done():
+                heapq.heappop(self.queue)
+                continue
+            if self.limit is not None and self.in_flight >= math.floor(self.limit):
+                return
+            now = time.monotonic()
+            wait = max(
+                self.paused_until - now,
+                self.rpm.wait_time(1, now) if self.rpm else 0.0,
+                self.tpm.wait_time(tokens, now) if self.tpm else 0.0,
+            )
+            if wait > 0:
+                self.timer = asyncio.get_running_loop().call_later(wait, self.dispatch)
+                return
+            heapq.heappop(self.queue)
+            if self.rpm:
+                self.rpm.take(1)
+            if self.tpm:
+                self.tpm.take(tokens)
+            self.in_flight += 1
+            future.set_result(None)
+
+    def unlimited(self) -> bool:
+        return self.limit is None and self.rpm is None and self.tpm is None and self.stats["throttled"] == 0
+
+    ##################################################################
+    # AIMD
+    # 減らすのは1秒に1回まで(同時に実行していた呼び出しがまとめて429を受けても
+    # 一度に何回も半分にしない)
+    ##################################################################
+    def _decrease(self, factor: float) -> None:
+        now = time.monotonic()
+        if self.limit is None or now - self.last_decrease < 1.0:
+            return
+        self.limit = max(1.0, self.limit * factor)
+        self.last_decrease = now
+        self.stats["decreases"] += 1
+
+    def release(self, latency: float, slot: _Slot, throttled: bool) -> None:
+        self.in_flight -= 1
+        if self.tpm is not None and slot.used is not None:
+            self.tpm.take(slot.used - slot.estimated)
+        if throttled:
+            self.stats["throttled"] += 1
+            now = time.monotonic()
+            for bucket in (self.rpm, self.tpm):
+                if bucket is not None:
+                    bucket.empty(now)
+            self.backoff = min(self.max_backoff, self.backoff * 2 if self.backoff else 1.0)
+            self.paused_until = max(self.paused_until, now + self.backoff)
+            self._decrease(0.5)
+        elif self.latency_target and latency > self.latency_target:
+            self.stats["slow"] += 1
+            self._decrease(0.8)
+        else:
+            self.backoff = 0.0
+            if self.limit is not None:
+                self.limit = min(float(self.max_limit), self.limit + 1.0 / self.limit)
+        self.dispatch()
+
+
+class ProviderLimiter:
+    ##################################################################
+    # limits          -> プロバイダ名 -> 同時実行数の上限
+    # tool_names      -> ツール名 -> プロバイダ名(指定のないツールは"tools")
+    # rpm / tpm       -> プロバイダ名 -> 1分あたりのリクエスト数 / トークン数
+    # latency_targets -> プロバイダ名 -> これを超えたら同時実行数を減らすレイテンシ(秒)
+    ##################################################################
+    def __init__(
+        self,
+        limits: Optional[dict[str, int]] = None,
+        tool_names: Optional[dict[str, str]] = None,
+        rpm: Optional[dict[str, float]] = None,
+        tpm: Optional[dict[str, float]] = None,
+        latency_targets: Optional[dict[str, float]] = None,
+        retries: int = 3,
+        max_backoff: float = 30.0,
+    ):
+        self.retries = retries
+        self.max_backoff = max_backoff
+        self.limits = dict(limits or {})
+        self.tool_names = dict(tool_names or {})
+        self.rpm = dict(rpm or {})
+        self.tpm = dict(tpm or {})
+        self.latency_targets = dict(latency_targets or {})
+        self._lanes: dict[str, _Lane] = {}
+        self._counter = itertools.count()
+
+    @classmethod
+    def from_env(cls, tool_names: Optional[dict[str, str]] = None) -> "ProviderLimiter":
+        return cls(
+            parse_limits(os.getenv("PROVIDER_CONCURRENCY", "")),
+            tool_names,
+            rpm=parse_limits(os.getenv("PROVIDER_RPM", ""), float),
+            tpm=parse_limits(os.getenv("PROVIDER_TPM", ""), float),
+            latency_targets=parse_limits(os.getenv("PROVIDER_LATENCY_TARGET", ""), float),
+            retries=int(os.getenv("PROVIDER_RETRIES", "3")),
+            max_backoff=float(os.getenv("PROVIDER_MAX_BACKOFF", "30")),
+        )
+
+    def _lane(self, provider: str) -> _Lane:
+        lane = self._lanes.get(provider)
+        if lane is None:
+            lane = self._lanes[provider] = _Lane(
+                self.limits.get(provider),
+                self.rpm.get(provider),
+                self.tpm.get(provider),
+                self.latency_targets.get(provider),
+                self.max_backoff,
+            )
+        return lane
+
+    ##################################################################
+    # プロバイダの呼び出し枠の確保
+    # tokens  -> 見積もりのトークン数(PROVIDER_TPMの消費に使う)
+    # timeout -> 枠を待つ時間の上限(秒)。過ぎた場合はQueueTimeout
+    # async with limiter.limit("anthropic", tokens=1200) as slot:
+    #     message = await llm.ainvoke(...)
+    #     slot.record_tokens(message.usage_metadata["total_tokens"])
+    ##################################################################
+    @asynccontextmanager
+    async def limit(
+        self, provider: str, tokens: int = 0, priority: Optional[int] = None, timeout: Optional[float] = None
+    ):
+        lane = self._lane(provider)
+        slot = _Slot(tokens)
+        start = time.perf_counter()
+        if not lane.unlimited():
+            future = asyncio.get_running_loop().create_future()
+            entry = (_priority.get() if priority is None else priority, next(self._counter), future, tokens)
+            heapq.heappush(lane.queue, entry)
+            lane.dispatch()
+            try:
+                await asyncio.wait_for(future, timeout)
+            except asyncio.TimeoutError:
+                if not (future.done() and not future.cancelled()):
+                    lane.stats["queue_timeouts"] += 1
+                    raise QueueTimeout(f"no {provider} slot within {timeout:.2f}s") from None
+            except asyncio.CancelledError:
+                if future.done() and not future.cancelled():
+                    # 割り当てられた直後にキャンセルされた場合は枠を返す
+                    lane.in_flight -= 1
+                    lane.dispatch()
+                raise
+        else:
+            lane.in_flight += 1
+        wait = time.perf_counter() - start
+        lane.stats["calls"] += 1
+        lane.stats["wait_seconds"] += wait
+        lane.stats["wait_max"] = max(lane.stats["wait_max"], wait)
+        lane.waits.append(wait)
+        start = time.perf_counter()
+        throttled = False
+        try:
+            yield slot
+        except BaseException as e:
+            throttled = is_rate_limit_error(e)
+            raise
+        finally:
+            lane.release(time.perf_counter() - start, slot, throttled)
+
+    ##################################################################
+    # 枠を確保して呼び出す
+    # 429を受けた場合はretries回まで待ち行列に戻して実行し直す
+    # 戻り値にusage_metadataがあれば、実際のトークン数でPROVIDER_TPMを補正する
+    # timeout -> 再試行を含めて枠を待つ時間の上限(秒)。過ぎた場合はQueueTimeout
+    # message = await limiter.call("anthropic", lambda: llm.ainvoke(messages), tokens=1200)
+    ##################################################################
+    async def call(
+        self, provider: str, fn, tokens: int = 0, retries: Optional[int] = None, timeout: Optional[float] = None
+    ):
+        retries = self.retries if retries is None else retries
+        deadline = time.monotonic() + timeout if timeout is not None else None
+        for attempt in range(retries + 1):
+            left = max(0.0, deadline - time.monotonic()) if deadline is not None else None
+            try:
+                async with self.limit(provider, tokens, timeout=left) as slot:
+                    result = await fn()
+                    usage = getattr(result, "usage_metadata", None)
+                    if usage:
+                        slot.record_tokens(usage.get("total_tokens"))
+                    return result
+            except Exception as e:
+                if attempt == retries or not is_rate_limit_error(e):
+                    raise
+
+    ##################################################################
+    # ToolNodeのawrap_tool_callに渡すラッパー
+    # ツール名からプロバイダを決めて、呼び出し枠を確保してから実行する
+    # tool_limit(request) -> その呼び出し枠(async with で使う)
+    ##################################################################
+    def tool_limit(self, request):
+        return self.limit(self.tool_names.get(request.tool_call["name"], "tools"))
+
+    async def wrap_tool_call(self, request, execute):
+        async with self.tool_limit(request):
+            return await execute(request)
+
+    def stats(self) -> dict:
+        result = {}
+        for provider, lane in self._lanes.items():
+            waits = sorted(lane.waits)
+            calls = lane.stats["calls"]
+            result[provider] = {
+                "in_flight": lane.in_flight,
+                "waiting": sum(1 for *_, future, _ in lane.queue if not future.done()),
+                "calls": calls,
+                "wait_seconds": lane.stats["wait_seconds"],
+                "wait_avg_ms": lane.stats["wait_seconds"] / calls * 1000 if calls else 0.0,
+                "wait_p95_ms": waits[min(int(0.95 * len(waits)), len(waits) - 1)] * 1000 if waits else 0.0,
+                "wait_max_ms": lane.stats["wait_max"] * 1000,
+                "limit": self.limits.get(provider),
+                "adaptive_limit": round(lane.limit, 2) if lane.limit is not None else None,
+                "throttled": lane.stats["throttled"],
+                "slow": lane.stats["slow"],
+                "decreases": lane.stats["decreases"],
+                "queue_timeouts": lane.stats["queue_timeouts"],
+                "rpm_available": round(lane.rpm.tokens, 1) if lane.rpm else None,
+                "tpm_available": round(lane.tpm.tokens, 1) if lane.tpm else None,
+            }
+        return result
+
+    ##################################################################
+    # Prometheus形式の出力(graph_server.pyの/metrics)
+    ##################################################################
+    def render_metrics(self) -> str:
+        lines = []
+        stats = self.stats()
+        names = sorted({key for stat in stats.values() for key in stat})
+        for key in names:
+            metric = f"provider_{key}"
+            lines.append(f"# TYPE {metric} gauge")
+            for provider, stat in sorted(stats.items()):
+                value = stat.get(key)
+                if value is not None:
+                    lines.append(f'{metric}{{provider="{provider}"}} {value}')
+        return "\n".join(lines) + "\n"
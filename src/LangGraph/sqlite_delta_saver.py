@@ -0,0 +1,435 @@
+######################################################################
+# LangGraph Quickstart
+# sqlite_delta_saver.py
+# MemorySaverの代わりに使う、SQLite(WALモード)に保存するcheckpointer
+#
+# MemorySaverは再起動すると会話が消え、各ステップでステート全体を保存する
+# messagesはadd_messages(追記のみ)で更新されるため、各ステップのスナップショットの
+# ほとんどは前のステップのコピーになる
+# このcheckpointerではmessagesなどの追記型のチャンネルについて
+# - 前のバージョンとの差分(先頭から一致する件数 + 追加されたメッセージ)だけを保存する
+# - snapshot_everyステップごとに全体(スナップショット)を保存し、復元時に辿る差分の数を抑える
+# そのため、1ステップの書き込み量は履歴全体ではなく新しいメッセージの量に比例する
+#
+# 使用例)
+# memory = SqliteDeltaSaver("checkpoints.sqlite")
+# graph = graph_builder.compile(checkpointer=memory)
+######################################################################
+import asyncio
+import random
+import sqlite3
+import threading
+from typing import Any, Iterator, Optional, Sequence
+
+from langchain_core.runnables import RunnableConfig
+
+from langgraph.checkpoint.base import (
+    WRITES_IDX_MAP,
+    BaseCheckpointSaver,
+    ChannelVersions,
+    Checkpoint,
+    CheckpointMetadata,
+    CheckpointTuple,
+    get_checkpoint_id,
+    get_checkpoint_metadata,
+    writes_sort_key,
+)
+
+DEFAULT_PATH = "checkpoints.sqlite"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS checkpoints (
+    thread_id TEXT NOT NULL,
+    checkpoint_ns TEXT NOT NULL DEFAULT '',
+    checkpoint_id TEXT NOT NULL,
+    parent_checkpoint_id TEXT,
+    type TEXT,
+    checkpoint BLOB,
+    metadata_type TEXT,
+    metadata BLOB,
+    PRIMARY KEY (thread_id, checkpoint_ns, checkpoint_id)
+);
+CREATE TABLE IF NOT EXISTS blobs (
+    thread_id TEXT NOT NULL,
+    checkpoint_ns TEXT NOT NULL DEFAULT '',
+    channel TEXT NOT NULL,
+    version TEXT NOT NULL,
+    base_version TEXT,
+    keep INTEGER NOT NULL DEFAULT 0,
+    depth INTEGER NOT NULL DEFAULT 0,
+    type TEXT NOT NULL,
+    blob BLOB,
+    PRIMARY KEY (thread_id, checkpoint_ns, channel, version)
+);
+CREATE TABLE IF NOT EXISTS writes (
+    thread_id TEXT NOT NULL,
+    checkpoint_ns TEXT NOT NULL DEFAULT '',
+    checkpoint_id TEXT NOT NULL,
+    task_id TEXT NOT NULL,
+    idx INTEGER NOT NULL,
+    channel TEXT NOT NULL,
+    type TEXT,
+    value BLOB,
+    task_path TEXT NOT NULL DEFAULT '',
+    PRIMARY KEY (thread_id, checkpoint_ns, checkpoint_id, task_id, idx)
+);
+"""
+
+
+class SqliteDeltaSaver(BaseCheckpointSaver[str]):
+    ##################################################################
+    # path           -> SQLiteファイルのパス(":memory:"も可)
+    # delta_channels -> 差分で保存するチャンネル(値がlistで、追記のみで更新されるもの)
+    # snapshot_every -> 何ステップごとに全体を保存するか
+    ##################################################################
+    def __init__(
+        self,
+        path: str = DEFAULT_PATH,
+        delta_channels: Sequence[str] = ("messages",),
+        snapshot_every: int = 20,
+        serde=None,
+    ):
+        super().__init__(serde=serde)
+        self.path = path
+        self.delta_channels = set(delta_channels)
+        self.snapshot_every = max(1, snapshot_every)
+        self._lock = threading.RLock()
+        self._conn = sqlite3.connect(self.path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(SCHEMA)
+        self._conn.commit()
+        # 最後に書き込んだ/読み込んだ差分チャンネルの値
+        # (thread_id, checkpoint_ns, channel, version) -> (値, depth)
+        self._values: dict[tuple, tuple[list, int]] = {}
+        self._last_version: dict[tuple, str] = {}
+        self.stats = {"snapshots": 0, "deltas": 0, "delta_bytes": 0, "snapshot_bytes": 0}
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+    ##################################################################
+    # 差分チャンネルの値の書き込み
+    # 前のバージョンの値と先頭から比較し、一致した件数(keep)と残り(tail)を保存する
+    # メッセージは前のステップと同じオブジェクトのことが多いため、まずisで比較する
+    ##################################################################
+    def _put_delta(self, thread_id: str, checkpoint_ns: str, channel: str, version: str, value: Any):
+        base_key = (thread_id, checkpoint_ns, channel)
+        base_version = self._last_version.get(base_key)
+        if base_version is None:
+            row = self._conn.execute(
+                "SELECT version FROM blobs WHERE thread_id = ? AND checkpoint_ns = ? AND channel = ? "
+                "ORDER BY version DESC LIMIT 1",
+                (thread_id, checkpoint_ns, channel),
+            ).fetchone()
+            base_version = row[0] if row else None
+
+        base, depth = None, 0
+        if base_version is not None and isinstance(value, list):
+            loaded = self._load_delta(thread_id, checkpoint_ns, channel, base_version)
+            if loaded is not None:
+                base, depth = loaded
+
+        keep = 0
+        if base is not None:
+            for old, new in zip(base, value):
+                if old is not new and old != new:
+                    break
+                keep += 1
+
+        if base is None or keep == 0 or depth + 1 >= self.snapshot_every:
+            type_, blob = self.serde.dumps_typed(value)
+            params = (None, 0, 0)
+            self.stats["snapshots"] += 1
+            self.stats["snapshot_bytes"] += len(blob)
+            depth = 0
+        else:
+            type_, blob = self.serde.dumps_typed(value[keep:])
+            params = (base_version, keep, depth + 1)
+            self.stats["deltas"] += 1
+            self.stats["delta_bytes"] += len(blob)
+            depth += 1
+
+        self._conn.execute(
+            "INSERT OR REPLACE INTO blobs "
+            "(thread_id, checkpoint_ns, channel, version, base_version, keep, depth, type, blob) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (thread_id, checkpoint_ns, channel, version, *params, type_, blob),
+        )
+        self._values[(thread_id, checkpoint_ns, channel, version)] = (list(value), depth)
+        self._last_version[base_key] = version
+        self._trim_values()
+
+    ##################################################################
+    # 差分チャンネルの値の復元
+    # スナップショットまで差分を遡り、スナップショットから順に差分を適用する
+    ##################################################################
+    def _load_delta(self, thread_id: str, checkpoint_ns: str, channel: str, version: str):
+        chain = []
+        cached = None
+        while version is not None:
+            cached = self._values.get((thread_id, checkpoint_ns, channel, version))
+            if cached is not None:
+                break
+            row = self._conn.execute(
+                "SELECT base_version, keep, depth, type, blob FROM blobs "
+                "WHERE thread_id = ? AND checkpoint_ns = ? AND channel = ? AND version = ?",
+                (thread_id, checkpoint_ns, channel, version),
+            ).fetchone()
+            if row is None:
+                return None
+            chain.append((version, *row))
+            version = row[0]
+
+        value, depth = (list(cached[0]), cached[1]) if cached else (None, 0)
+        for version, base_version, keep, depth, type_, blob in reversed(chain):
+            if type_ == "empty":
+                return None
+            data = self.serde.loads_typed((type_, blob))
+            value = data if base_version is None else value[:keep] + data
+        if chain:
+            self._values[(thread_id, checkpoint_ns, channel, chain[0][0])] = (list(value), depth)
+            self._trim_values()
+        return value, depth
+
+    def _trim_values(self, maxsize: int = 256) -> None:
+        while len(self._values) > maxsize:
+            self._values.pop(next(iter(self._values)))
+
+    def _load_blobs(self, thread_id: str, checkpoint_ns: str, versions: ChannelVersions) -> dict[str, Any]:
+        result: dict[str, Any] = {}
+        for channel, version in versions.items():
+            if channel in self.delta_channels:
+                loaded = self._load_delta(thread_id, checkpoint_ns, channel, str(version))
+                if loaded is not None:
+                    result[channel] = list(loaded[0])
+                continue
+            row = self._conn.execute(
+                "SELECT type, blob FROM blobs "
+                "WHERE thread_id = ? AND checkpoint_ns = ? AND channel = ? AND version = ?",
+                (thread_id, checkpoint_ns, channel, str(version)),
+            ).fetchone()
+            if row is not None and row[0] != "empty":
+                result[channel] = self.serde.loads_typed(row)
+        return result
+
+    def _load_writes(self, thread_id: str, checkpoint_ns: str, checkpoint_id: str) -> list:
+        rows = self._conn.execute(
+            "SELECT task_id, idx, channel, type, value, task_path FROM writes "
+            "WHERE thread_id = ? AND checkpoint_ns = ? AND checkpoint_id = ?",
+            (thread_id, checkpoint_ns, checkpoint_id),
+        ).fetchall()
+        rows.sort(key=lambda r: writes_sort_key(r[5], r[0], r[1]))
+        return [(task_id, channel, self.serde.loads_typed((type_, value))) for task_id, _, channel, type_, value, _ in rows]
+
+    def _to_tuple(self, thread_id: str, checkpoint_ns: str, row: tuple) -> CheckpointTuple:
+        checkpoint_id, parent_checkpoint_id, type_, checkpoint, metadata_type, metadata = row
+        checkpoint_: Checkpoint = self.serde.loads_typed((type_, checkpoint))
+        return CheckpointTuple(
+            config={
+                "configurable": {
+                    "thread_id": thread_id,
+                    "checkpoint_ns": checkpoint_ns,
+                    "checkpoint_id": checkpoint_id,
+                }
+            },
+            checkpoint={
+                **checkpoint_,
+                "channel_values": self._load_blobs(thread_id, checkpoint_ns, checkpoint_["channel_versions"]),
+            },
+            metadata=self.serde.loads_typed((metadata_type, metadata)),
+            pending_writes=self._load_writes(thread_id, checkpoint_ns, checkpoint_id),
+            parent_config=(
+                {
+                    "configurable": {
+                        "thread_id": thread_id,
+                        "checkpoint_ns": checkpoint_ns,
+                        "checkpoint_id": parent_checkpoint_id,
+                    }
+                }
+                if parent_checkpoint_id
+                else None
+            ),
+        )
+
+    ##################################################################
+    # BaseCheckpointSaverのメソッド
+    ##################################################################
+    def get_tuple(self, config: RunnableConfig) -> Optional[CheckpointTuple]:
+        thread_id = config["configurable"]["thread_id"]
+        checkpoint_ns = config["configurable"].get("checkpoint_ns", "")
+        columns = "checkpoint_id, parent_checkpoint_id, type, checkpoint, metadata_type, metadata"
+        with self._lock:
+            if checkpoint_id := get_checkpoint_id(config):
+                row = self._conn.execute(
+                    f"SELECT {columns} FROM checkpoints "
+                    "WHERE thread_id = ? AND checkpoint_ns = ? AND checkpoint_id = ?",
+                    (thread_id, checkpoint_ns, checkpoint_id),
+                ).fetchone()
+            else:
+                row = self._conn.execute(
+                    f"SELECT {columns} FROM checkpoints WHERE thread_id = ? AND checkpoint_ns = ? "
+                    "ORDER BY checkpoint_id DESC LIMIT 1",
+                    (thread_id, checkpoint_ns),
+                ).fetchone()
+            return self._to_tuple(thread_id, checkpoint_ns, row) if row else None
+
+    def list(
+        self,
+        config: Optional[RunnableConfig],
+        *,
+        filter: Optional[dict[str, Any]] = None,
+        before: Optional[RunnableConfig] = None,
+        limit: Optional[int] = None,
+    ) -> Iterator[CheckpointTuple]:
+        where, params = [], []
+        if config:
+            where.append("thread_id = ?")
+            params.append(config["configurable"]["thread_id"])
+            if (checkpoint_ns := config["configurable"].get("checkpoint_ns")) is not None:
+                where.append("checkpoint_ns = ?")
+                params.append(checkpoint_ns)
+            if checkpoint_id := get_checkpoint_id(config):
+                where.append("checkpoint_id = ?")
+                params.append(checkpoint_id)
+        if before and (before_checkpoint_id := get_checkpoint_id(before)):
+            where.append("checkpoint_id < ?")
+            params.append(before_checkpoint_id)
+        query = (
+            "SELECT thread_id, checkpoint_ns, checkpoint_id, parent_checkpoint_id, "
+            "type, checkpoint, metadata_type, metadata FROM checkpoints"
+        )
+        if where:
+            query += " WHERE " + " AND ".join(where)
+        query += " ORDER BY checkpoint_id DESC"
+
+        with self._lock:
+            rows = self._conn.execute(query, params).fetchall()
+        for thread_id, checkpoint_ns, *row in rows:
+            if limit is not None and limit <= 0:
+                break
+            if filter:
+                metadata = self.serde.loads_typed((row[4], row[5]))
+                if not all(metadata.get(k) == v for k, v in filter.items()):
+                    continue
+            if limit is not None:
+                limit -= 1
+            with self._lock:
+                item = self._to_tuple(thread_id, checkpoint_ns, tuple(row))
+            yield item
+
+    def put(
+        self,
+        config: RunnableConfig,
+        checkpoint: Checkpoint,
+        metadata: CheckpointMetadata,
+        new_versions: ChannelVersions,
+    ) -> RunnableConfig:
+        c = checkpoint.copy()
+        thread_id = config["configurable"]["thread_id"]
+        checkpoint_ns = config["configurable"]["checkpoint_ns"]
+        values: dict[str, Any] = c.pop("channel_values")
+        with self._lock:
+            for channel, version in new_versions.items():
+                if channel not in values:
+                    self._conn.execute(
+                        "INSERT OR REPLACE INTO blobs (thread_id, checkpoint_ns, channel, version, type, blob) "
+                        "VALUES (?, ?, ?, ?, 'empty', NULL)",
+                        (thread_id, checkpoint_ns, channel, str(version)),
+                    )
+                elif channel in self.delta_channels:
+                    self._put_delta(thread_id, checkpoint_ns, channel, str(version), values[channel])
+                else:
+                    self._conn.execute(
+                        "INSERT OR REPLACE INTO blobs (thread_id, checkpoint_ns, channel, version, type, blob) "
+                        "VALUES (?, ?, ?, ?, ?, ?)",
+                        (thread_id, checkpoint_ns, channel, str(version), *self.serde.dumps_typed(values[channel])),
+                    )
+            self._conn.execute(
+                "INSERT OR REPLACE INTO checkpoints "
+                "(thread_id, checkpoint_ns, checkpoint_id, parent_checkpoint_id, type, checkpoint, metadata_type, metadata) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (
+                    thread_id,
+                    checkpoint_ns,
+                    checkpoint["id"],
+                    config["configurable"].get("checkpoint_id"),
+                    *self.serde.dumps_typed(c),
+                    *self.serde.dumps_typed(get_checkpoint_metadata(config, metadata)),
+                ),
+            )
+            self._conn.commit()
+        return {
+            "configurable": {
+                "thread_id": thread_id,
+                "checkpoint_ns": checkpoint_ns,
+                "checkpoint_id": checkpoint["id"],
+            }
+        }
+
+    def put_writes(
+        self,
+        config: RunnableConfig,
+        writes: Sequence[tuple[str, Any]],
+        task_id: str,
+        task_path: str = "",
+    ) -> None:
+        thread_id = config["configurable"]["thread_id"]
+        checkpoint_ns = config["configurable"].get("checkpoint_ns", "")
+        checkpoint_id = config["configurable"]["checkpoint_id"]
+        with self._lock:
+            for idx, (channel, value) in enumerate(writes):
+                idx = WRITES_IDX_MAP.get(channel, idx)
+                # 通常の書き込みは最初のものを残し、特殊な書き込み(エラー・割り込みなど)は上書きする
+                verb = "INSERT OR IGNORE" if idx >= 0 else "INSERT OR REPLACE"
+                self._conn.execute(
+                    f"{verb} INTO writes "
+                    "(thread_id, checkpoint_ns, checkpoint_id, task_id, idx, channel, type, value, task_path) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                    (thread_id, checkpoint_ns, checkpoint_id, task_id, idx, channel,
+                     *self.serde.dumps_typed(value), task_path),
+                )
+            self._conn.commit()
+
+    def delete_thread(self, thread_id: str) -> None:
+        with self._lock:
+            for table in ("checkpoints", "blobs", "writes"):
+                self._conn.execute(f"DELETE FROM {table} WHERE thread_id = ?", (thread_id,))
+            self._conn.commit()
+            for key in [k for k in self._values if k[0] == thread_id]:
+                del self._values[key]
+            for key in [k for k in self._last_version if k[0] == thread_id]:
+                del self._last_version[key]
+
+    ##################################################################
+    # 非同期版
+    # SQLiteの呼び出しは短いので、別スレッドで同期版を実行する
+    ##################################################################
+    async def aget_tuple(self, config: RunnableConfig) -> Optional[CheckpointTuple]:
+        return await asyncio.to_thread(self.get_tuple, config)
+
+    async def alist(self, config, *, filter=None, before=None, limit=None):
+        items = await asyncio.to_thread(lambda: list(self.list(config, filter=filter, before=before, limit=limit)))
+        for item in items:
+            yield item
+
+    async def aput(self, config, checkpoint, metadata, new_versions) -> RunnableConfig:
+        return await asyncio.to_thread(self.put, config, checkpoint, metadata, new_versions)
+
+    async def aput_writes(self, config, writes, task_id, task_path: str = "") -> None:
+        await asyncio.to_thread(self.put_writes, config, writes, task_id, task_path)
+
+    async def adelete_thread(self, thread_id: str) -> None:
+        await asyncio.to_thread(self.delete_thread, thread_id)
+
+    def get_next_version(self, current: Optional[str], channel: None) -> str:
+        if current is None:
+            current_v = 0
+        elif isinstance(current, int):
+            current_v = current
+        else:
+            current_v = int(current.split(".")[0])
+        next_v = current_v + 1
+        next_h = random.random()
+        return f"{next_v:032}.{next_h:016}"
@@ -0,0 +1,146 @@
+######################################################################
+# LangGraph Quickstart
+# token_stream.py
+# グラフの実行結果をトークン単位で表示する
+#
+# part3~5はstream_mode="values"で実行し、event["messages"][-1]を表示していたが、
+# "values"のイベントは毎回ステート全体(それまでの全履歴)を含むため、
+# 長い会話では表示のたびに履歴全体を受け取ることになる(会話全体でO(n^2))
+# また、モデルの応答は全て生成し終わるまで表示されない
+# ここではstream_mode=["messages", "updates"]で実行し、
+# - "messages" -> モデルが生成したトークンを届いた順にすぐ表示する
+# - "updates"  -> 各ノードが追加したメッセージ(差分)だけを受け取る
+# STREAM_MODE=valuesを指定した場合は従来どおりステート全体を受け取って表示する
+# REQUEST_DEADLINE(秒)を指定した場合は、呼び出しごとにその期限をconfigに付ける(tool_guard.py)
+#
+# 使用例)
+# stream_chat(graph, {"messages": [{"role": "user", "content": user_input}]}, config)
+######################################################################
+import os
+import sys
+from typing import Any, AsyncIterator, Iterable, Iterator, Optional
+
+from langchain_core.messages import AIMessageChunk, BaseMessage, convert_to_messages
+from langchain_core.messages.base import get_msg_title_repr
+
+from tool_guard import request_config
+
+STREAM_MODES = ["messages", "updates"]
+# トークンを表示するノード(ツールや要約のモデル呼び出しは含めない)
+CHAT_NODES = ("chatbot",)
+
+
+######################################################################
+# ストリームのチャンクをイベントに変換する
+# ("token", AIMessageChunk)       -> モデルが生成したテキストの断片
+# ("message", ノード名, メッセージ) -> ノードが追加したメッセージ
+# ("interrupt", Interruptのタプル) -> interrupt()で中断した
+######################################################################
+def chunk_events(mode: str, chunk: Any, nodes: Iterable[str] = CHAT_NODES) -> Iterator[tuple]:
+    if mode == "messages":
+        message, metadata = chunk
+        if isinstance(message, AIMessageChunk) and message.text and metadata.get("langgraph_node") in nodes:
+            yield "token", message
+        return
+    for node, update in chunk.items():
+        if node == "__interrupt__":
+            yield "interrupt", update
+            continue
+        # Commandを返すツールの場合は更新のリストになる
+        for item in update if isinstance(update, (list, tuple)) else [update]:
+            if isinstance(item, dict):
+                for message in item.get("messages") or []:
+                    if isinstance(message, BaseMessage):
+                        yield "message", node, message
+
+
+def stream_events(graph, graph_input, config: dict, nodes: Iterable[str] = CHAT_NODES) -> Iterator[tuple]:
+    for mode, chunk in graph.stream(graph_input, config, stream_mode=STREAM_MODES):
+        yield from chunk_events(mode, chunk, nodes)
+
+
+async def astream_events(graph, graph_input, config: dict, nodes: Iterable[str] = CHAT_NODES) -> AsyncIterator[tuple]:
+    async for mode, chunk in graph.astream(graph_input, config, stream_mode=STREAM_MODES):
+        for event in chunk_events(mode, chunk, nodes):
+            yield event
+
+
+######################################################################
+# コンソールへの表示
+# トークンは届いた順に表示し、同じメッセージの完成版(updates)では
+# 未表示の部分(ツール呼び出し)だけを表示する
+######################################################################
+class ConsolePrinter:
+    def __init__(self, out=None):
+        self.out = out or sys.stdout
+        self._streaming: Optional[str] = None
+        self._streamed: set = set()
+
+    def _end_line(self) -> None:
+        if self._streaming is not None:
+            print(file=self.out, flush=True)
+            self._streaming = None
+
+    def input(self, graph_input) -> None:
+        if isinstance(graph_input, dict) and graph_input.get("messages"):
+            for message in convert_to_messages(graph_input["messages"]):
+                print(message.pretty_repr(), file=self.out)
+
+    def event(self, event: tuple) -> None:
+        if event[0] == "token":
+            chunk = event[1]
+            if chunk.id != self._streaming:
+                self._end_line()
+                print(get_msg_title_repr("Ai Message"), file=self.out)
+                print(file=self.out)
+                self._streaming = chunk.id
+                self._streamed.add(chunk.id)
+            print(chunk.text, end="", file=self.out, flush=True)
+        elif event[0] == "message":
+            message = event[2]
+            self._end_line()
+            if message.id not in self._streamed:
+                print(message.pretty_repr(), file=self.out)
+            elif getattr(message, "tool_calls", None):
+                # テキストは表示済みなので、ツール呼び出しの部分だけを表示する
+                lines = message.model_copy(update={"content": ""}).pretty_repr().splitlines()
+                print("\n".join(lines[2:]), file=self.out)
+        elif event[0] == "interrupt":
+            self._end_line()
+            for item in event[1]:
+                print(get_msg_title_repr("Interrupt"), file=self.out)
+                print(file=self.out)
+                print(item.value, file=self.out)
+        self.out.flush()
+
+    def finish(self) -> None:
+        self._end_line()
+
+
+######################################################################
+# part3~5のチャットループ用
+# graph.stream(graph_input, config)を実行して表示する
+# mode -> "tokens"(デフォルト)または"values"(環境変数STREAM_MODEで指定)
+######################################################################
+def stream_chat(graph, graph_input, config: dict, mode: Optional[str] = None, out=None) -> None:
+    mode = mode or os.getenv("STREAM_MODE", "tokens")
+    config = request_config(config)
+    if mode == "values":
+        for event in graph.stream(graph_input, config, stream_mode="values"):
+            if "messages" in event:
+                print(event["messages"][-1].pretty_repr(), file=out or sys.stdout)
+        return
+    printer = ConsolePrinter(out)
+    printer.input(graph_input)
+    for event in stream_events(graph, graph_input, config):
+        printer.event(event)
+    printer.finish()
+
+
+async def astream_chat(graph, graph_input, config: dict, out=None) -> None:
+    config = request_config(config)
+    printer = ConsolePrinter(out)
+    printer.input(graph_input)
+    async for event in astream_events(graph, graph_input, config):
+        printer.event(event)
+    printer.finish()
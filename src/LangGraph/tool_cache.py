@@ -0,0 +1,355 @@
+######################################################################
+# LangGraph Quickstart
+# tool_cache.py
+# ToolNodeで使うツールの結果キャッシュ
+#
+# - キー     : ツール名と引数を正規化してハッシュ化
+# - 1段目    : プロセス内LRU
+# - 2段目    : SQLiteによるディスクキャッシュ(再起動後も残る)
+#              ainvokeではイベントループを止めないよう、別スレッドで読み書きする
+# - 有効期限 : ツールごとにttlを設定できる
+#              期限切れ後もstale_ttlの間は古い結果をすぐに返し、裏で取得し直す
+#              (stale-while-revalidate)
+#
+# 使用例)
+# cache = ToolResultCache(path="tool_cache.sqlite")
+# tool = cache.wrap(TavilySearchResults(max_results=2), ttl=600)
+######################################################################
+import asyncio
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+from typing import Any, Callable, Optional
+
+from langchain_core.messages import ToolMessage
+from langchain_core.tools import BaseTool
+
+# 裏で実行中の取得し直しのタスク(実行中にガベージコレクトされないように保持する)
+_background_tasks: set = set()
+
+
+######################################################################
+# キーの正規化
+# 文字列の引数は前後・連続する空白、大文字小文字、Unicodeの合成形を揃え、
+# 引数の順番に依存しないようにキーをソートしてからハッシュ化する
+######################################################################
+def _normalize(value: Any) -> Any:
+    if isinstance(value, str):
+        return " ".join(unicodedata.normalize("NFC", value).split()).casefold()
+    if isinstance(value, dict):
+        return {str(k): _normalize(v) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_normalize(v) for v in value]
+    return value
+
+
+def normalize_tool_key(name: str, args: dict) -> str:
+    raw = json.dumps(
+        [name.strip().casefold(), _normalize(args)],
+        ensure_ascii=False,
+        sort_keys=True,
+        separators=(",", ":"),
+        default=str,
+    )
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+######################################################################
+# ディスクキャッシュ(SQLite)
+# fresh_until -> この時刻までは新しい結果として返す
+# stale_until -> この時刻までは古い結果として返し、裏で取得し直す
+######################################################################
+class _DiskTier:
+    def __init__(self, path: str):
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS tool_results ("
+            " key TEXT PRIMARY KEY, tool TEXT NOT NULL, value TEXT NOT NULL,"
+            " fresh_until REAL NOT NULL, stale_until REAL NOT NULL)"
+        )
+        self._conn.commit()
+
+    def get(self, key: str) -> Optional[tuple[str, float, float]]:
+        with self._lock:
+            return self._conn.execute(
+                "SELECT value, fresh_until, stale_until FROM tool_results WHERE key = ?", (key,)
+            ).fetchone()
+
+    def set(self, key: str, tool: str, value: str, fresh_until: float, stale_until: float) -> None:
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO tool_results (key, tool, value, fresh_until, stale_until) "
+                "VALUES (?, ?, ?, ?, ?)",
+                (key, tool, value, fresh_until, stale_until),
+            )
+            self._conn.commit()
+
+    def delete(self, key: str) -> None:
+        with self._lock:
+            self._conn.execute("DELETE FROM tool_results WHERE key = ?", (key,))
+            self._conn.commit()
+
+    def clear(self) -> None:
+        with self._lock:
+            self._conn.execute("DELETE FROM tool_results")
+            self._conn.commit()
+
+
+######################################################################
+# ツール結果キャッシュ本体
+# maxsize   -> メモリに保持する最大件数
+# ttl       -> 有効期限(秒)。wrap()でツールごとに上書きできる
+# stale_ttl -> 有効期限が切れた後、古い結果を返してよい時間(秒)。0の場合は返さない
+# path      -> SQLiteファイルのパス。Noneの場合はメモリのみ
+######################################################################
+class ToolResultCache:
+    def __init__(
+        self,
+        maxsize: int = 1024,
+        ttl: float = 3600.0,
+        stale_ttl: float = 86400.0,
+        path: Optional[str] = None,
+    ):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self._lock = threading.Lock()
+        self._entries: "OrderedDict[str, tuple[Any, float, float]]" = OrderedDict()
+        self._disk = _DiskTier(path) if path else None
+        self._refreshing: set[str] = set()
+        self._stats = {
+            "hits": 0, "disk_hits": 0, "stale_hits": 0, "misses": 0,
+            "refreshes": 0, "refresh_errors": 0, "evictions": 0,
+        }
+
+    ##################################################################
+    # 環境変数から作成する
+    # TOOL_CACHE_PATH / TOOL_CACHE_SIZE / TOOL_CACHE_TTL / TOOL_CACHE_STALE_TTL
+    ##################################################################
+    @classmethod
+    def from_env(cls) -> "ToolResultCache":
+        return cls(
+            maxsize=int(os.getenv("TOOL_CACHE_SIZE", "1024")),
+            ttl=float(os.getenv("TOOL_CACHE_TTL", "3600")),
+            stale_ttl=float(os.getenv("TOOL_CACHE_STALE_TTL", "86400")),
+            path=os.getenv("TOOL_CACHE_PATH", "tool_cache.sqlite") or None,
+        )
+
+    ##################################################################
+    # 取得・保存
+    # 戻り値 -> (値, "fresh" / "stale") または None
+    # aget / asetはディスクキャッシュの読み書きを別スレッドで行う(メモリは直接参照する)
+    ##################################################################
+    def get(self, key: str) -> Optional[tuple[Any, str]]:
+        cached = self._get_memory(key)
+        if cached is None:
+            cached = self._get_disk(key)
+        return cached
+
+    async def aget(self, key: str) -> Optional[tuple[Any, str]]:
+        cached = self._get_memory(key)
+        if cached is None:
+            cached = await asyncio.to_thread(self._get_disk, key) if self._disk is not None else self._get_disk(key)
+        return cached
+
+    def _get_memory(self, key: str) -> Optional[tuple[Any, str]]:
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                value, fresh_until, stale_until = entry
+                if now < stale_until:
+                    self._entries.move_to_end(key)
+                    state = "fresh" if now < fresh_until else "stale"
+                    self._stats["hits" if state == "fresh" else "stale_hits"] += 1
+                    return value, state
+                del self._entries[key]
+        return None
+
+    def _get_disk(self, key: str) -> Optional[tuple[Any, str]]:
+        now = time.time()
+        if self._disk is not None:
+            row = self._disk.get(key)
+            if row is not None:
+                value, fresh_until, stale_until = row
+                if now < stale_until:
+                    value = json.loads(value)
+                    # ディスクでヒットしたものはメモリにも載せておく
+                    self._remember(key, value, fresh_until, stale_until)
+                    state = "fresh" if now < fresh_until else "stale"
+                    with self._lock:
+                        self._stats["disk_hits" if state == "fresh" else "stale_hits"] += 1
+                    return value, state
+                self._disk.delete(key)
+        with self._lock:
+            self._stats["misses"] += 1
+        return None
+
+    def set(self, key: str, tool: str, value: Any, ttl: Optional[float] = None) -> None:
+        fresh_until, stale_until = self._expiry(ttl)
+        self._remember(key, value, fresh_until, stale_until)
+        if self._disk is not None:
+            self._disk.set(key, tool, json.dumps(value, ensure_ascii=False, default=str), fresh_until, stale_until)
+
+    async def aset(self, key: str, tool: str, value: Any, ttl: Optional[float] = None) -> None:
+        fresh_until, stale_until = self._expiry(ttl)
+        self._remember(key, value, fresh_until, stale_until)
+        if self._disk is not None:
+            await asyncio.to_thread(
+                self._disk.set, key, tool, json.dumps(value, ensure_ascii=False, default=str), fresh_until, stale_until
+            )
+
+    def _expiry(self, ttl: Optional[float]) -> tuple[float, float]:
+        fresh_until = time.time() + (self.ttl if ttl is None else ttl)
+        return fresh_until, fresh_until + self.stale_ttl
+
+    def _remember(self, key: str, value: Any, fresh_until: float, stale_until: float) -> None:
+        with self._lock:
+            self._entries[key] = (value, fresh_until, stale_until)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+                self._stats["evictions"] += 1
+
+    ##################################################################
+    # 裏での取得し直し
+    # 同じキーの取得し直しは同時に1つだけ実行する
+    ##################################################################
+    def start_refresh(self, key: str) -> bool:
+        with self._lock:
+            if key in self._refreshing:
+                return False
+            self._refreshing.add(key)
+            self._stats["refreshes"] += 1
+            return True
+
+    def finish_refresh(self, key: str, error: bool = False) -> None:
+        with self._lock:
+            self._refreshing.discard(key)
+            if error:
+                self._stats["refresh_errors"] += 1
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+        if self._disk is not None:
+            self._disk.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            stats = dict(self._stats)
+            stats["size"] = len(self._entries)
+            stats["refreshing"] = len(self._refreshing)
+        lookups = stats["hits"] + stats["disk_hits"] + stats["stale_hits"] + stats["misses"]
+        stats["hit_rate"] = (lookups - stats["misses"]) / lookups if lookups else 0.0
+        stats["disk"] = self._disk is not None
+        return stats
+
+    def wrap(self, tool: BaseTool, ttl: Optional[float] = None) -> "CachedTool":
+        return CachedTool(
+            name=tool.name,
+            description=tool.description,
+            args_schema=tool.args_schema,
+            response_format=tool.response_format,
+            tool=tool,
+            cache=self,
+            ttl=ttl,
+        )
+
+
+######################################################################
+# キャッシュ付きツール
+# 元のツールと同じ名前・説明・引数で、ToolNodeやbind_toolsからはそのまま使える
+# 結果はToolMessageとして受け取り、content(とartifact)をキャッシュする
+# エラーの結果(status="error"、artifactが空のcontent_and_artifact)はキャッシュしない
+######################################################################
+class CachedTool(BaseTool):
+    tool: BaseTool
+    cache: Any
+    ttl: Optional[float] = None
+    should_cache: Optional[Callable[[ToolMessage], bool]] = None
+
+    def _call(self, args: dict, callbacks=None) -> ToolMessage:
+        return self.tool.invoke(
+            {"type": "tool_call", "name": self.tool.name, "args": args, "id": "cached"},
+            {"callbacks": callbacks},
+        )
+
+    async def _acall(self, args: dict, callbacks=None) -> ToolMessage:
+        return await self.tool.ainvoke(
+            {"type": "tool_call", "name": self.tool.name, "args": args, "id": "cached"},
+            {"callbacks": callbacks},
+        )
+
+    def _cacheable(self, message: ToolMessage) -> bool:
+        if self.should_cache is not None:
+            return self.should_cache(message)
+        if message.status == "error":
+            return False
+        return self.response_format != "content_and_artifact" or bool(message.artifact)
+
+    def _value(self, message: ToolMessage) -> Any:
+        return [message.content, message.artifact] if self.response_format == "content_and_artifact" else message.content
+
+    def _store(self, key: str, message: ToolMessage) -> Any:
+        value = self._value(message)
+        if self._cacheable(message):
+            self.cache.set(key, self.name, value, self.ttl)
+        return value
+
+    async def _astore(self, key: str, message: ToolMessage) -> Any:
+        value = self._value(message)
+        if self._cacheable(message):
+            await self.cache.aset(key, self.name, value, self.ttl)
+        return value
+
+    def _output(self, value: Any) -> Any:
+        return tuple(value) if self.response_format == "content_and_artifact" else value
+
+    def _run(self, run_manager=None, **kwargs: Any) -> Any:
+        key = normalize_tool_key(self.name, kwargs)
+        cached = self.cache.get(key)
+        if cached is not None:
+            value, state = cached
+            if state == "stale" and self.cache.start_refresh(key):
+                threading.Thread(target=self._refresh, args=(key, kwargs), daemon=True).start()
+            return self._output(value)
+        callbacks = run_manager.get_child() if run_manager else None
+        return self._output(self._store(key, self._call(kwargs, callbacks)))
+
+    async def _arun(self, run_manager=None, **kwargs: Any) -> Any:
+        key = normalize_tool_key(self.name, kwargs)
+        cached = await self.cache.aget(key)
+        if cached is not None:
+            value, state = cached
+            if state == "stale" and self.cache.start_refresh(key):
+                task = asyncio.get_running_loop().create_task(self._arefresh(key, kwargs))
+                _background_tasks.add(task)
+                task.add_done_callback(_background_tasks.discard)
+            return self._output(value)
+        callbacks = run_manager.get_child() if run_manager else None
+        return self._output(await self._astore(key, await self._acall(kwargs, callbacks)))
+
+    def _refresh(self, key: str, args: dict) -> None:
+        try:
+            self._store(key, self._call(args))
+        except Exception:
+            self.cache.finish_refresh(key, error=True)
+        else:
+            self.cache.finish_refresh(key)
+
+    async def _arefresh(self, key: str, args: dict) -> None:
+        try:
+            await self._astore(key, await self._acall(args))
+        except Exception:
+            self.cache.finish_refresh(key, error=True)
+        else:
+            self.cache.finish_refresh(key)
@@ -0,0 +1,335 @@
+######################################################################
+# LangGraph Quickstart
+# tool_guard.py
+# ツール呼び出しの期限(デッドライン)とサーキットブレーカー
+#
+# Tavilyなどの外部ツールが遅い場合、ToolNodeはHTTPのタイムアウトまで待つため、
+# その間は会話全体が止まる。ここではToolNodeのwrap_tool_call / awrap_tool_callで
+# - デッドライン   -> リクエストごとの期限をconfig["configurable"]["deadline"]
+#                     (time.time()の時刻)で渡す。configurableはグラフの全てのノード・
+#                     ツールに引き継がれるため、各ツール呼び出しは期限(とTOOL_TIMEOUT)の
+#                     早い方で打ち切られる。期限を過ぎた後のツール呼び出しはすぐに返す
+# - サーキットブレーカー -> ツールごとに直近TOOL_BREAKER_WINDOW回の呼び出しのうち、
+#                     エラー・タイムアウト・TOOL_SLOW_CALL秒を超えた呼び出しの割合が
+#                     TOOL_BREAKER_FAILURE_RATEを超えたら遮断(open)し、
+#                     TOOL_BREAKER_COOLDOWN秒の間はツールを呼ばずにすぐに返す
+#                     その後は1回だけ試し(half_open)、成功すれば元に戻す
+# 遅い呼び出しの判定には、ツールの実行が始まってからの時間を使う(スレッドや呼び出し枠を
+# 待っている間に期限を過ぎた場合や、実行してからTOOL_SLOW_CALL秒が経つ前に期限を
+# 過ぎた場合は、ツールの失敗として数えない)
+# 打ち切り・遮断したツール呼び出しは、"tool_unavailable"のToolMessage(status="error")を
+# 返すため、chatbotノードはそのツールなしで回答できる
+#
+# 使用例)
+# guard = ToolGuard.from_env()
+# ToolNode(tools=tools, wrap_tool_call=guard.wrap_tool_call, awrap_tool_call=guard.awrap_tool_call)
+# graph.invoke(state, with_deadline({"configurable": {"thread_id": "1"}}, 10))
+######################################################################
+import asyncio
+import contextvars
+import json
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from typing import Optional
+
+from langchain_core.messages import ToolMessage
+from langgraph.errors import GraphBubbleUp
+
+from provider_limits import parse_limits
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+######################################################################
+# デッドライン
+# with_deadline(config, 10)   -> 今から10秒後を期限にしたconfigを返す
+#                                (既により早い期限があればそれを残す)
+# request_config(config)      -> REQUEST_DEADLINE(秒)が指定されていれば期限を付ける
+# time_left(config)           -> 期限までの残り時間(秒)。期限がない場合はNone
+######################################################################
+def with_deadline(config: Optional[dict], timeout: Optional[float]) -> dict:
+    config = dict(config or {})
+    configurable = dict(config.get("configurable", {}))
+    if timeout is not None:
+        deadline = time.time() + timeout
+        current = configurable.get("deadline")
+        configurable["deadline"] = min(deadline, current) if current else deadline
+    config["configurable"] = configurable
+    return config
+
+
+def request_config(config: Optional[dict]) -> dict:
+    timeout = os.getenv("REQUEST_DEADLINE")
+    return with_deadline(config, float(timeout) if timeout else None)
+
+
+def time_left(config: Optional[dict]) -> Optional[float]:
+    deadline = (config or {}).get("configurable", {}).get("deadline")
+    return deadline - time.time() if deadline else None
+
+
+######################################################################
+# サーキットブレーカー(ツール1つ分)
+# window       -> 失敗の割合を計算する直近の呼び出し数
+# min_calls    -> 遮断を判定するのに必要な呼び出し数
+# failure_rate -> この割合以上の呼び出しが失敗したら遮断する
+# cooldown     -> 遮断してから1回試すまでの時間(秒)
+######################################################################
+class CircuitBreaker:
+    def __init__(self, window: int = 20, min_calls: int = 5, failure_rate: float = 0.5, cooldown: float = 30.0):
+        self.window = window
+        self.min_calls = min_calls
+        self.failure_rate = failure_rate
+        self.cooldown = cooldown
+        self.state = CLOSED
+        self.opened_at = 0.0
+        self._results: deque = deque(maxlen=window)
+        self._probing = False
+        self._lock = threading.Lock()
+        self.stats = {"calls": 0, "failures": 0, "timeouts": 0, "slow": 0, "rejected": 0, "trips": 0}
+
+    ##################################################################
+    # 呼び出してよいかどうか
+    # 遮断中はcooldownが過ぎるまでFalse。過ぎたら1つの呼び出しだけを通す
+    ##################################################################
+    def allow(self) -> bool:
+        with self._lock:
+            if self.state == OPEN and time.monotonic() - self.opened_at >= self.cooldown:
+                self.state = HALF_OPEN
+                self._probing = False
+            if self.state == CLOSED or (self.state == HALF_OPEN and not self._probing):
+                self._probing = self.state == HALF_OPEN
+                return True
+            self.stats["rejected"] += 1
+            return False
+
+    def retry_after(self) -> float:
+        return max(0.0, self.cooldown - (time.monotonic() - self.opened_at)) if self.state == OPEN else 0.0
+
+    ##################################################################
+    # 結果の記録
+    # failed -> エラー・タイムアウト・遅すぎた呼び出し
+    ##################################################################
+    def record(self, failed: bool, timeout: bool = False, slow: bool = False) -> None:
+        with self._lock:
+            self.stats["calls"] += 1
+            self.stats["failures"] += failed
+            self.stats["timeouts"] += timeout
+            self.stats["slow"] += slow
+            if self.state == HALF_OPEN:
+                self._probing = False
+                if failed:
+                    self._trip()
+                else:
+                    self.state = CLOSED
+                    self._results.clear()
+                return
+            self._results.append(failed)
+            if (
+                self.state == CLOSED
+                and len(self._results) >= self.min_calls
+                and sum(self._results) / len(self._results) >= self.failure_rate
+            ):
+                self._trip()
+
+    def release(self) -> None:
+        # 結果を記録せずに終わった試行(interruptなど)の後に、次の試行を通せるようにする
+        with self._lock:
+            self._probing = False
+
+    def _trip(self) -> None:
+        self.state = OPEN
+        self.opened_at = time.monotonic()
+        self._results.clear()
+        self.stats["trips"] += 1
+
+
+######################################################################
+# ツール呼び出しのガード
+# timeouts  -> ツール名ごとの1回の呼び出しの上限(秒)。指定のないツールはtimeout
+# slow_call -> これを超えた呼び出しは成功しても失敗として数える(秒)
+######################################################################
+class ToolGuard:
+    def __init__(
+        self,
+        timeout: Optional[float] = 10.0,
+        timeouts: Optional[dict] = None,
+        slow_call: Optional[float] = 5.0,
+        window: int = 20,
+        min_calls: int = 5,
+        failure_rate: float = 0.5,
+        cooldown: float = 30.0,
+        max_workers: int = 32,
+    ):
+        self.timeout = timeout
+        self.timeouts = dict(timeouts or {})
+        self.slow_call = slow_call
+        self._breaker_args = {"window": window, "min_calls": min_calls, "failure_rate": failure_rate, "cooldown": cooldown}
+        self._breakers: dict[str, CircuitBreaker] = {}
+        self._lock = threading.Lock()
+        # 同期のツールを期限付きで待つためのスレッド(打ち切ったツールは裏で最後まで実行される)
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="tool-guard")
+
+    ##################################################################
+    # 環境変数から作成する
+    # TOOL_TIMEOUT          -> 1回の呼び出しの上限(秒)。"5"または"tavily_search_results_json=5,..."
+    # TOOL_SLOW_CALL        -> 失敗として数える応答時間(秒)
+    # TOOL_BREAKER_WINDOW / TOOL_BREAKER_MIN_CALLS / TOOL_BREAKER_FAILURE_RATE / TOOL_BREAKER_COOLDOWN
+    ##################################################################
+    @classmethod
+    def from_env(cls) -> "ToolGuard":
+        value = os.getenv("TOOL_TIMEOUT", "10")
+        timeouts = parse_limits(value, float) if "=" in value else {}
+        slow_call = os.getenv("TOOL_SLOW_CALL", "5")
+        return cls(
+            timeout=None if "=" in value or not value else float(value),
+            timeouts=timeouts,
+            slow_call=float(slow_call) if slow_call else None,
+            window=int(os.getenv("TOOL_BREAKER_WINDOW", "20")),
+            min_calls=int(os.getenv("TOOL_BREAKER_MIN_CALLS", "5")),
+            failure_rate=float(os.getenv("TOOL_BREAKER_FAILURE_RATE", "0.5")),
+            cooldown=float(os.getenv("TOOL_BREAKER_COOLDOWN", "30")),
+        )
+
+    def breaker(self, name: str) -> CircuitBreaker:
+        with self._lock:
+            if name not in self._breakers:
+                self._breakers[name] = CircuitBreaker(**self._breaker_args)
+            return self._breakers[name]
+
+    ##################################################################
+    # 呼び出しの前の判定
+    # 戻り値 -> (打ち切るまでの時間(秒)またはNone, すぐに返すToolMessageまたはNone)
+    ##################################################################
+    def _admit(self, request) -> tuple[Optional[float], Optional[ToolMessage]]:
+        name = request.tool_call["name"]
+        left = time_left(getattr(request.runtime, "config", None))
+        if left is not None and left <= 0:
+            return None, self.unavailable(request.tool_call, "deadline_exceeded")
+        breaker = self.breaker(name)
+        if not breaker.allow():
+            return None, self.unavailable(request.tool_call, "circuit_open", breaker.retry_after())
+        timeout = self.timeouts.get(name, self.timeout)
+        if left is not None:
+            timeout = left if timeout is None else min(timeout, left)
+        return timeout, None
+
+    def _record(self, name: str, result, elapsed: float) -> None:
+        failed = isinstance(result, ToolMessage) and result.status == "error"
+        slow = self.slow_call is not None and elapsed > self.slow_call
+        self.breaker(name).record(failed or slow, slow=slow)
+
+    def _timed_out(self, request, timeout: float, started: list[float]) -> ToolMessage:
+        # 枠を待っている間や、実行が始まってすぐに期限を過ぎた場合はツールの失敗として数えない
+        name = request.tool_call["name"]
+        breaker = self.breaker(name)
+        limit = min(t for t in (self.slow_call, self.timeouts.get(name, self.timeout), timeout) if t is not None)
+        if started and time.perf_counter() - started[0] >= limit:
+            breaker.record(True, timeout=True)
+        else:
+            breaker.release()
+        return self.unavailable(request.tool_call, "timeout", timeout=timeout)
+
+    ##################################################################
+    # ToolNodeのwrap_tool_callに渡すラッパー(同期)
+    # ツールを別スレッドで実行し、期限までに終わらなければ待つのをやめる
+    ##################################################################
+    def wrap_tool_call(self, request, execute):
+        timeout, rejected = self._admit(request)
+        if rejected is not None:
+            return rejected
+        name = request.tool_call["name"]
+        started: list[float] = []
+
+        def run():
+            started.append(time.perf_counter())
+            return execute(request)
+
+        # interrupt()などがグラフの実行中のcontextvarを参照できるように、コンテキストごと渡す
+        future = self._executor.submit(contextvars.copy_context().run, run)
+        try:
+            result = future.result(timeout=timeout)
+        except FutureTimeoutError:
+            future.cancel()
+            return self._timed_out(request, timeout, started)
+        except GraphBubbleUp:
+            self.breaker(name).release()
+            raise
+        except Exception:
+            self.breaker(name).record(True)
+            raise
+        self._record(name, result, time.perf_counter() - started[0])
+        return result
+
+    ##################################################################
+    # ToolNodeのawrap_tool_callに渡すラッパー(非同期)
+    # execute -> 実際の呼び出し
+    # slot    -> 呼び出し枠(provider_limits.pyのlimiter.tool_limit(request)など)
+    #            期限には枠を待つ時間も含めるが、遅い呼び出しの判定には含めない
+    ##################################################################
+    async def awrap_tool_call(self, request, execute, slot=None):
+        timeout, rejected = self._admit(request)
+        if rejected is not None:
+            return rejected
+        name = request.tool_call["name"]
+        started: list[float] = []
+
+        async def run():
+            if slot is None:
+                started.append(time.perf_counter())
+                return await execute(request)
+            async with slot:
+                started.append(time.perf_counter())
+                return await execute(request)
+
+        try:
+            result = await asyncio.wait_for(run(), timeout)
+        except asyncio.TimeoutError:
+            return self._timed_out(request, timeout, started)
+        except GraphBubbleUp:
+            self.breaker(name).release()
+            raise
+        except Exception:
+            self.breaker(name).record(True)
+            raise
+        self._record(name, result, time.perf_counter() - started[0])
+        return result
+
+    ##################################################################
+    # 使えないツールの結果
+    # モデルが理由を判断できるように、内容はJSONで返す
+    ##################################################################
+    def unavailable(
+        self, tool_call: dict, reason: str, retry_after: Optional[float] = None, timeout: Optional[float] = None
+    ) -> ToolMessage:
+        content = {
+            "error": "tool_unavailable",
+            "tool": tool_call["name"],
+            "reason": reason,
+            "message": "This tool is temporarily unavailable. Answer without it.",
+        }
+        if retry_after:
+            content["retry_after"] = round(retry_after, 1)
+        if timeout is not None:
+            content["timeout"] = round(timeout, 2)
+        return ToolMessage(
+            content=json.dumps(content),
+            tool_call_id=tool_call["id"],
+            name=tool_call["name"],
+            status="error",
+            response_metadata={"tool_unavailable": reason},
+        )
+
+    def stats(self) -> dict:
+        with self._lock:
+            breakers = dict(self._breakers)
+        return {
+            name: {"state": breaker.state, "retry_after": round(breaker.retry_after(), 1), **breaker.stats}
+            for name, breaker in breakers.items()
+        }
@@ -0,0 +1,134 @@
+######################################################################
+# import_budget.py
+# 起動時間(インポート時間)の計測
+#
+# 各対象を別プロセスで複数回インポートし、プロセスの起動から
+# インポート完了までの時間(中央値)が予算を超えた場合は終了コード1で終了する
+# また、起動時に読み込まれてはいけないモジュール(使わないプロバイダSDKなど)が
+# 読み込まれていないかを確認する
+#
+# 実行例)
+# python import_budget.py
+# python import_budget.py --budget serve=2000 --repeat 5
+######################################################################
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+SRC_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# 起動時に読み込まれてはいけない重いモジュール
+HEAVY_MODULES = (
+    "langchain_openai",
+    "openai",
+    "langchain_anthropic",
+    "anthropic",
+    "langchain_community",
+    "langgraph",
+    "chromadb",
+    "faiss",
+    "tavily",
+)
+
+######################################################################
+# 計測対象
+# 名前 -> (作業ディレクトリ(srcからの相対パス), インポートするモジュール,
+#          読み込まれてはいけないモジュール, 予算(ミリ秒))
+######################################################################
+TARGETS = {
+    "main": (".", "main", HEAVY_MODULES, 150),
+    "serve": ("LangChain", "serve", HEAVY_MODULES, 3000),
+}
+
+PROBE = """
+import json, sys, time
+start = time.perf_counter()
+import {module}
+elapsed = time.perf_counter() - start
+print(json.dumps({{"import_s": elapsed, "loaded": [m for m in {forbidden!r} if m in sys.modules]}}))
+"""
+
+
+def measure(name: str, repeat: int) -> dict:
+    directory, module, forbidden, budget_ms = TARGETS[name]
+    cwd = os.path.join(SRC_DIR, directory)
+    code = PROBE.format(module=module, forbidden=tuple(forbidden))
+    walls, imports, loaded, slowest = [], [], [], []
+    for i in range(repeat):
+        command = [sys.executable, "-X", "importtime", "-c", code]
+        start = time.perf_counter()
+        result = subprocess.run(command, cwd=cwd, capture_output=True, text=True)
+        walls.append(time.perf_counter() - start)
+        if result.returncode != 0:
+            raise RuntimeError(f"{name}: import failed\n{result.stderr[-2000:]}")
+        probe = json.loads(result.stdout.strip().splitlines()[-1])
+        imports.append(probe["import_s"])
+        loaded = probe["loaded"]
+        if i == repeat - 1:
+            slowest = slowest_imports(result.stderr)
+    wall_ms = statistics.median(walls) * 1000.0
+    return {
+        "name": name,
+        "module": module,
+        "budget_ms": budget_ms,
+        "wall_ms": wall_ms,
+        "import_ms": statistics.median(imports) * 1000.0,
+        "forbidden_loaded": loaded,
+        "slowest": slowest,
+        "ok": wall_ms <= budget_ms and not loaded,
+    }
+
+
+######################################################################
+# -X importtime の出力から、直接インポートされたモジュールのうち
+# 累積時間が大きいものを取り出す
+######################################################################
+def slowest_imports(stderr: str, top: int = 5) -> list:
+    entries = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "[us]" in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        depth = (len(name) - len(name.lstrip())) // 2
+        if depth <= 1:
+            entries.append((int(cumulative), name.strip()))
+    entries.sort(reverse=True)
+    return [{"module": module, "cumulative_ms": us / 1000.0} for us, module in entries[:top]]
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="起動時間(インポート時間)の計測")
+    parser.add_argument("targets", nargs="*", default=list(TARGETS), help="計測対象")
+    parser.add_argument("--repeat", type=int, default=3, help="計測回数(中央値を使う)")
+    parser.add_argument("--budget", action="append", default=[], help="予算の上書き(例: serve=2000)")
+    parser.add_argument("--json", help="結果をJSONで保存するパス")
+    args = parser.parse_args(argv)
+
+    for item in args.budget:
+        name, _, value = item.partition("=")
+        directory, module, forbidden, _ = TARGETS[name]
+        TARGETS[name] = (directory, module, forbidden, float(value))
+
+    results = [measure(name, args.repeat) for name in args.targets]
+    for result in results:
+        status = "OK  " if result["ok"] else "FAIL"
+        print(
+            f"{status} {result['name']:<8} wall={result['wall_ms']:7.1f}ms "
+            f"import={result['import_ms']:7.1f}ms budget={result['budget_ms']:.0f}ms"
+        )
+        if result["forbidden_loaded"]:
+            print(f"     loaded at startup: {', '.join(result['forbidden_loaded'])}")
+        for entry in result["slowest"]:
+            print(f"     {entry['cumulative_ms']:8.1f}ms  {entry['module']}")
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+    return 0 if all(result["ok"] for result in results) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
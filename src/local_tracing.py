@@ -0,0 +1,707 @@
+######################################################################
+# local_tracing.py
+# LangSmithの代わりに使うローカルのトレース(chain・グラフの各ステップの実行時間)
+#
+# LANGCHAIN_TRACING_V2=trueの場合、chain・グラフのステップごとのデータがネットワーク越しに
+# LangSmithに送られる。LOCAL_TRACING=trueの場合はLangSmithへの送信を止め、
+# 各ステップ(span)の名前・種類・開始時刻・実行時間・エラーだけをローカルのファイルに書き出す
+#
+# - 登録     -> install()でLangChainのconfigure hookに登録するため、chain・グラフのコードを
+#               変更せずに全ての実行(子の実行を含む)が記録される(main.py・serve.pyで呼び出す)
+# - サンプリング -> head: 最上位の実行の開始時にLOCAL_TRACING_SAMPLE_RATEの確率で記録するかを決める
+#               tail: LOCAL_TRACING_SLOW_MSを指定した場合は全てのspanを一旦保持し、
+#               最上位の実行が終わった時に、遅い・エラーになったトレースも記録する
+# - 書き出し -> コールバックではspanをタプルにしてメモリのバッファに追加するだけにし、
+#               バックグラウンドのスレッドがまとめてJSONL/SQLiteのファイルに書き出す
+#               ファイルはLOCAL_TRACING_MAX_BYTESで切り替え、このプロセスのファイルが
+#               LOCAL_TRACING_MAX_FILESを超えたら古いものから削除する(他のプロセスのファイルは消さない)
+# - メモリ   -> バッファ(LOCAL_TRACING_BUFFER件)・実行中のspan・1つのトレースのspanの数に上限を設け、
+#               超えた分は記録せずに数だけ数える
+#
+# 実行例)
+# LOCAL_TRACING=true python main.py serve
+# python local_tracing.py slow --min-ms 500          -> 遅いトレースの一覧
+# python local_tracing.py trace 3f2a                 -> トレースのspanの木(IDの先頭で指定)
+# python local_tracing.py summary                    -> spanの名前ごとの件数・p50/p95
+# python local_tracing.py bench                      -> トレースのオーバーヘッドの計測
+######################################################################
+import argparse
+import atexit
+import contextvars
+import glob
+import itertools
+import json
+import os
+import random
+import sqlite3
+import statistics
+import sys
+import threading
+import time
+from collections import deque
+from typing import Any, Iterator, Optional
+from uuid import UUID
+
+from langchain_core.callbacks import BaseCallbackHandler
+
+SRC_DIR = os.path.dirname(os.path.abspath(__file__))
+
+FIELDS = ("trace_id", "span_id", "parent_id", "name", "kind", "start", "duration_ms", "error", "thread_id")
+
+
+def _env_bool(name: str) -> bool:
+    return os.getenv(name, "").lower() in ("1", "true", "yes", "on")
+
+
+class _Trace:
+    # 1つの最上位の実行(とその子)のspan
+    __slots__ = ("root", "sampled", "error", "spans", "thread_id")
+
+    def __init__(self, root: UUID, sampled: bool, thread_id: Any):
+        self.root = root
+        self.sampled = sampled
+        self.error = False
+        self.spans: list = []
+        self.thread_id = thread_id
+
+
+######################################################################
+# 書き出し先(JSONL / SQLite)
+######################################################################
+class _JsonlSink:
+    suffix = "jsonl"
+
+    def __init__(self, path: str):
+        self.path = path
+        self._file = open(path, "a", encoding="utf-8")
+
+    def write(self, rows: list[dict]) -> None:
+        self._file.write("".join(json.dumps(row, ensure_ascii=False) + "\n" for row in rows))
+        self._file.flush()
+
+    def size(self) -> int:
+        return self._file.tell()
+
+    def close(self) -> None:
+        self._file.close()
+
+
+class _SqliteSink:
+    suffix = "sqlite"
+
+    def __init__(self, path: str):
+        self.path = path
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(f"CREATE TABLE IF NOT EXISTS spans ({', '.join(FIELDS)})")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS spans_trace ON spans (trace_id)")
+        self._conn.commit()
+
+    def write(self, rows: list[dict]) -> None:
+        self._conn.executemany(
+            f"INSERT INTO spans VALUES ({', '.join('?' for _ in FIELDS)})",
+            [tuple(row[field] for field in FIELDS) for row in rows],
+        )
+        self._conn.commit()
+
+    def size(self) -> int:
+        # WALモードでは書き込みは先に-walファイルに溜まるため、その分も含める
+        wal = self.path + "-wal"
+        return os.path.getsize(self.path) + (os.path.getsize(wal) if os.path.exists(wal) else 0)
+
+    def close(self) -> None:
+        self._conn.close()
+
+
+SINKS = {"jsonl": _JsonlSink, "sqlite": _SqliteSink}
+
+
+######################################################################
+# ローカルのトレース(コールバック)
+# path          -> 書き出し先のディレクトリ
+# sample_rate   -> 記録する最上位の実行の割合(head sampling)
+# slow_ms       -> これより遅い・エラーになったトレースは常に記録する(tail sampling、Noneの場合は無効)
+# format        -> "jsonl" または "sqlite"
+# max_buffer    -> 書き出し待ちのspanの上限
+# max_active    -> 実行中のspanの上限(終了しないまま残ったspanは max_age 秒後に捨てる)
+# max_trace_spans -> 1つのトレースで保持するspanの上限
+# batch_size / flush_interval -> この件数が溜まるか、この秒数ごとにまとめて書き出す
+# max_bytes / max_files       -> ファイルを切り替えるサイズ / 残すファイルの数
+######################################################################
+class LocalTracer(BaseCallbackHandler):
+    # コールバックはスレッドプールに回さず、その場で実行する
+    run_inline = True
+    raise_error = False
+
+    def __init__(
+        self,
+        path: str = "traces",
+        sample_rate: float = 1.0,
+        slow_ms: Optional[float] = None,
+        format: str = "jsonl",
+        max_buffer: int = 10000,
+        max_active: int = 100000,
+        max_trace_spans: int = 1000,
+        batch_size: int = 512,
+        flush_interval: float = 1.0,
+        max_bytes: int = 16 * 1024 * 1024,
+        max_files: int = 10,
+        max_age: float = 3600.0,
+    ):
+        if format not in SINKS:
+            raise ValueError(f"unknown format: {format} (jsonl / sqlite)")
+        self.path = path
+        self.sample_rate = sample_rate
+        self.slow_ms = slow_ms
+        self.format = format
+        self.max_buffer = max_buffer
+        self.max_active = max_active
+        self.max_trace_spans = max_trace_spans
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_bytes = max_bytes
+        self.max_files = max_files
+        self.max_age = max_age
+        # 実行中のspan: run_id -> (トレース(記録しない場合はNone), 開始時刻, 名前, 種類, 親のrun_id)
+        self._active: dict = {}
+        # 書き出し待ちのトレースと、その中のspanの数(書き出しのスレッドと共有するため_buffer_lockで守る)
+        self._buffer: deque = deque()
+        self._buffered = 0
+        self._buffer_lock = threading.Lock()
+        # perf_counter() -> エポック秒の変換(書き出し時に使う)
+        self._epoch = time.time() - time.perf_counter()
+        self._wake = threading.Event()
+        self._write_lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+        self._sink = None
+        self._stats = {
+            "spans": 0, "traces": 0, "sampled_out": 0, "written": 0,
+            "dropped": 0, "expired": 0, "files": 0, "write_errors": 0,
+        }
+
+    ##################################################################
+    # 環境変数から作成する
+    # LOCAL_TRACING_DIR / LOCAL_TRACING_SAMPLE_RATE / LOCAL_TRACING_SLOW_MS / LOCAL_TRACING_FORMAT
+    # LOCAL_TRACING_BUFFER / LOCAL_TRACING_FLUSH_INTERVAL / LOCAL_TRACING_MAX_BYTES / LOCAL_TRACING_MAX_FILES
+    ##################################################################
+    @classmethod
+    def from_env(cls) -> "LocalTracer":
+        slow_ms = os.getenv("LOCAL_TRACING_SLOW_MS")
+        return cls(
+            path=os.getenv("LOCAL_TRACING_DIR", "traces"),
+            sample_rate=float(os.getenv("LOCAL_TRACING_SAMPLE_RATE", "1.0")),
+            slow_ms=float(slow_ms) if slow_ms else None,
+            format=os.getenv("LOCAL_TRACING_FORMAT", "jsonl"),
+            max_buffer=int(os.getenv("LOCAL_TRACING_BUFFER", "10000")),
+            flush_interval=float(os.getenv("LOCAL_TRACING_FLUSH_INTERVAL", "1.0")),
+            max_bytes=int(os.getenv("LOCAL_TRACING_MAX_BYTES", str(16 * 1024 * 1024))),
+            max_files=int(os.getenv("LOCAL_TRACING_MAX_FILES", "10")),
+        )
+
+    ##################################################################
+    # spanの開始・終了
+    # 親が実行中でない実行を最上位とし、そこで記録するかどうかを決める
+    # (記録しないトレースもNoneとして登録し、子の実行が最上位と扱われないようにする)
+    ##################################################################
+    def _start(self, run_id: UUID, parent_run_id: Optional[UUID], name: str, kind: str, metadata) -> None:
+        parent = self._active.get(parent_run_id) if parent_run_id is not None else None
+        if parent is not None:
+            trace = parent[0]
+        else:
+            sampled = self.sample_rate >= 1.0 or random.random() < self.sample_rate
+            if sampled or self.slow_ms is not None:
+                trace = _Trace(run_id, sampled, metadata.get("thread_id") if metadata else None)
+            else:
+                trace = None
+                self._stats["sampled_out"] += 1
+        if len(self._active) >= self.max_active:
+            self._stats["dropped"] += 1
+            return
+        self._active[run_id] = (trace, time.perf_counter(), name, kind, parent_run_id)
+
+    def _end(self, run_id: UUID, error: Optional[str] = None) -> None:
+        entry = self._active.pop(run_id, None)
+        if entry is None:
+            return
+        trace, start, name, kind, parent_run_id = entry
+        if trace is None:
+            return
+        duration = time.perf_counter() - start
+        if len(trace.spans) < self.max_trace_spans:
+            trace.spans.append((run_id, parent_run_id, name, kind, start, duration, error))
+        else:
+            self._stats["dropped"] += 1
+        if error is not None:
+            trace.error = True
+        if run_id == trace.root:
+            self._finish(trace, duration)
+
+    def _finish(self, trace: _Trace, duration: float) -> None:
+        keep = trace.sampled or trace.error or (self.slow_ms is not None and duration * 1000 >= self.slow_ms)
+        if not keep:
+            self._stats["sampled_out"] += 1
+            return
+        with self._buffer_lock:
+            if self._buffered + len(trace.spans) > self.max_buffer:
+                self._stats["dropped"] += len(trace.spans)
+                return
+            self._buffered += len(trace.spans)
+            self._buffer.append(trace)
+            buffered = self._buffered
+        self._stats["traces"] += 1
+        self._stats["spans"] += len(trace.spans)
+        if self._thread is None:
+            self.start()
+        if buffered >= self.batch_size and not self._wake.is_set():
+            self._wake.set()
+
+    @staticmethod
+    def _name(serialized: Optional[dict], kwargs: dict, default: str) -> str:
+        name = kwargs.get("name")
+        if name:
+            return name
+        if serialized:
+            return serialized.get("name") or (serialized.get("id") or [default])[-1]
+        return default
+
+    ##################################################################
+    # LangChainのコールバック
+    ##################################################################
+    def on_chain_start(self, serialized, inputs, *, run_id, parent_run_id=None, metadata=None, **kwargs: Any) -> None:
+        self._start(run_id, parent_run_id, self._name(serialized, kwargs, "chain"), "chain", metadata)
+
+    def on_chat_model_start(self, serialized, messages, *, run_id, parent_run_id=None, metadata=None, **kwargs: Any) -> None:
+        self._start(run_id, parent_run_id, self._name(serialized, kwargs, "chat_model"), "llm", metadata)
+
+    def on_llm_start(self, serialized, prompts, *, run_id, parent_run_id=None, metadata=None, **kwargs: Any) -> None:
+        self._start(run_id, parent_run_id, self._name(serialized, kwargs, "llm"), "llm", metadata)
+
+    def on_tool_start(self, serialized, input_str, *, run_id, parent_run_id=None, metadata=None, **kwargs: Any) -> None:
+        self._start(run_id, parent_run_id, self._name(serialized, kwargs, "tool"), "tool", metadata)
+
+    def on_retriever_start(self, serialized, query, *, run_id, parent_run_id=None, metadata=None, **kwargs: Any) -> None:
+        self._start(run_id, parent_run_id, self._name(serialized, kwargs, "retriever"), "retriever", metadata)
+
+    def on_chain_end(self, outputs, *, run_id, **kwargs: Any) -> None:
+        self._end(run_id)
+
+    def on_llm_end(self, response, *, run_id, **kwargs: Any) -> None:
+        self._end(run_id)
+
+    def on_tool_end(self, output, *, run_id, **kwargs: Any) -> None:
+        self._end(run_id)
+
+    def on_retriever_end(self, documents, *, run_id, **kwargs: Any) -> None:
+        self._end(run_id)
+
+    def on_chain_error(self, error, *, run_id, **kwargs: Any) -> None:
+        self._end(run_id, type(error).__name__)
+
+    def on_llm_error(self, error, *, run_id, **kwargs: Any) -> None:
+        self._end(run_id, type(error).__name__)
+
+    def on_tool_error(self, error, *, run_id, **kwargs: Any) -> None:
+        self._end(run_id, type(error).__name__)
+
+    def on_retriever_error(self, error, *, run_id, **kwargs: Any) -> None:
+        self._end(run_id, type(error).__name__)
+
+    ##################################################################
+    # バックグラウンドでの書き出し
+    ##################################################################
+    def start(self) -> None:
+        with self._write_lock:
+            if self._thread is not None:
+                return
+            self._thread = threading.Thread(target=self._run, name="local-tracing", daemon=True)
+            self._thread.start()
+        atexit.register(self.flush)
+
+    def _run(self) -> None:
+        last_expire = time.perf_counter()
+        while True:
+            self._wake.wait(self.flush_interval)
+            self._wake.clear()
+            self.flush()
+            if time.perf_counter() - last_expire >= 60.0:
+                self._expire()
+                last_expire = time.perf_counter()
+
+    def _rows(self, trace: _Trace) -> list[dict]:
+        trace_id = str(trace.root)
+        return [
+            {
+                "trace_id": trace_id,
+                "span_id": str(run_id),
+                "parent_id": str(parent_run_id) if parent_run_id is not None and run_id != trace.root else None,
+                "name": name,
+                "kind": kind,
+                "start": round(self._epoch + start, 6),
+                "duration_ms": round(duration * 1000, 3),
+                "error": error,
+                "thread_id": trace.thread_id,
+            }
+            for run_id, parent_run_id, name, kind, start, duration, error in trace.spans
+        ]
+
+    def flush(self) -> None:
+        with self._write_lock:
+            while self._buffer:
+                traces = []
+                count = 0
+                with self._buffer_lock:
+                    while self._buffer and count < self.batch_size:
+                        trace = self._buffer.popleft()
+                        self._buffered -= len(trace.spans)
+                        traces.append(trace)
+                        count += len(trace.spans)
+                rows = [row for trace in traces for row in self._rows(trace)]
+                try:
+                    self._open().write(rows)
+                    self._stats["written"] += len(rows)
+                except Exception:
+                    self._stats["write_errors"] += 1
+                    self._close()
+
+    def _expire(self) -> None:
+        # 終了の通知が来なかった(途中で捨てられたストリーミングなど)spanを捨てる
+        limit = time.perf_counter() - self.max_age
+        for run_id, entry in list(self._active.items()):
+            if entry[1] < limit and self._active.pop(run_id, None) is not None:
+                self._stats["expired"] += 1
+
+    ##################################################################
+    # ファイルの切り替え
+    # spans-<時刻>-<pid>.<jsonl|sqlite>。max_bytesを超えたら新しいファイルにし、
+    # このプロセス(pid)のファイルがmax_filesを超えたら古いものから削除する
+    # (同じディレクトリに書き出している他のワーカーのファイルは削除しない)
+    ##################################################################
+    def _open(self):
+        if self._sink is not None and self._sink.size() < self.max_bytes:
+            return self._sink
+        self._close()
+        os.makedirs(self.path, exist_ok=True)
+        sink_class = SINKS[self.format]
+        now = time.time()
+        stamp = time.strftime("%Y%m%d-%H%M%S", time.localtime(now)) + f"-{int(now % 1 * 1_000_000):06d}"
+        pid = os.getpid()
+        name = f"spans-{stamp}-{pid}.{sink_class.suffix}"
+        self._sink = sink_class(os.path.join(self.path, name))
+        self._stats["files"] += 1
+        for old in trace_files(self.path, pid)[: -self.max_files or None]:
+            if old != self._sink.path:
+                for path in (old, old + "-wal", old + "-shm"):
+                    if os.path.exists(path):
+                        os.remove(path)
+        return self._sink
+
+    def _close(self) -> None:
+        if self._sink is not None:
+            self._sink.close()
+            self._sink = None
+
+    def close(self) -> None:
+        self.flush()
+        with self._write_lock:
+            self._close()
+
+    def stats(self) -> dict:
+        stats = dict(self._stats)
+        with self._buffer_lock:
+            stats["buffered"] = self._buffered
+        stats["active"] = len(self._active)
+        return stats
+
+
+######################################################################
+# 登録
+# 全ての実行(コールバックを指定していないものを含む)にLocalTracerを追加する
+# LangSmithへの送信は止める(LANGCHAIN_TRACING_V2 / LANGSMITH_TRACING=false)
+# 同じプロセスで複数回呼んでも登録は1回だけ
+######################################################################
+_tracer: Optional[LocalTracer] = None
+
+
+def install(tracer: Optional[LocalTracer] = None) -> LocalTracer:
+    global _tracer
+    if _tracer is not None:
+        return _tracer
+    from langchain_core.tracers.context import register_configure_hook
+
+    os.environ["LANGCHAIN_TRACING_V2"] = "false"
+    os.environ["LANGSMITH_TRACING"] = "false"
+    _tracer = tracer or LocalTracer.from_env()
+    # デフォルト値をトレーサーにしたcontextvar(どのスレッド・タスクからも参照できる)
+    register_configure_hook(contextvars.ContextVar("local_tracing", default=_tracer), inheritable=True)
+    return _tracer
+
+
+def install_from_env() -> Optional[LocalTracer]:
+    return install() if _env_bool("LOCAL_TRACING") else None
+
+
+def get_tracer() -> Optional[LocalTracer]:
+    return _tracer
+
+
+######################################################################
+# 読み込み
+######################################################################
+def trace_files(path: str, pid: Optional[int] = None) -> list[str]:
+    # pidを指定した場合はそのプロセスが書き出したファイルだけ
+    pattern = f"spans-*-{pid}" if pid is not None else "spans-*"
+    return sorted(
+        glob.glob(os.path.join(path, pattern + ".jsonl")) + glob.glob(os.path.join(path, pattern + ".sqlite"))
+    )
+
+
+def iter_spans(path: str) -> Iterator[dict]:
+    for file in trace_files(path):
+        if file.endswith(".jsonl"):
+            with open(file, encoding="utf-8") as f:
+                for line in f:
+                    if line.strip():
+                        yield json.loads(line)
+        else:
+            conn = sqlite3.connect(f"file:{file}?mode=ro", uri=True)
+            try:
+                for row in conn.execute(f"SELECT {', '.join(FIELDS)} FROM spans"):
+                    yield dict(zip(FIELDS, row))
+            finally:
+                conn.close()
+
+
+def _percentile(values: list[float], q: float) -> float:
+    return values[min(int(q * len(values)), len(values) - 1)] if values else 0.0
+
+
+def _time(start: float) -> str:
+    return time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(start))
+
+
+######################################################################
+# 遅いトレースの一覧
+# 最上位のspanを実行時間の長い順に表示する
+######################################################################
+def cmd_slow(args) -> None:
+    roots, counts = [], {}
+    for span in iter_spans(args.dir):
+        counts[span["trace_id"]] = counts.get(span["trace_id"], 0) + 1
+        if span["span_id"] != span["trace_id"] or span["duration_ms"] < args.min_ms:
+            continue
+        if args.name and args.name not in span["name"]:
+            continue
+        if args.since and span["start"] < time.time() - args.since:
+            continue
+        roots.append(span)
+    roots.sort(key=lambda span: span["duration_ms"], reverse=True)
+    print(f"{'start':<19} {'duration_ms':>11} {'spans':>5}  {'trace_id':<36} name (thread_id) error")
+    for span in roots[: args.limit]:
+        thread = f" ({span['thread_id']})" if span.get("thread_id") else ""
+        print(f"{_time(span['start'])} {span['duration_ms']:>11.1f} {counts[span['trace_id']]:>5}  "
+              f"{span['trace_id']:<36} {span['name']}{thread} {span['error'] or ''}")
+
+
+######################################################################
+# トレースのspanの木
+# 各spanの開始時刻はトレースの開始からの経過時間(ms)で表示する
+######################################################################
+def cmd_trace(args) -> None:
+    spans = [span for span in iter_spans(args.dir) if span["trace_id"].startswith(args.trace_id)]
+    if not spans:
+        print(f"trace not found: {args.trace_id}", file=sys.stderr)
+        sys.exit(1)
+    trace_ids = {span["trace_id"] for span in spans}
+    if len(trace_ids) > 1:
+        print(f"ambiguous trace id: {args.trace_id} ({len(trace_ids)} traces)", file=sys.stderr)
+        sys.exit(1)
+    children: dict = {}
+    for span in spans:
+        children.setdefault(span["parent_id"], []).append(span)
+    origin = min(span["start"] for span in spans)
+
+    def show(span: dict, depth: int) -> None:
+        offset = (span["start"] - origin) * 1000
+        error = f"  ! {span['error']}" if span["error"] else ""
+        print(f"{offset:>9.1f} {span['duration_ms']:>10.1f}  {'  ' * depth}{span['name']} [{span['kind']}]{error}")
+        for child in sorted(children.get(span["span_id"], []), key=lambda s: s["start"]):
+            show(child, depth + 1)
+
+    print(f"{'start_ms':>9} {'duration_ms':>10}  name [kind]")
+    ids = {span["span_id"] for span in spans}
+    # 親が記録されていないspan(上限で捨てたものなど)も最上位として表示する
+    for span in sorted((s for s in spans if s["parent_id"] not in ids), key=lambda s: s["start"]):
+        show(span, 0)
+
+
+######################################################################
+# spanの名前ごとの集計
+######################################################################
+def cmd_summary(args) -> None:
+    groups: dict = {}
+    for span in iter_spans(args.dir):
+        group = groups.setdefault((span["kind"], span["name"]), {"durations": [], "errors": 0})
+        group["durations"].append(span["duration_ms"])
+        group["errors"] += bool(span["error"])
+    print(f"{'kind':<10} {'name':<40} {'count':>7} {'p50_ms':>9} {'p95_ms':>9} {'max_ms':>9} {'errors':>6}")
+    rows = sorted(groups.items(), key=lambda item: sum(item[1]["durations"]), reverse=True)
+    for (kind, name), group in rows[: args.limit]:
+        durations = sorted(group["durations"])
+        print(f"{kind:<10} {name[:40]:<40} {len(durations):>7} {statistics.median(durations):>9.2f} "
+              f"{_percentile(durations, 0.95):>9.2f} {durations[-1]:>9.2f} {group['errors']:>6}")
+
+
+######################################################################
+# オーバーヘッドの計測
+# - callbacks -> コールバックだけを直接呼んだ場合の1 spanあたりの時間
+# - chain     -> serve.pyと同じ構成のchain(prompt | model | parser、モデルはFakeChatModel)
+# - graph     -> build_chatbot_graph()のグラフ(モデル・ツールはfakes.py、checkpointerはメモリ)
+# トレースなし・何もしないコールバック・トレースあり(sample_rate=1 / 0)で交互に実行し、
+# 差分をspanの数で割る(何もしないコールバックとの差がこのトレースの処理の分、
+# トレースなしとの差はLangChainのコールバックの呼び出しの分も含む)
+######################################################################
+class _NoopHandler(BaseCallbackHandler):
+    run_inline = True
+
+def _measure(run, handlers: dict, iterations: int) -> dict:
+    # 1回ずつ順番を入れ替えながら実行し、1回あたりの時間の中央値を返す
+    # (CPUの周波数・GCなどの揺らぎが特定の条件にだけ偏らないようにする)
+    configs = {name: {"callbacks": [handler]} if handler is not None else {} for name, handler in handlers.items()}
+    names = list(configs)
+    times: dict = {name: [] for name in names}
+    for i in range(iterations):
+        for name in names[i % len(names):] + names[: i % len(names)]:
+            start = time.perf_counter()
+            run(i, configs[name])
+            times[name].append(time.perf_counter() - start)
+    return {name: statistics.median(values) for name, values in times.items()}
+
+
+def _bench_callbacks(tracer: LocalTracer, iterations: int) -> float:
+    import uuid
+
+    ids = [uuid.uuid4() for _ in range(iterations)]
+    start = time.perf_counter()
+    for run_id in ids:
+        tracer.on_chain_start(None, None, run_id=run_id, parent_run_id=None, name="bench")
+        tracer.on_chain_end(None, run_id=run_id)
+    return (time.perf_counter() - start) / iterations
+
+
+def _chain_target():
+    sys.path.insert(0, os.path.join(SRC_DIR, "LangChain"))
+    from fake_chat_model import FakeChatModel
+    from langchain_core.output_parsers import StrOutputParser
+    from langchain_core.prompts import ChatPromptTemplate
+
+    prompt_template = ChatPromptTemplate.from_messages([("system", "Translate the following into {language}:"), ("user", "{text}")])
+    chain = prompt_template | FakeChatModel() | StrOutputParser()
+    return lambda i, config: chain.invoke({"language": "Japanese", "text": f"hello {i}"}, config)
+
+
+def _graph_target():
+    import asyncio
+
+    sys.path.insert(0, os.path.join(SRC_DIR, "LangGraph"))
+    os.environ.setdefault("LLM_CACHE", "false")
+    from chatbot_graph import build_chatbot_graph
+    from fakes import FakeSearchTool, FakeToolCallingModel
+    from langgraph.checkpoint.memory import InMemorySaver
+    from provider_limits import ProviderLimiter
+    from tool_guard import ToolGuard
+
+    graph = build_chatbot_graph(
+        llm=FakeToolCallingModel(),
+        tools=[FakeSearchTool()],
+        checkpointer=InMemorySaver(),
+        limiter=ProviderLimiter({}),
+        guard=ToolGuard(),
+    )
+    loop = asyncio.new_event_loop()
+    threads = itertools.count()
+
+    def run(i, config):
+        # 毎回新しいthread_idで実行する(履歴が伸びて後の計測ほど遅くならないように)
+        config = {**config, "configurable": {"thread_id": f"bench-{next(threads)}"}}
+        loop.run_until_complete(graph.ainvoke({"messages": [{"role": "user", "content": f"What is {i}?"}]}, config))
+
+    return run
+
+
+def cmd_bench(args) -> None:
+    import tempfile
+
+    results = {}
+    with tempfile.TemporaryDirectory() as path:
+        sampled = LocalTracer(path=path, max_buffer=10**7)
+        unsampled = LocalTracer(path=path, sample_rate=0.0)
+        for name, tracer in (("sampled", sampled), ("unsampled", unsampled)):
+            per_call = min(_bench_callbacks(tracer, args.iterations * 10) for _ in range(args.repeat))
+            results[f"callbacks/{name}"] = {"us_per_span": per_call * 1e6}
+        sampled.flush()
+
+        targets = {"chain": _chain_target, "graph": _graph_target}
+        for target in args.targets.split(","):
+            run = targets[target]()
+            run(-1, {})
+            counter = LocalTracer(path=path, max_buffer=10**7)
+            _measure(run, {"count": counter}, 1)
+            spans = counter.stats()["spans"]
+            times = _measure(
+                run,
+                {"plain": None, "noop": _NoopHandler(), "sampled": sampled, "unsampled": unsampled},
+                args.iterations * args.repeat,
+            )
+            results[target] = {
+                "spans": spans,
+                "plain_ms": times["plain"] * 1000,
+                "traced_ms": times["sampled"] * 1000,
+                "us_per_span": (times["sampled"] - times["plain"]) / spans * 1e6,
+                "tracer_us_per_span": (times["sampled"] - times["noop"]) / spans * 1e6,
+                "unsampled_tracer_us_per_span": (times["unsampled"] - times["noop"]) / spans * 1e6,
+            }
+        sampled.close()
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+    for name, result in results.items():
+        print(name.ljust(20) + "  ".join(
+            f"{key}={value:.2f}" if isinstance(value, float) else f"{key}={value}" for key, value in result.items()
+        ))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="ローカルのトレースの検索・オーバーヘッドの計測")
+    parser.add_argument("--dir", default=os.getenv("LOCAL_TRACING_DIR", "traces"), help="トレースのディレクトリ")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    slow = commands.add_parser("slow", help="遅いトレースの一覧")
+    slow.add_argument("--min-ms", type=float, default=0.0, help="これより遅いトレースだけを表示する")
+    slow.add_argument("--name", help="最上位のspanの名前(部分一致)")
+    slow.add_argument("--since", type=float, help="直近この秒数のトレースだけを表示する")
+    slow.add_argument("--limit", type=int, default=20)
+    slow.set_defaults(func=cmd_slow)
+
+    trace = commands.add_parser("trace", help="トレースのspanの木")
+    trace.add_argument("trace_id", help="トレースのID(先頭の一部でもよい)")
+    trace.set_defaults(func=cmd_trace)
+
+    summary = commands.add_parser("summary", help="spanの名前ごとの件数・実行時間")
+    summary.add_argument("--limit", type=int, default=30)
+    summary.set_defaults(func=cmd_summary)
+
+    bench = commands.add_parser("bench", help="トレースのオーバーヘッドの計測")
+    bench.add_argument("--targets", default="chain,graph", help="計測するもの(chain,graph)")
+    bench.add_argument("--iterations", type=int, default=200, help="1回の計測での実行回数")
+    bench.add_argument("--repeat", type=int, default=5)
+    bench.add_argument("--json", action="store_true", help="結果をJSONで出力する")
+    bench.set_defaults(func=cmd_bench)
+
+    args = parser.parse_args()
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main()
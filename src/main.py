@@ -0,0 +1,94 @@
+######################################################################
+# main.py
+# 各サンプルプログラムの起動用エントリーポイント
+#
+# 指定したシナリオのスクリプトだけを実行する
+# 起動を速くするため、このファイルでは標準ライブラリ以外をインポートしない
+# (プロバイダSDK・chromadb/faiss・ツールはシナリオ側で必要になった時に読み込まれる)
+# LOCAL_TRACING=trueの場合はLangSmithの代わりにローカルのトレース(local_tracing.py)を
+# 有効にしてから実行する(serve.pyの複数ワーカーの場合も各ワーカーで有効になる)
+#
+# 実行例)
+# python main.py --list                 -> シナリオの一覧
+# python main.py serve                  -> LangChain/serve.py
+# python main.py client --input a.jsonl -> LangChain/client.py に引数を渡して実行
+# python main.py                        -> 環境変数APP_SCENARIOのシナリオ(デフォルトはserve)
+######################################################################
+import os
+import runpy
+import sys
+
+SRC_DIR = os.path.dirname(os.path.abspath(__file__))
+
+######################################################################
+# シナリオの定義
+# シナリオ名 -> (スクリプトのパス(srcからの相対パス), 説明)
+######################################################################
+SCENARIOS = {
+    "env": ("LangChain/00.py", "環境変数確認"),
+    "01": ("LangChain/01.py", "Using Language Models"),
+    "02": ("LangChain/02.py", "Prompt Templates"),
+    "03": ("LangChain/03.py", "LCEL - Using Language Models"),
+    "04": ("LangChain/04.py", "LCEL - OutputParsers"),
+    "05": ("LangChain/05.py", "LCEL - Prompt Templates"),
+    "06": ("LangChain/06.py", "LCEL - Chaining together components"),
+    "07": ("LangChain/07.py", "How to use chat models to call tools"),
+    "test": ("LangChain/test.py", "LangSmith疎通確認"),
+    "serve": ("LangChain/serve.py", "LangServeによる翻訳APIサーバー"),
+    "client": ("LangChain/client.py", "翻訳APIのクライアント(大量翻訳を含む)"),
+    "bench-serve": ("LangChain/bench_serve.py", "翻訳APIの負荷試験"),
+    "part1": ("LangGraph/part1.py", "Build a Basic Chatbot"),
+    "part2": ("LangGraph/part2.py", "Enhancing the Chatbot with Tools"),
+    "part3": ("LangGraph/part3.py", "Adding Memory to the Chatbot"),
+    "part4": ("LangGraph/part4.py", "Human-in-the-loop"),
+    "part5": ("LangGraph/part5.py", "Customizing State"),
+    "chatbot-async": ("LangGraph/chatbot_async.py", "非同期版チャットボットの同時実行"),
+    "graph-serve": ("LangGraph/graph_server.py", "チャットボットのグラフのHTTP/SSEサーバー"),
+    "import-budget": ("import_budget.py", "起動時間(インポート時間)の計測"),
+    "traces": ("local_tracing.py", "ローカルのトレースの検索・オーバーヘッドの計測"),
+}
+
+DEFAULT_SCENARIO = "serve"
+
+
+def usage() -> str:
+    lines = ["usage: python main.py [scenario] [args...]", "", "scenarios:"]
+    for name, (path, description) in SCENARIOS.items():
+        lines.append(f"  {name:<14} {path:<26} {description}")
+    return "\n".join(lines)
+
+
+######################################################################
+# シナリオの実行
+# スクリプトを直接実行した場合と同じになるように、スクリプトのディレクトリを
+# sys.pathの先頭に追加し、sys.argvを差し替えてから__main__として実行する
+######################################################################
+def run(name: str, args: list) -> None:
+    path = os.path.join(SRC_DIR, SCENARIOS[name][0])
+    if os.getenv("LOCAL_TRACING", "").lower() in ("1", "true", "yes", "on"):
+        # ワーカーのプロセスもsys.pathを引き継ぐため、serve.pyからもlocal_tracingをインポートできる
+        sys.path.insert(0, SRC_DIR)
+        import local_tracing
+
+        local_tracing.install()
+    sys.path.insert(0, os.path.dirname(path))
+    sys.argv = [path, *args]
+    runpy.run_path(path, run_name="__main__")
+
+
+def main(argv=None) -> int:
+    argv = list(sys.argv[1:] if argv is None else argv)
+    if argv and argv[0] in ("-h", "--help", "--list"):
+        print(usage())
+        return 0
+    name = argv.pop(0) if argv else os.getenv("APP_SCENARIO", DEFAULT_SCENARIO)
+    if name not in SCENARIOS:
+        print(f"unknown scenario: {name}\n", file=sys.stderr)
+        print(usage(), file=sys.stderr)
+        return 2
+    run(name, argv)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())